@@ -0,0 +1,213 @@
+"""
+Batched, cached access-control resolution against TrustAwareStorage
+
+Listing files for an account needs the owner of every file and, for files the
+account does not own, a hasFileAccess check. AccessResolver answers both with
+at most two JSON-RPC batch requests per listing. It caches the answers:
+- owners never change once a file is registered, so they are kept until evicted
+- access decisions are kept for a TTL and dropped early when the contract
+  emits FileUploaded / AccessGranted / AccessRevoked for that file
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from web3 import Web3
+
+from .indexer import EVENT_TOPICS as INDEXED_EVENT_TOPICS, file_topic, normalize_hex
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds (None = never)"""
+
+    def __init__(self, max_size: int = 100_000, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at >= time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else float("inf")
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches predicate; returns the number dropped"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+# Topics of the events that change ownership or permissions
+ACCESS_EVENTS = ("FileUploaded", "AccessGranted", "AccessRevoked")
+EVENT_TOPICS = {topic: name for topic, name in INDEXED_EVENT_TOPICS.items() if name in ACCESS_EVENTS}
+
+class AccessResolver:
+    """
+    Resolves which of a set of files an account can access
+
+    resolve() returns {file_hash: "owner" | "granted" | None}. Files that are not
+    registered on chain are left out so callers can fall back to local metadata.
+    """
+
+    def __init__(self, chain: Any, ttl: float = 30.0, max_size: int = 100_000, event_poll_interval: float = 2.0):
+        self.chain = chain
+        self.event_poll_interval = event_poll_interval
+        # file_hash => owner checksum address (or None while the file is not on chain yet)
+        self.owner_cache = TTLCache(max_size)
+        # (file_hash, account) => bool
+        self.access_cache = TTLCache(max_size, ttl)
+        self.ttl = ttl
+        self._topic_to_hash: Dict[str, str] = {}
+        self._last_block: Optional[int] = None
+        self._last_poll = 0.0
+        self._lock = asyncio.Lock()
+
+    # ---- event-driven invalidation ----
+
+    async def poll_events(self) -> None:
+        """Apply FileUploaded / AccessGranted / AccessRevoked logs emitted since the last poll"""
+        async with self._lock:
+            now = time.monotonic()
+            if now - self._last_poll < self.event_poll_interval:
+                return
+            self._last_poll = now
+            head = await self.chain.block_number()
+            if self._last_block is None:
+                # Nothing is cached yet, so history before now cannot be stale
+                self._last_block = head
+                return
+            if head <= self._last_block:
+                return
+            logs = await self.chain.get_logs({
+                "address": self.chain.contract_address,
+                "fromBlock": self._last_block + 1,
+                "toBlock": head,
+                "topics": [list(EVENT_TOPICS)]
+            })
+            self._last_block = head
+
+        for log in logs:
+            self.apply_log(log)
+
+    def apply_log(self, log: Dict[str, Any]) -> None:
+        """Invalidate cache entries affected by one contract log"""
+        topics = [normalize_hex(topic) for topic in log["topics"]]
+        event = EVENT_TOPICS.get(topics[0])
+        file_hash = self._topic_to_hash.get(topics[1]) if len(topics) > 1 else None
+        if event is None or file_hash is None:
+            # Files we have never resolved have nothing cached
+            return
+
+        if event == "FileUploaded":
+            self.owner_cache.delete(file_hash)
+            self.access_cache.delete_where(lambda key: key[0] == file_hash)
+        else:
+            account = Web3.to_checksum_address("0x" + topics[3][-40:])
+            self.access_cache.delete((file_hash, account))
+
+    def invalidate_file(self, file_hash: str) -> None:
+        """Drop everything cached for a file (e.g. after it is deleted locally)"""
+        self.owner_cache.delete(file_hash)
+        self.access_cache.delete_where(lambda key: key[0] == file_hash)
+
+    # ---- batched lookups ----
+
+    async def _owners(self, file_hashes: List[str]) -> Dict[str, Optional[str]]:
+        owners: Dict[str, Optional[str]] = {}
+        missing = []
+        for file_hash in file_hashes:
+            owner = self.owner_cache.get(file_hash, _MISSING)
+            if owner is _MISSING:
+                missing.append(file_hash)
+            else:
+                owners[file_hash] = owner
+
+        # files() is the public getter; unlike getFileMetadata it does not revert for unknown files
+        results = await self.chain.batch_call([("files", (file_hash,)) for file_hash in missing])
+        for file_hash, result in zip(missing, results):
+            self._topic_to_hash[file_topic(file_hash)] = file_hash
+            if isinstance(result, Exception):
+                print(f"⚠️ Error checking blockchain owner for {file_hash}: {result}")
+                continue
+            exists = bool(result[5])
+            owner = Web3.to_checksum_address(result[1]) if exists else None
+            # Unregistered files can be registered later, so only remember that briefly
+            self.owner_cache.set(file_hash, owner, None if exists else self.ttl)
+            owners[file_hash] = owner
+        return owners
+
+    async def resolve(self, account: str, file_hashes: List[str]) -> Dict[str, Optional[str]]:
+        await self.poll_events()
+        account = Web3.to_checksum_address(account)
+        decisions: Dict[str, Optional[str]] = {}
+        to_check = []
+
+        for file_hash, owner in (await self._owners(file_hashes)).items():
+            if owner is None:
+                continue
+            if owner == account:
+                decisions[file_hash] = "owner"
+                continue
+            granted = self.access_cache.get((file_hash, account), _MISSING)
+            if granted is _MISSING:
+                to_check.append(file_hash)
+            else:
+                decisions[file_hash] = "granted" if granted else None
+
+        results = await self.chain.batch_call([("hasFileAccess", (file_hash, account)) for file_hash in to_check])
+        for file_hash, result in zip(to_check, results):
+            if isinstance(result, Exception):
+                print(f"⚠️ Error checking blockchain access for {file_hash}: {result}")
+                continue
+            granted = bool(result)
+            self.access_cache.set((file_hash, account), granted)
+            decisions[file_hash] = "granted" if granted else None
+
+        return decisions
+
+    def stats(self) -> Dict[str, Any]:
+        return {"owners": self.owner_cache.stats(), "access": self.access_cache.stats()}
@@ -0,0 +1,117 @@
+"""
+Byte-capped cache of verified plaintext fragments
+
+Retrieving a popular file decrypts and re-hashes the same fragments on every
+request. FragmentCache keeps verified plaintext keyed by its SHA-256 (the
+fragment's original_hash), so repeat reads of hot fragments skip the crypto
+pool, and files sharing deduplicated fragments share entries too.
+
+Eviction is segmented LRU: new entries go to a probation segment and move to
+the protected segment (at most `protected_ratio` of the capacity) when they are
+read again. Streaming one large file once therefore only churns probation and
+cannot flush the hot set the way a plain LRU would.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+class FragmentCache:
+    """Segmented LRU of plaintext fragments, capped at max_bytes (0 disables it)"""
+
+    def __init__(self, max_bytes: int, protected_ratio: float = 0.8):
+        self.max_bytes = max_bytes
+        self.protected_bytes_max = int(max_bytes * protected_ratio)
+        self._probation: "OrderedDict[str, bytes]" = OrderedDict()
+        self._protected: "OrderedDict[str, bytes]" = OrderedDict()
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: Optional[str]) -> Optional[bytes]:
+        if not self.enabled or key is None:
+            return None
+        chunk = self._protected.get(key)
+        if chunk is not None:
+            self._protected.move_to_end(key)
+            self.hits += 1
+            return chunk
+        chunk = self._probation.pop(key, None)
+        if chunk is None:
+            self.misses += 1
+            return None
+        # Second hit: promote, demoting the protected segment's coldest entries to probation
+        self._probation_bytes -= len(chunk)
+        self._protected[key] = chunk
+        self._protected_bytes += len(chunk)
+        while self._protected_bytes > self.protected_bytes_max and len(self._protected) > 1:
+            demoted_key, demoted = self._protected.popitem(last=False)
+            self._protected_bytes -= len(demoted)
+            self._probation[demoted_key] = demoted
+            self._probation_bytes += len(demoted)
+        self._evict()
+        self.hits += 1
+        return chunk
+
+    def get_many(self, keys: List[Optional[str]]) -> Optional[List[bytes]]:
+        """All of the entries, or None (counting the absent ones as misses) unless every one is cached"""
+        if not self.enabled:
+            return None
+        absent = sum(1 for key in keys if key is None or (key not in self._protected and key not in self._probation))
+        if absent:
+            self.misses += absent
+            return None
+        return [self.get(key) for key in keys]
+
+    def put(self, key: Optional[str], chunk: bytes) -> None:
+        """Cache a fragment's plaintext; only call with data verified against key"""
+        if not self.enabled or key is None or len(chunk) > self.max_bytes - self.protected_bytes_max:
+            return
+        if key in self._protected or key in self._probation:
+            return
+        chunk = bytes(chunk)
+        self._probation[key] = chunk
+        self._probation_bytes += len(chunk)
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._probation_bytes + self._protected_bytes > self.max_bytes and self._probation:
+            _, chunk = self._probation.popitem(last=False)
+            self._probation_bytes -= len(chunk)
+            self.evictions += 1
+
+    def discard(self, keys: Iterable[str]) -> None:
+        """Drop entries (a deleted file's fragments)"""
+        for key in keys:
+            chunk = self._probation.pop(key, None)
+            if chunk is not None:
+                self._probation_bytes -= len(chunk)
+                self.invalidations += 1
+                continue
+            chunk = self._protected.pop(key, None)
+            if chunk is not None:
+                self._protected_bytes -= len(chunk)
+                self.invalidations += 1
+
+    def __len__(self) -> int:
+        return len(self._probation) + len(self._protected)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "max_bytes": self.max_bytes,
+            "bytes": self._probation_bytes + self._protected_bytes,
+            "entries": len(self),
+            "protected_entries": len(self._protected),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
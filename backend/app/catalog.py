@@ -0,0 +1,231 @@
+"""
+Secondary indexes over the file catalog
+
+CatalogIndex keeps, next to uploaded_files, the lookups GET /files needs so a
+listing costs O(results) instead of a walk over every file:
+- files by the owner recorded at upload
+- files by the keccak topic their hash is indexed under in contract events,
+  to turn ChainIndex rows (owned and granted files of an account) into hashes
+- files sorted by upload timestamp and by case-folded filename, so a page of
+  the whole catalog or a filename prefix range is found by bisection
+
+Pages are addressed by a cursor holding the sort key of the last file returned,
+so they stay stable while files are added or deleted between requests.
+
+StripeIndex maps each stored payload to the erasure stripes that hold it, so the
+scrubber finds what it needs to rebuild a damaged payload without a catalog walk.
+"""
+import base64
+import binascii
+import json
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from .fragments import FragmentTable
+from .indexer import file_topic
+
+# Sort orders for listings, by the metadata field they sort on
+SORT_FIELDS = ("upload_time", "filename")
+
+SortKey = Tuple[str, str]  # (sort value, file hash); the hash breaks ties
+
+class CatalogIndex:
+    """Owner, event topic, upload time and filename indexes of the file catalog"""
+
+    def __init__(self):
+        # Lowercase owner address => file hashes
+        self.by_owner: Dict[str, Set[str]] = {}
+        # Event topic => file hash, built on first use (hashing every file costs startup time)
+        self._by_topic: Optional[Dict[str, str]] = None
+        # Sorted (sort value, file hash) per sort field
+        self._sorted: Dict[str, List[SortKey]] = {field: [] for field in SORT_FIELDS}
+        # file hash => sort values in SORT_FIELDS order, to find a file's entries on removal
+        self._keys: Dict[str, Tuple[str, ...]] = {}
+        self._owners: Dict[str, str] = {}
+
+    @staticmethod
+    def sort_values(metadata: Dict[str, Any]) -> Tuple[str, ...]:
+        return metadata["upload_timestamp"], metadata["original_filename"].casefold()
+
+    @staticmethod
+    def owner_key(owner: Optional[str]) -> str:
+        return (owner or "").lower()
+
+    @classmethod
+    def build(cls, catalog: Dict[str, Dict[str, Any]]) -> "CatalogIndex":
+        """Index a loaded catalog, sorting each index once"""
+        index = cls()
+        for file_hash, metadata in catalog.items():
+            values = index._keys[file_hash] = cls.sort_values(metadata)
+            owner = index._owners[file_hash] = cls.owner_key(metadata.get("owner"))
+            index.by_owner.setdefault(owner, set()).add(file_hash)
+            for field, value in zip(SORT_FIELDS, values):
+                index._sorted[field].append((value, file_hash))
+        for entries in index._sorted.values():
+            entries.sort()
+        return index
+
+    def add(self, file_hash: str, metadata: Dict[str, Any]) -> None:
+        self.remove(file_hash)
+        values = self._keys[file_hash] = self.sort_values(metadata)
+        owner = self._owners[file_hash] = self.owner_key(metadata.get("owner"))
+        self.by_owner.setdefault(owner, set()).add(file_hash)
+        for field, value in zip(SORT_FIELDS, values):
+            # New uploads have the latest timestamp, so the time index grows at the end
+            insort(self._sorted[field], (value, file_hash))
+        if self._by_topic is not None:
+            self._by_topic[file_topic(file_hash)] = file_hash
+
+    def remove(self, file_hash: str) -> None:
+        values = self._keys.pop(file_hash, None)
+        if values is None:
+            return
+        owner = self._owners.pop(file_hash)
+        owned = self.by_owner.get(owner)
+        if owned is not None:
+            owned.discard(file_hash)
+            if not owned:
+                del self.by_owner[owner]
+        for field, value in zip(SORT_FIELDS, values):
+            entries = self._sorted[field]
+            position = bisect_left(entries, (value, file_hash))
+            if position < len(entries) and entries[position][1] == file_hash:
+                del entries[position]
+        if self._by_topic is not None:
+            self._by_topic.pop(file_topic(file_hash), None)
+
+    def __contains__(self, file_hash: str) -> bool:
+        return file_hash in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def owned_by(self, owner: str) -> Set[str]:
+        """Files whose recorded owner is `owner` (any address case)"""
+        return self.by_owner.get(self.owner_key(owner), set())
+
+    def by_topic(self, topic: str) -> Optional[str]:
+        if self._by_topic is None:
+            self._by_topic = {file_topic(file_hash): file_hash for file_hash in self._keys}
+        return self._by_topic.get(topic)
+
+    # ---- pages ----
+
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        entries = self._sorted["filename"]
+        prefix = prefix.casefold()
+        # Every string starting with prefix sorts between (prefix, "") and (prefix + U+10FFFF, "")
+        return bisect_left(entries, (prefix, "")), bisect_left(entries, (prefix + "\U0010ffff", ""))
+
+    def page(self, sort: str = "upload_time", descending: bool = False, after: Optional[SortKey] = None,
+             limit: Optional[int] = None, prefix: Optional[str] = None,
+             candidates: Optional[Iterable[str]] = None) -> Tuple[List[str], int, Optional[SortKey]]:
+        """
+        One page of file hashes in sort order: (hashes, total matching files, key
+        of the last file if more follow). `candidates` restricts the listing to
+        those files (an account's files); otherwise the whole catalog is paged
+        straight from the sorted index.
+        """
+        field = SORT_FIELDS.index(sort)
+        if candidates is None and prefix and sort != "filename":
+            # A prefix range of the name index, re-sorted by the requested field
+            low, high = self._prefix_range(prefix)
+            candidates = [file_hash for _, file_hash in self._sorted["filename"][low:high]]
+            prefix = None
+
+        if candidates is None:
+            entries = self._sorted[sort]
+            low, high = self._prefix_range(prefix) if prefix else (0, len(entries))
+            total = high - low
+        else:
+            folded = prefix.casefold() if prefix else None
+            entries = sorted(
+                (self._keys[file_hash][field], file_hash) for file_hash in candidates
+                if file_hash in self._keys and (folded is None or self._keys[file_hash][1].startswith(folded))
+            )
+            low, high = 0, len(entries)
+            total = high
+
+        if descending:
+            if after is not None:
+                high = bisect_left(entries, after, low, high)
+            start = max(low, high - limit) if limit is not None else low
+            selected = entries[start:high][::-1]
+            more = start > low
+        else:
+            if after is not None:
+                low = bisect_right(entries, after, low, high)
+            end = min(high, low + limit) if limit is not None else high
+            selected = entries[low:end]
+            more = end < high
+        return [file_hash for _, file_hash in selected], total, (selected[-1] if more and selected else None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"files": len(self._keys), "owners": len(self.by_owner), "topics_indexed": self._by_topic is not None}
+
+StripeRef = Tuple[str, int]  # (file hash, stripe)
+
+class StripeIndex:
+    """Erasure stripes by payload: storage key => every (file hash, stripe) holding it"""
+
+    def __init__(self):
+        # Payload digest => one StripeRef, or a list of them for a payload several stripes share
+        self._stripes: Dict[bytes, Union[StripeRef, List[StripeRef]]] = {}
+        self.entries = 0
+
+    @classmethod
+    def build(cls, tables: Dict[str, FragmentTable]) -> "StripeIndex":
+        index = cls()
+        for file_hash, fragments in tables.items():
+            index.add(file_hash, fragments)
+        return index
+
+    def add(self, file_hash: str, fragments: FragmentTable) -> None:
+        """Index a file's erasure-coded payloads (a file without parity adds nothing)"""
+        for digest, stripe in fragments.stripe_payloads():
+            ref = (file_hash, stripe)
+            held = self._stripes.get(digest)
+            if held is None:
+                self._stripes[digest] = ref
+            elif isinstance(held, list):
+                held.append(ref)
+            else:
+                self._stripes[digest] = [held, ref]
+            self.entries += 1
+
+    def remove(self, file_hash: str, fragments: FragmentTable) -> None:
+        for digest, stripe in fragments.stripe_payloads():
+            ref = (file_hash, stripe)
+            held = self._stripes.get(digest)
+            if held == ref:
+                del self._stripes[digest]
+            elif isinstance(held, list) and ref in held:
+                held.remove(ref)
+                if len(held) == 1:
+                    self._stripes[digest] = held[0]
+            else:
+                continue
+            self.entries -= 1
+
+    def stripes(self, storage_key: str) -> List[StripeRef]:
+        """Every (file hash, stripe) whose stripe includes the payload"""
+        held = self._stripes.get(bytes.fromhex(storage_key))
+        if held is None:
+            return []
+        return list(held) if isinstance(held, list) else [held]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"payloads": len(self._stripes), "stripe_entries": self.entries}
+
+def encode_cursor(sort: str, key: SortKey) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, key[0], key[1]]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str, sort: str) -> SortKey:
+    """Sort key a cursor points after; ValueError if it is malformed or was issued for another sort"""
+    try:
+        cursor_sort, value, file_hash = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, binascii.Error, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if cursor_sort != sort or not isinstance(value, str) or not isinstance(file_hash, str):
+        raise ValueError("Cursor was issued for a different sort order")
+    return value, file_hash
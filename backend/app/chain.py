@@ -0,0 +1,145 @@
+"""
+Async client for the TrustAwareStorage contract
+
+ChainClient wraps AsyncWeb3 over a single pooled keep-alive aiohttp session.
+It connects lazily when the app starts and never blocks startup on a slow or
+down RPC. Connection health is checked in the background and cached, so
+handlers read `available` instead of calling is_connected() per request.
+Every RPC round trip is reported to `observer` as (method, seconds, calls),
+where method is the contract function or eth_* method name.
+"""
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+from web3 import AsyncWeb3
+from web3.providers.rpc import AsyncHTTPProvider
+
+class ChainClient:
+    """Pooled AsyncWeb3 connection plus the contract instance"""
+
+    def __init__(self, rpc_url: str, contract_address: str, abi: List[Dict[str, Any]],
+                 pool_size: int = 32, request_timeout: float = 10.0, health_interval: float = 5.0,
+                 max_batch: int = 500, observer: Optional[Callable[[str, float, int], None]] = None):
+        self.rpc_url = rpc_url
+        self.contract_address = contract_address
+        self.abi = abi
+        self.pool_size = pool_size
+        self.request_timeout = request_timeout
+        self.health_interval = health_interval
+        self.max_batch = max_batch
+        self.observer = observer
+        self.w3: Optional[AsyncWeb3] = None
+        self.contract: Any = None
+        self.connected = False
+        self._health_task: Optional[asyncio.Task] = None
+
+    @property
+    def available(self) -> bool:
+        """True when the contract is set up and the last health check succeeded"""
+        return self.contract is not None and self.connected
+
+    # ---- lifecycle ----
+
+    async def start(self) -> None:
+        """Create the pooled session and start background health checks (no network I/O here)"""
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+        )
+        provider = AsyncHTTPProvider(self.rpc_url)
+        await provider.cache_async_session(session)
+        self.w3 = AsyncWeb3(provider)
+        self.contract = self.w3.eth.contract(address=self.contract_address, abi=self.abi)
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        if self.w3 is not None:
+            await self.w3.provider.disconnect()
+        self.w3 = None
+        self.contract = None
+        self.connected = False
+
+    async def check_health(self) -> bool:
+        try:
+            connected = bool(await asyncio.wait_for(self.w3.is_connected(), self.request_timeout))
+        except Exception:
+            connected = False
+        if connected != self.connected:
+            if connected:
+                print("✅ Connected to blockchain at", self.rpc_url)
+            else:
+                print("⚠️ Warning: Could not connect to blockchain")
+        self.connected = connected
+        return connected
+
+    async def _health_loop(self) -> None:
+        while True:
+            await self.check_health()
+            await asyncio.sleep(self.health_interval)
+
+    async def _timed(self, method: str, request: Awaitable[Any]) -> Any:
+        if self.observer is None:
+            return await request
+        started = time.perf_counter()
+        try:
+            return await request
+        finally:
+            self.observer(method, time.perf_counter() - started, 1)
+
+    # ---- contract calls ----
+
+    async def call(self, function_name: str, *args: Any) -> Any:
+        """Call a view function of the contract"""
+        return await self._timed(function_name, getattr(self.contract.functions, function_name)(*args).call())
+
+    async def batch_call(self, calls: List[Tuple[str, Tuple[Any, ...]]]) -> List[Any]:
+        """
+        Run (function_name, args) view calls as JSON-RPC batches of at most max_batch
+        If the provider rejects batching the calls are made concurrently instead,
+        and failed calls come back as Exception instances in their slot
+        """
+        if not calls:
+            return []
+        try:
+            results: List[Any] = []
+            for start in range(0, len(calls), self.max_batch):
+                chunk = calls[start:start + self.max_batch]
+                started = time.perf_counter()
+                async with self.w3.batch_requests() as batch:
+                    for function_name, args in chunk:
+                        batch.add(getattr(self.contract.functions, function_name)(*args))
+                    results.extend(await batch.async_execute())
+                if self.observer is not None:
+                    # One round trip carried them all, so each function is charged its duration once
+                    elapsed = time.perf_counter() - started
+                    for function_name, count in Counter(name for name, _ in chunk).items():
+                        self.observer(function_name, elapsed, count)
+            return results
+        except Exception as e:
+            print(f"⚠️ Batch request failed, falling back to individual calls: {e}")
+
+        return list(await asyncio.gather(
+            *(self.call(function_name, *args) for function_name, args in calls),
+            return_exceptions=True
+        ))
+
+    # ---- chain data ----
+
+    async def block_number(self) -> int:
+        return await self._timed("eth_blockNumber", self.w3.eth.block_number)
+
+    async def get_block(self, block_number: int) -> Any:
+        return await self._timed("eth_getBlockByNumber", self.w3.eth.get_block(block_number))
+
+    async def get_logs(self, filter_params: Dict[str, Any]) -> List[Any]:
+        return await self._timed("eth_getLogs", self.w3.eth.get_logs(filter_params))
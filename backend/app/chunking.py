@@ -0,0 +1,98 @@
+"""
+Content-defined chunking (FastCDC style)
+
+Chunk boundaries are placed where a rolling gear hash of the last 32 bytes
+matches a mask, so they move with the content instead of sitting at fixed
+offsets: inserting a byte only changes the chunks around the edit and later
+chunks keep their hashes (and deduplicate).
+
+The gear hash at byte i is sum(GEAR[b[i - j]] << j for j < 32) mod 2^32. It is
+computed for a whole buffer with NumPy in five shift-and-add passes (each pass
+doubles the number of bytes folded in) over cache-sized blocks, and normalized
+chunking uses a stricter mask before the average size and a looser one after it.
+"""
+import hashlib
+from typing import List
+
+import numpy as np
+
+WINDOW = 32
+
+# Fixed pseudo-random gear table, so boundaries are stable across processes and restarts
+GEAR = np.array(
+    [int.from_bytes(hashlib.sha256(bytes([value])).digest()[:4], "little") for value in range(256)],
+    dtype=np.uint32
+)
+
+# Bytes hashed per block; small blocks keep the shift-and-add passes in cache
+BLOCK_SIZE = 64 * 1024
+
+def gear_hashes(buffer: bytes) -> np.ndarray:
+    """Rolling gear hash at every position of buffer (bytes before the buffer count as absent)"""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    hashes = np.empty(len(data), dtype=np.uint32)
+    for start in range(0, len(data), BLOCK_SIZE):
+        # Each block is hashed with the preceding WINDOW - 1 bytes as context
+        context = min(start, WINDOW - 1)
+        h = GEAR.take(data[start - context:start + BLOCK_SIZE])
+        span = 1
+        while span < WINDOW:
+            h[span:] += h[:-span] << np.uint32(span)
+            span *= 2
+        hashes[start:start + BLOCK_SIZE] = h[context:]
+    return hashes
+
+def _top_bits_mask(bits: int) -> int:
+    # The high bits of the hash depend on the most bytes of the window
+    return ((1 << bits) - 1) << (WINDOW - bits)
+
+class CDCChunker:
+    """Splits a byte stream into chunks of min_size..max_size averaging about avg_size"""
+
+    def __init__(self, avg_size: int = 64 * 1024):
+        bits = max(avg_size.bit_length() - 1, 6)
+        self.avg_size = 1 << bits
+        self.min_size = self.avg_size // 4
+        self.max_size = self.avg_size * 4
+        self.mask_small = np.uint32(_top_bits_mask(min(bits + 2, WINDOW)))
+        self.mask_large = np.uint32(_top_bits_mask(bits - 2))
+
+    def split(self, buffer: bytes, final: bool = False) -> List[int]:
+        """
+        Lengths of the chunks at the start of buffer whose boundaries are settled
+        Unless final is set, bytes after the last settled boundary are left for
+        the caller to extend with more data.
+        """
+        length = len(buffer)
+        if length == 0 or (length < self.max_size and not final):
+            return []
+
+        hashes = gear_hashes(buffer)
+        # The small mask's bits include the large mask's, so its matches are a subset
+        large = np.flatnonzero((hashes & self.mask_large) == 0)
+        small = large[(hashes[large] & self.mask_small) == 0]
+
+        lengths = []
+        start = 0
+        while length - start >= self.max_size or (final and start < length):
+            end = min(start + self.max_size, length)
+            if end - start <= self.min_size:
+                cut = end
+            else:
+                normal = min(start + self.avg_size, end)
+                cut = self._first(small, start + self.min_size, normal)
+                if cut is None:
+                    cut = self._first(large, normal, end)
+                if cut is None:
+                    cut = end
+            lengths.append(cut - start)
+            start = cut
+        return lengths
+
+    @staticmethod
+    def _first(candidates: np.ndarray, low: int, high: int):
+        """First boundary in [low, high]; a match at index i cuts after byte i"""
+        index = np.searchsorted(candidates, low - 1)
+        if index < len(candidates) and candidates[index] < high:
+            return int(candidates[index]) + 1
+        return None
@@ -0,0 +1,139 @@
+"""
+Fragment cipher engines
+
+Fragments are sealed with an AEAD cipher under the data key of the upload
+that wrote them (see keys.py) and stored as raw binary:
+
+    version (1 byte) | key id (8 bytes) | nonce (12 bytes) | ciphertext + 16-byte tag
+
+version 3 is AES-256-GCM and version 4 is ChaCha20-Poly1305, each with a
+fresh random nonce per fragment. The key id lets any process find the data
+key without consulting the catalog, so deduplicated payloads shared by files
+with different keys still open.
+
+Older formats are still read with the cipher's base key: versions 1 and 2
+(the same AEADs without a key id, keyed by HKDF of the base key) and Fernet
+tokens, which always start with "g" and so never with a version byte.
+"""
+import os
+from collections import OrderedDict
+from typing import Any, Optional, Tuple, Union
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+AES_GCM = 1
+CHACHA20_POLY1305 = 2
+# Enveloped formats: the same AEADs under a data key named in the header
+ENVELOPE_AES_GCM = 3
+ENVELOPE_CHACHA20_POLY1305 = 4
+
+ENGINES = {"aes-gcm": ENVELOPE_AES_GCM, "chacha20": ENVELOPE_CHACHA20_POLY1305, "fernet": None}
+_AEADS = {AES_GCM: AESGCM, CHACHA20_POLY1305: ChaCha20Poly1305,
+          ENVELOPE_AES_GCM: AESGCM, ENVELOPE_CHACHA20_POLY1305: ChaCha20Poly1305}
+
+KEY_ID_SIZE = 8
+NONCE_SIZE = 12
+TAG_SIZE = 16
+OVERHEAD = 1 + NONCE_SIZE + TAG_SIZE
+
+def derive_aead_key(key: bytes) -> bytes:
+    """32-byte AEAD key derived from a Fernet key"""
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"chainvault-fragment-aead").derive(key)
+
+def payload_key_id(payload: Union[bytes, bytearray, memoryview]) -> Optional[str]:
+    """Data key id named by an enveloped payload (None for formats that use the base key)"""
+    if len(payload) > 1 + KEY_ID_SIZE and payload[0] in (ENVELOPE_AES_GCM, ENVELOPE_CHACHA20_POLY1305):
+        return bytes(payload[1:1 + KEY_ID_SIZE]).hex()
+    return None
+
+class FragmentCipher:
+    """Encrypts with the configured engine, decrypts every supported format"""
+
+    # Data keys whose AEAD objects are kept ready
+    CACHED_KEYS = 64
+
+    def __init__(self, key: bytes, engine: str = "aes-gcm"):
+        """key is the base key (Fernet key format) for the formats without a key id"""
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown cipher engine {engine!r} (expected one of {', '.join(ENGINES)})")
+        self.engine = engine
+        self._version = ENGINES[engine]
+        self._fernet = Fernet(key)
+        aead_key = derive_aead_key(key)
+        self._base_aeads = {AES_GCM: AESGCM(aead_key), CHACHA20_POLY1305: ChaCha20Poly1305(aead_key)}
+        # (version, data key) => AEAD, least recently used first
+        self._data_aeads: "OrderedDict[Tuple[int, bytes], Any]" = OrderedDict()
+
+    def _data_aead(self, version: int, data_key: bytes) -> Any:
+        cache_key = (version, data_key)
+        aead = self._data_aeads.get(cache_key)
+        if aead is None:
+            aead = self._data_aeads[cache_key] = _AEADS[version](data_key)
+            if len(self._data_aeads) > self.CACHED_KEYS:
+                self._data_aeads.popitem(last=False)
+        else:
+            self._data_aeads.move_to_end(cache_key)
+        return aead
+
+    def encrypt(self, data: bytes, data_key: Optional[Tuple[str, bytes]] = None) -> bytes:
+        """
+        Seal data under data_key ((key id, key)); without one the AEAD engines use
+        the base key format
+        """
+        if self._version is None:
+            return self._fernet.encrypt(data)
+        nonce = os.urandom(NONCE_SIZE)
+        if data_key is None:
+            version = self._version - 2
+            return bytes((version,)) + nonce + self._base_aeads[version].encrypt(nonce, data, None)
+        key_id, key = data_key
+        # The header is authenticated, so a payload cannot be relabelled with another key id
+        header = bytes((self._version,)) + bytes.fromhex(key_id)
+        return header + nonce + self._data_aead(self._version, key).encrypt(nonce, data, header)
+
+    def decrypt(self, payload: Union[bytes, bytearray, memoryview], data_key: Optional[bytes] = None) -> bytes:
+        """
+        Open any supported payload; enveloped payloads need the data key named by
+        payload_key_id(). Raises InvalidToken if it fails authentication.
+        """
+        view = memoryview(payload)
+        version = view[0] if len(view) else None
+        try:
+            if version in (ENVELOPE_AES_GCM, ENVELOPE_CHACHA20_POLY1305):
+                body = 1 + KEY_ID_SIZE
+                if data_key is None or len(view) < body + NONCE_SIZE + TAG_SIZE:
+                    raise InvalidToken
+                # Slices of the view, so a payload mapped from a segment file is not copied first
+                return self._data_aead(version, data_key).decrypt(view[body:body + NONCE_SIZE],
+                                                                  view[body + NONCE_SIZE:], view[:body])
+            if version in self._base_aeads:
+                if len(view) < OVERHEAD:
+                    raise InvalidToken
+                return self._base_aeads[version].decrypt(view[1:1 + NONCE_SIZE], view[1 + NONCE_SIZE:], None)
+        except InvalidToken:
+            raise
+        except Exception:
+            # Same error type for every format, so callers need not know which one failed
+            raise InvalidToken
+        return self._fernet.decrypt(bytes(view))
+
+    def authenticate(self, payload: Union[bytes, bytearray, memoryview], data_key: Optional[bytes] = None) -> bool:
+        """
+        Whether a payload passes authentication (as decrypt would); unlike decrypt it
+        leaves the AEAD cache alone, so several threads may call it at once
+        """
+        view = memoryview(payload)
+        try:
+            if len(view) and view[0] in (ENVELOPE_AES_GCM, ENVELOPE_CHACHA20_POLY1305):
+                body = 1 + KEY_ID_SIZE
+                if data_key is None or len(view) < body + NONCE_SIZE + TAG_SIZE:
+                    return False
+                _AEADS[view[0]](data_key).decrypt(view[body:body + NONCE_SIZE], view[body + NONCE_SIZE:], view[:body])
+            else:
+                self.decrypt(view)
+        except Exception:
+            return False
+        return True
@@ -0,0 +1,79 @@
+"""
+Fragment compression codecs
+
+Chunks are compressed before they are encrypted (ciphertext does not
+compress). zlib is always available; zstd and lz4 are used when the
+`zstandard` / `lz4` packages are installed. A chunk is only stored compressed
+when that saves at least MIN_SAVING of its size, and a small sample is tried
+first so incompressible data (media, archives, random bytes) costs one cheap
+probe instead of a full compression pass.
+"""
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Codec column values in fragment tables; never renumber
+CODEC_IDS = {"zlib": 1, "zstd": 2, "lz4": 3}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+
+# Preference order for "auto"
+AUTO_ORDER = ("zstd", "lz4", "zlib")
+
+SAMPLE_SIZE = 4096
+MIN_CHUNK_SIZE = 256
+MIN_SAVING = 0.1
+
+CODECS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress)
+}
+if zstandard is not None:
+    CODECS["zstd"] = (
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data)
+    )
+if lz4_frame is not None:
+    CODECS["lz4"] = (lz4_frame.compress, lz4_frame.decompress)
+
+def resolve_codec(name: str) -> Optional[str]:
+    """Codec for a CHAINVAULT_COMPRESSION setting: "auto", "none" or a codec name"""
+    name = (name or "none").lower()
+    if name == "none":
+        return None
+    if name == "auto":
+        return next(codec for codec in AUTO_ORDER if codec in CODECS)
+    if name not in CODECS:
+        raise ValueError(f"Compression codec {name!r} is not available (available: {', '.join(CODECS)})")
+    return name
+
+def compress_chunk(chunk: bytes, codec: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """(payload, codec used): the chunk compressed with codec, or unchanged when that does not pay off"""
+    if codec is None or len(chunk) < MIN_CHUNK_SIZE:
+        return chunk, None
+    compress = CODECS[codec][0]
+    if len(chunk) > 2 * SAMPLE_SIZE:
+        # Probe the middle of the chunk; headers are often more compressible than the body
+        middle = len(chunk) // 2
+        sample = chunk[middle - SAMPLE_SIZE // 2:middle + SAMPLE_SIZE // 2]
+        if len(compress(sample)) > len(sample) * (1 - MIN_SAVING):
+            return chunk, None
+    compressed = compress(chunk)
+    if len(compressed) > len(chunk) * (1 - MIN_SAVING):
+        return chunk, None
+    return compressed, codec
+
+def decompress_chunk(payload: bytes, codec: Optional[str]) -> bytes:
+    """Reverse compress_chunk"""
+    if codec is None:
+        return payload
+    if codec not in CODECS:
+        raise ValueError(f"Fragment is compressed with {codec}, which is not installed")
+    return CODECS[codec][1](payload)
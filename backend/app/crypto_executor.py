@@ -0,0 +1,407 @@
+"""
+Parallel crypto executor for fragment encryption and decryption
+
+Fragment jobs are grouped into batches and run on a thread or process pool,
+so large files are hashed and encrypted on every core while the event loop
+keeps serving other requests. Results always come back in submission order.
+
+Batches run through the pool also time each stage of every fragment (hash,
+compress, encrypt, decrypt, ...); the timings travel back with the results and
+are handed to the executor's observer and to the caller's StageTimer, if any.
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional, Tuple, Union
+
+from .ciphers import FragmentCipher
+from .compression import CODECS, compress_chunk, decompress_chunk
+from .erasure import get_codec
+from .metrics import StageTimer
+
+# Cipher and compression codec used by the batch functions below. They are set in
+# the API process and, for process pools, once per worker through the pool initializer.
+_cipher: Optional[FragmentCipher] = None
+_compression: Optional[str] = None
+# Per-thread {stage: [seconds per fragment]} of the batch being timed (see run_timed)
+_timing = threading.local()
+
+def _record(stage: str, started: float) -> float:
+    """Add the time since started to stage when a batch is being timed; returns now"""
+    now = time.perf_counter()
+    times = getattr(_timing, "times", None)
+    if times is not None:
+        times.setdefault(stage, []).append(now - started)
+    return now
+
+def run_timed(fn: Callable[[List[Any]], List[Any]], batch: List[Any]) -> Tuple[List[Any], Dict[str, List[float]]]:
+    """Run a batch function, returning (results, {stage: [seconds per fragment]})"""
+    _timing.times = {}
+    try:
+        return fn(batch), _timing.times
+    finally:
+        _timing.times = None
+
+def set_worker_key(key: bytes, engine: str = "aes-gcm") -> None:
+    """Install the fragment encryption key and cipher engine for batch functions in this process"""
+    global _cipher
+    _cipher = FragmentCipher(key, engine)
+
+def init_worker(key: bytes, compression: Optional[str] = None, engine: str = "aes-gcm") -> None:
+    """Install the encryption key, cipher engine and compression codec for batch functions in this process"""
+    global _compression
+    set_worker_key(key, engine)
+    _compression = compression
+
+def build_fragment(chunk: bytes, fragment_id: int, position: int, stored: bool = False,
+                   data_key: Optional[Tuple[str, bytes]] = None) -> Dict[str, Any]:
+    """
+    Hash, compress (when it pays off) and encrypt a single chunk into a fragment record
+    stored=True means the payload is already in the fragment store, so the
+    chunk is only hashed and the record has no "data"; data_key is the
+    upload's (key id, data key)
+    """
+    started = time.perf_counter()
+    fragment_hash = hashlib.sha256(chunk).hexdigest()
+    started = _record("hash", started)
+    record = {
+        "fragment_id": fragment_id,
+        "fragment_hash": fragment_hash,
+        "size": len(chunk),
+        "position": position,
+        "original_hash": fragment_hash  # Store original hash of unencrypted data
+    }
+    if not stored:
+        payload, codec = compress_chunk(chunk, _compression)
+        started = _record("compress", started)
+        record["data"] = _cipher.encrypt(payload, data_key)  # Raw ciphertext, written to the fragment store as-is
+        _record("encrypt", started)
+        if codec is not None:
+            record["codec"] = codec
+    return record
+
+def decrypt_data(data: Union[bytes, str], fragment_id: Any = None, data_key: Optional[bytes] = None) -> bytes:
+    """
+    Decrypt fragment data
+    bytes are payloads read from the fragment store (AEAD or Fernet), opened with
+    data_key when the payload names one; str is the legacy inline base64 form,
+    which may also be unencrypted
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return _cipher.decrypt(data, data_key)
+
+    try:
+        # Try new format: individually encrypted fragments
+        return _cipher.decrypt(base64.b64decode(data.encode('utf-8')))
+    except Exception as decrypt_error:
+        # Fallback to old format: just base64 encoded (no encryption at fragment level)
+        try:
+            return base64.b64decode(data.encode('utf-8'))
+        except Exception as decode_error:
+            print(f"Error processing fragment {fragment_id}: decrypt={decrypt_error}, decode={decode_error}")
+            raise
+
+def encrypt_batch(jobs: List[Tuple[int, int, bytes, bool]], data_key: Optional[Tuple[str, bytes]] = None) -> List[Dict[str, Any]]:
+    """Build fragment records for a batch of (fragment_id, position, chunk, stored) jobs"""
+    return [build_fragment(chunk, fragment_id, position, stored, data_key)
+            for fragment_id, position, chunk, stored in jobs]
+
+def decrypt_batch(jobs: List[Tuple[Any, Union[bytes, str], Optional[str], Optional[str], Optional[bytes]]]) -> List[bytes]:
+    """
+    Decrypt (and decompress) a batch of (fragment_id, data, original_hash, codec, data_key) jobs
+    When original_hash is given the plaintext is verified against it
+    """
+    chunks = []
+    for fragment_id, data, original_hash, codec, data_key in jobs:
+        started = time.perf_counter()
+        chunk = decrypt_data(data, fragment_id, data_key)
+        started = _record("decrypt", started)
+        if codec is not None:
+            chunk = decompress_chunk(chunk, codec)
+            started = _record("decompress", started)
+        if original_hash is not None:
+            if hashlib.sha256(chunk).hexdigest() != original_hash:
+                raise ValueError(f"Fragment {fragment_id} failed integrity check")
+            _record("verify", started)
+        chunks.append(chunk)
+    return chunks
+
+def verify_batch(jobs: List[Tuple[Any, Union[bytes, str], str, Optional[str], Optional[bytes]]]) -> List[Optional[str]]:
+    """
+    Check a batch of (fragment_id, data, original_hash, codec, data_key) jobs one by one
+    Returns None for each payload that decrypts to its original hash, else the error.
+    """
+    errors: List[Optional[str]] = []
+    for job in jobs:
+        try:
+            decrypt_batch([job])
+        except Exception as e:
+            errors.append(str(e) or type(e).__name__)
+        else:
+            errors.append(None)
+    return errors
+
+def encode_stripe_batch(stripes: List[Tuple[int, int, int, List[Tuple[int, int, bytes, bool]]]],
+                        data_key: Optional[Tuple[str, bytes]] = None) -> List[Dict[str, Any]]:
+    """
+    Build fragment records for a batch of (stripe, k, m, jobs) erasure stripes
+    Each stripe yields its data fragments followed by m parity fragments. Parity is
+    computed over the plaintext chunks (zero-padded to the longest chunk, with
+    zero shards standing in for a short final stripe) and encrypted like data.
+    Parity fragments have no fragment_id or position; the caller numbers them.
+    """
+    records = []
+    for stripe, k, m, jobs in stripes:
+        shard_size = max(len(job[2]) for job in jobs)
+        shards = [job[2].ljust(shard_size, b"\0") for job in jobs]
+        shards += [bytes(shard_size)] * (k - len(jobs))
+
+        for shard, (fragment_id, position, chunk, stored) in enumerate(jobs):
+            record = build_fragment(chunk, fragment_id, position, stored, data_key)
+            record.update(stripe=stripe, shard=shard)
+            records.append(record)
+        started = time.perf_counter()
+        parities = get_codec(k, m).encode(shards)
+        _record("erasure_encode", started)
+        for offset, parity in enumerate(parities):
+            record = build_fragment(parity, None, None, data_key=data_key)
+            record.update(stripe=stripe, shard=k + offset, parity=True)
+            records.append(record)
+    return records
+
+def decode_stripe_batch(stripes: List[Tuple[int, int, int, List[Tuple[int, str]], List[Tuple[int, Any, Union[bytes, str], str, Optional[str], Optional[bytes]]]]]) -> List[Optional[List[bytes]]]:
+    """
+    Rebuild the data chunks of a batch of (k, m, shard_size, data, shards) stripes
+    data lists (size, original_hash) of every data fragment in the stripe; shards
+    are the available (shard, fragment_id, payload, original_hash, codec, data_key) fragments.
+    A shard that fails decryption or its hash check is treated as missing.
+    Returns each stripe's data chunks, or None for stripes with too few good shards.
+    """
+    results: List[Optional[List[bytes]]] = []
+    for k, m, shard_size, data, shards in stripes:
+        plain: Dict[int, bytes] = {}
+        for shard, fragment_id, payload, original_hash, codec, data_key in shards:
+            try:
+                plain[shard] = decrypt_batch([(fragment_id, payload, original_hash, codec, data_key)])[0]
+            except Exception as e:
+                print(f"⚠️ Dropping fragment {fragment_id}: {e!r}")
+
+        if all(shard in plain for shard in range(len(data))):
+            results.append([plain[shard] for shard in range(len(data))])
+            continue
+        # A short final stripe is padded with zero shards that never go missing
+        if len(plain) + k - len(data) < k:
+            results.append(None)
+            continue
+
+        padded = {shard: chunk.ljust(shard_size, b"\0") for shard, chunk in plain.items()}
+        for shard in range(len(data), k):
+            padded[shard] = bytes(shard_size)
+        started = time.perf_counter()
+        decoded = get_codec(k, m).decode(padded, wanted=range(len(data)))
+        _record("erasure_decode", started)
+
+        chunks = []
+        for shard, (size, original_hash) in enumerate(data):
+            chunk = decoded[shard][:size]
+            if hashlib.sha256(chunk).hexdigest() != original_hash:
+                raise ValueError(f"Recovered shard {shard} failed integrity check")
+            chunks.append(chunk)
+        results.append(chunks)
+    return results
+
+def rebuild_stripe_batch(stripes: List[Tuple[int, int, int, List[Tuple[int, str]], List[Tuple[int, Any, Union[bytes, str], str, Optional[str], Optional[bytes]]], List[Tuple[int, str, Optional[str]]]]]) -> List[Optional[Dict[int, bytes]]]:
+    """
+    Re-create lost fragments of a batch of (k, m, shard_size, data, shards, lost) stripes
+    data and shards are as for decode_stripe_batch; lost lists the (shard, original_hash,
+    codec) of the fragments to rebuild, data or parity. Each rebuilt fragment is checked
+    against its hash, then compressed with its codec and encrypted with the base key.
+    Returns each stripe's {shard: payload}, or None when it cannot be rebuilt.
+    """
+    results: List[Optional[Dict[int, bytes]]] = []
+    for k, m, shard_size, data, shards, lost in stripes:
+        try:
+            chunks = decode_stripe_batch([(k, m, shard_size, data, shards)])[0]
+        except ValueError as e:
+            print(f"⚠️ Stripe rebuild failed: {e}")
+            chunks = None
+        if chunks is None:
+            results.append(None)
+            continue
+
+        parities: List[bytes] = []
+        if any(shard >= k for shard, _, _ in lost):
+            padded = [chunk.ljust(shard_size, b"\0") for chunk in chunks] + [bytes(shard_size)] * (k - len(chunks))
+            started = time.perf_counter()
+            parities = get_codec(k, m).encode(padded)
+            _record("erasure_encode", started)
+        rebuilt: Optional[Dict[int, bytes]] = {}
+        for shard, original_hash, codec in lost:
+            chunk = chunks[shard] if shard < k else parities[shard - k]
+            if hashlib.sha256(chunk).hexdigest() != original_hash:
+                print(f"⚠️ Rebuilt shard {shard} does not match its hash")
+                rebuilt = None
+                break
+            # The catalog records how the payload is compressed, so use that codec whether or not it pays off
+            payload = CODECS[codec][0](chunk) if codec is not None else chunk
+            rebuilt[shard] = _cipher.encrypt(payload)
+        results.append(rebuilt)
+    return results
+
+async def _aiterate(items: Iterable[Any]) -> AsyncIterator[Any]:
+    for item in items:
+        yield item
+
+class CryptoExecutor:
+    """
+    Runs batched fragment crypto jobs on a pool sized to the available cores
+
+    mode="process" gives near-linear scaling for work that holds the GIL (such as
+    the legacy Fernet format); mode="thread" avoids inter-process copies for small
+    deployments.
+    """
+
+    def __init__(self, key: bytes, mode: str = "process", workers: Optional[int] = None, batch_size: int = 8,
+                 compression: Optional[str] = None, engine: str = "aes-gcm",
+                 observer: Optional[Callable[[Dict[str, List[float]]], None]] = None):
+        if mode not in ("process", "thread"):
+            raise ValueError(f"Unknown crypto executor mode: {mode}")
+        self.key = key
+        self.compression = compression
+        self.engine = engine
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        # Receives the {stage: [seconds per fragment]} timings of every batch
+        self.observer = observer
+        # Batches allowed in flight per pipeline before the producer waits
+        self.depth = self.workers * 2
+        self._pool: Optional[Executor] = None
+        # Batches submitted to the pool and not finished yet, from every caller
+        self.in_flight = 0
+        init_worker(key, compression, engine)
+
+    def _get_pool(self) -> Executor:
+        # Created lazily so importing the app never forks worker processes
+        if self._pool is None:
+            if self.mode == "process":
+                self._pool = ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                                 initargs=(self.key, self.compression, self.engine))
+            else:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="chainvault-crypto")
+        return self._pool
+
+    def submit(self, fn: Callable[[List[Any]], List[Any]], batch: List[Any],
+               timer: Optional[StageTimer] = None) -> "asyncio.Future[List[Any]]":
+        """Schedule one batch and return an awaitable for its results; stage timings are added to timer"""
+        if not batch:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result([])
+            return future
+        future = asyncio.get_running_loop().run_in_executor(self._get_pool(), run_timed, fn, batch)
+        self.in_flight += 1
+        future.add_done_callback(self._batch_done)
+        return asyncio.ensure_future(self._results(future, timer))
+
+    def _batch_done(self, future: asyncio.Future) -> None:
+        self.in_flight -= 1
+
+    async def _results(self, future: "asyncio.Future[Tuple[List[Any], Dict[str, List[float]]]]",
+                       timer: Optional[StageTimer]) -> List[Any]:
+        results, times = await future
+        if self.observer is not None:
+            self.observer(times)
+        if timer is not None:
+            timer.add_times(times)
+        return results
+
+    def batches(self, items: List[Any]) -> List[List[Any]]:
+        """Split items into batches of batch_size"""
+        return [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+
+    async def map(self, fn: Callable[[List[Any]], List[Any]], items: List[Any],
+                  timer: Optional[StageTimer] = None) -> List[Any]:
+        """Run fn over all items in parallel batches, returning results in order"""
+        results: List[Any] = []
+        async for batch_results in self.imap(fn, self.batches(items), timer):
+            results.extend(batch_results)
+        return results
+
+    async def imap(self, fn: Callable[[List[Any]], List[Any]],
+                   batches: Union[Iterable[List[Any]], AsyncIterable[List[Any]]],
+                   timer: Optional[StageTimer] = None) -> AsyncIterator[List[Any]]:
+        """
+        Yield per-batch results in order, keeping at most `depth` batches in flight
+        batches may be an async iterable, e.g. one that fetches payloads while earlier batches run
+        """
+        in_flight: Deque[asyncio.Future] = deque()
+        if not hasattr(batches, "__aiter__"):
+            batches = _aiterate(batches)
+        try:
+            async for batch in batches:
+                in_flight.append(self.submit(fn, batch, timer))
+                if len(in_flight) >= self.depth:
+                    yield await in_flight.popleft()
+            while in_flight:
+                yield await in_flight.popleft()
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def pipeline(self, fn: Callable[[List[Any]], List[Any]], sink: Optional[Callable[[Any], Any]] = None,
+                 timer: Optional[StageTimer] = None) -> "OrderedBatchPipeline":
+        """Start a producer-driven pipeline for fn"""
+        return OrderedBatchPipeline(self, fn, sink, timer)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+class OrderedBatchPipeline:
+    """
+    Collects results of batches submitted by a producer, in submission order
+
+    submit() waits for the oldest batch once `depth` batches are in flight, which
+    applies backpressure to the producer and bounds memory to batch size x depth.
+    Each result is passed through `sink` (e.g. a storage write) as it completes,
+    and only the sink's return value is kept.
+    """
+
+    def __init__(self, executor: CryptoExecutor, fn: Callable[[List[Any]], List[Any]],
+                 sink: Optional[Callable[[Any], Any]] = None, timer: Optional[StageTimer] = None):
+        self.executor = executor
+        self.fn = fn
+        self.sink = sink
+        self.timer = timer
+        self.results: List[Any] = []
+        self._in_flight: Deque[asyncio.Future] = deque()
+
+    async def _collect_oldest(self) -> None:
+        batch_results = await self._in_flight.popleft()
+        if self.sink is not None:
+            batch_results = [self.sink(result) for result in batch_results]
+        self.results.extend(batch_results)
+
+    async def submit(self, batch: List[Any]) -> None:
+        if not batch:
+            return
+        self._in_flight.append(self.executor.submit(self.fn, batch, self.timer))
+        while len(self._in_flight) >= self.executor.depth:
+            await self._collect_oldest()
+
+    async def finish(self) -> List[Any]:
+        """Wait for all outstanding batches and return every result in order"""
+        while self._in_flight:
+            await self._collect_oldest()
+        return self.results
+
+    def cancel(self) -> None:
+        for future in self._in_flight:
+            future.cancel()
+        self._in_flight.clear()
@@ -0,0 +1,146 @@
+"""
+Reed-Solomon erasure coding over GF(256)
+
+ReedSolomon(k, m) turns k equally sized data shards into m parity shards so that
+any k of the k + m shards rebuild the data. The code is systematic (data shards
+are stored unchanged) and uses a Cauchy matrix, whose square submatrices are
+all invertible. Shard arithmetic is vectorized with NumPy: multiplying a shard
+by a constant is a lookup into a precomputed product table (two bytes at a
+time), and adding shards is XOR.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# GF(2^8) with the primitive polynomial x^8 + x^4 + x^3 + x^2 + 1
+_EXP = [0] * 512
+_LOG = [0] * 256
+_value = 1
+for _power in range(255):
+    _EXP[_power] = _value
+    _LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x11d
+for _power in range(255, 512):
+    _EXP[_power] = _EXP[_power - 255]
+
+def gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+def gf_inv(a: int) -> int:
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return _EXP[255 - _LOG[a]]
+
+# MUL_TABLE[c] maps every byte x to c * x
+MUL_TABLE = np.array([[gf_mul(c, x) for x in range(256)] for c in range(256)], dtype=np.uint8)
+
+_wide_tables: Dict[int, np.ndarray] = {}
+
+def _wide_table(c: int) -> np.ndarray:
+    """c * x for byte pairs packed as little-endian uint16, so one lookup handles two bytes"""
+    table = _wide_tables.get(c)
+    if table is None:
+        row = MUL_TABLE[c].astype(np.uint16)
+        table = _wide_tables[c] = ((row[:, None] << 8) | row[None, :]).ravel()
+    return table
+
+def gf_invert_matrix(matrix: List[List[int]]) -> List[List[int]]:
+    """Invert a square matrix over GF(256) by Gauss-Jordan elimination"""
+    size = len(matrix)
+    rows = [list(row) + [1 if i == j else 0 for j in range(size)] for i, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = next((r for r in range(col, size) if rows[r][col]), None)
+        if pivot is None:
+            raise ValueError("Matrix is singular")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = gf_inv(rows[col][col])
+        rows[col] = [gf_mul(scale, value) for value in rows[col]]
+        for r in range(size):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [value ^ gf_mul(factor, pivot_value) for value, pivot_value in zip(rows[r], rows[col])]
+    return [row[size:] for row in rows]
+
+class ReedSolomon:
+    """Systematic k-of-(k+m) Reed-Solomon code"""
+
+    def __init__(self, k: int, m: int):
+        if k < 1 or m < 0 or k + m > 256:
+            raise ValueError(f"Invalid Reed-Solomon parameters k={k}, m={m}")
+        self.k = k
+        self.m = m
+        # Parity rows of the encoding matrix: Cauchy matrix 1 / (x_i + y_j) with
+        # disjoint x = 0..m-1 and y = m..m+k-1 (addition is XOR)
+        self.parity_rows = [[gf_inv(i ^ (m + j)) for j in range(k)] for i in range(m)]
+        # Inverted decoding matrices keyed by the shard indices they decode from
+        self._decoders: Dict[Tuple[int, ...], List[List[int]]] = {}
+
+    def _row(self, shard_index: int) -> List[int]:
+        if shard_index < self.k:
+            return [1 if j == shard_index else 0 for j in range(self.k)]
+        return self.parity_rows[shard_index - self.k]
+
+    @staticmethod
+    def _combine(coefficients: Sequence[int], shards: Sequence[np.ndarray]) -> np.ndarray:
+        """Sum of coefficient * shard over GF(256)"""
+        length = len(shards[0])
+        if length % 2 == 0:
+            # Two bytes per table lookup
+            shards = [shard.view(np.uint16) for shard in shards]
+            out = np.zeros(length // 2, dtype=np.uint16)
+            lookup = lambda c, shard: _wide_table(c).take(shard)
+        else:
+            out = np.zeros(length, dtype=np.uint8)
+            lookup = lambda c, shard: MUL_TABLE[c].take(shard)
+        for coefficient, shard in zip(coefficients, shards):
+            if coefficient == 1:
+                np.bitwise_xor(out, shard, out=out)
+            elif coefficient:
+                np.bitwise_xor(out, lookup(coefficient, shard), out=out)
+        return out.view(np.uint8)
+
+    def encode(self, data_shards: Sequence[bytes]) -> List[bytes]:
+        """Return the m parity shards for k data shards of equal length"""
+        if len(data_shards) != self.k:
+            raise ValueError(f"Expected {self.k} data shards, got {len(data_shards)}")
+        shards = [np.frombuffer(shard, dtype=np.uint8) for shard in data_shards]
+        return [self._combine(row, shards).tobytes() for row in self.parity_rows]
+
+    def decode(self, shards: Dict[int, bytes], wanted: Optional[Sequence[int]] = None) -> Dict[int, bytes]:
+        """
+        Rebuild data shards from any k of the k + m shards
+        shards maps shard index (0..k-1 data, k.. parity) to its bytes; returns
+        {data index: bytes} for `wanted` (default: all data shards)
+        """
+        wanted = range(self.k) if wanted is None else wanted
+        missing = [index for index in wanted if index not in shards]
+        result = {index: shards[index] for index in wanted if index in shards}
+        if not missing:
+            return result
+        if len(shards) < self.k:
+            raise ValueError(f"Need {self.k} shards to decode, only {len(shards)} available")
+
+        # Prefer data shards: their rows are identity rows, so fewer products are needed
+        used = tuple(sorted(shards)[:self.k])
+        decoder = self._decoders.get(used)
+        if decoder is None:
+            decoder = gf_invert_matrix([self._row(index) for index in used])
+            self._decoders[used] = decoder
+
+        arrays = [np.frombuffer(shards[index], dtype=np.uint8) for index in used]
+        for index in missing:
+            result[index] = self._combine(decoder[index], arrays).tobytes()
+        return result
+
+_codecs: Dict[Tuple[int, int], ReedSolomon] = {}
+
+def get_codec(k: int, m: int) -> ReedSolomon:
+    """Shared ReedSolomon instance for (k, m), so decoding matrices are reused"""
+    codec = _codecs.get((k, m))
+    if codec is None:
+        codec = _codecs[(k, m)] = ReedSolomon(k, m)
+    return codec
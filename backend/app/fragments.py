@@ -0,0 +1,161 @@
+"""
+Compact fragment tables
+
+The catalog keeps one FragmentTable per file instead of a dict per fragment.
+Each field is a column: fragment ids, sizes, positions, erasure stripe/shard
+numbers and payload compression codecs are typed arrays, and the plaintext
+SHA-256 of each fragment (which is also its fragment_hash and storage key) is
+kept once as a raw 32-byte digest.
+Payloads live in the fragment store, so a table holds no encrypted data.
+
+Iterating a table (or indexing it) yields the familiar fragment record dicts,
+built on demand; code that only needs one field should read the column.
+"""
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .compression import CODEC_IDS, CODEC_NAMES
+
+NONE = -1  # Column value for a field the record does not have (parity position, non-erasure stripe)
+
+class FragmentTable:
+    """Column-oriented fragment records of one file"""
+
+    __slots__ = ("ids", "positions", "sizes", "stripes", "shards", "codecs", "parity", "digests", "inline", "data_count")
+
+    def __init__(self):
+        self.ids = array("i")
+        self.positions = array("q")
+        self.sizes = array("i")
+        self.stripes = array("i")
+        self.shards = array("h")
+        self.codecs = array("b")  # 0 = stored uncompressed, else compression.CODEC_IDS
+        self.parity = bytearray()
+        self.digests = bytearray()  # 32 bytes per fragment
+        # Legacy records whose payload is stored inline rather than in the fragment store
+        self.inline: Optional[Dict[int, Any]] = None
+        self.data_count = 0
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> "FragmentTable":
+        table = cls()
+        for record in records:
+            table.append(record)
+        return table
+
+    def append(self, record: Dict[str, Any]) -> None:
+        parity = bool(record.get("parity"))
+        position = record.get("position")
+        self.ids.append(record["fragment_id"])
+        self.positions.append(NONE if position is None else position)
+        self.sizes.append(record["size"])
+        self.stripes.append(record.get("stripe", NONE))
+        self.shards.append(record.get("shard", NONE))
+        self.codecs.append(CODEC_IDS[record["codec"]] if record.get("codec") else 0)
+        self.parity.append(parity)
+        self.digests += bytes.fromhex(record["original_hash"])
+        if "data" in record:
+            if self.inline is None:
+                self.inline = {}
+            self.inline[len(self.ids) - 1] = record["data"]
+        if not parity:
+            self.data_count += 1
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def hash_hex(self, index: int) -> str:
+        return self.digests[index * 32:(index + 1) * 32].hex()
+
+    def record(self, index: int) -> Dict[str, Any]:
+        """The fragment record dict at index"""
+        fragment_hash = self.hash_hex(index)
+        position = self.positions[index]
+        record: Dict[str, Any] = {
+            "fragment_id": self.ids[index],
+            "fragment_hash": fragment_hash,
+            "size": self.sizes[index],
+            "position": None if position == NONE else position,
+            "original_hash": fragment_hash
+        }
+        if self.inline is not None and index in self.inline:
+            record["data"] = self.inline[index]
+        else:
+            record["storage_key"] = fragment_hash
+        if self.codecs[index]:
+            record["codec"] = CODEC_NAMES[self.codecs[index]]
+        if self.stripes[index] != NONE:
+            record["stripe"] = self.stripes[index]
+            record["shard"] = self.shards[index]
+        if self.parity[index]:
+            record["parity"] = True
+        return record
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        if isinstance(index, slice):
+            return [self.record(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Fragment index out of range")
+        return self.record(index)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(len(self)):
+            yield self.record(index)
+
+    def index_of(self, fragment_id: int) -> Optional[int]:
+        """Row of a fragment id (ids are normally 1..n in row order)"""
+        if 0 < fragment_id <= len(self.ids) and self.ids[fragment_id - 1] == fragment_id:
+            return fragment_id - 1
+        try:
+            return self.ids.index(fragment_id)
+        except ValueError:
+            return None
+
+    def stripe_payloads(self) -> Iterator[Tuple[bytes, int]]:
+        """(digest, stripe) of every stored payload that belongs to an erasure stripe"""
+        for index in range(len(self)):
+            if self.stripes[index] != NONE and (self.inline is None or index not in self.inline):
+                yield bytes(self.digests[index * 32:index * 32 + 32]), self.stripes[index]
+
+    def stripe_rows(self, stripe: int) -> List[int]:
+        """Rows of one erasure stripe: its data fragments, then its parity fragments"""
+        return [index for index in range(len(self)) if self.stripes[index] == stripe]
+
+    def leaf_index(self, index: int) -> int:
+        """Position of a data fragment among the data fragments (its Merkle leaf index)"""
+        return index - self.parity[:index].count(1)
+
+    def hashes(self) -> List[str]:
+        """Fragment hashes of every fragment in row order"""
+        return [self.hash_hex(index) for index in range(len(self))]
+
+    def data_hashes(self) -> List[str]:
+        """Plaintext hashes of the data fragments in row order"""
+        return [self.hash_hex(index) for index in range(len(self)) if not self.parity[index]]
+
+    def data_sizes(self) -> List[int]:
+        """Sizes of the data fragments in row order"""
+        return [self.sizes[index] for index in range(len(self)) if not self.parity[index]]
+
+    def storage_keys(self) -> Iterator[str]:
+        """Fragment store keys referenced by this file"""
+        for key, _ in self.stored_payloads():
+            yield key
+
+    def stored_payloads(self) -> Iterator[Tuple[str, Optional[str]]]:
+        """(storage key, compression codec) of every payload this file references in the fragment store"""
+        for index in range(len(self)):
+            if self.inline is None or index not in self.inline:
+                yield self.hash_hex(index), CODEC_NAMES.get(self.codecs[index])
+
+    @property
+    def compressed_count(self) -> int:
+        return len(self.codecs) - self.codecs.count(0)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the columns"""
+        columns = (self.ids, self.positions, self.sizes, self.stripes, self.shards, self.codecs)
+        return sum(column.itemsize * len(column) for column in columns) + len(self.parity) + len(self.digests)
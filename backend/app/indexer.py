@@ -0,0 +1,447 @@
+"""
+Event-driven local index of on-chain TrustAwareStorage state
+
+ChainIndexer follows the contract's FileUploaded, AccessGranted, AccessRevoked,
+NodeRegistered, TrustScoreUpdated and FragmentStored events and folds them
+into a ChainIndex. API handlers query the index from memory instead of making
+RPC calls. Progress is checkpointed to disk with the block height, and every
+change made in the last `reorg_depth` blocks is journaled so a chain
+reorganization can be rolled back to the fork point and replayed.
+"""
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from eth_abi import decode as abi_decode
+from web3 import Web3
+from web3.exceptions import BlockNotFound
+
+def normalize_hex(value: Any) -> str:
+    """Normalize a topic or hash to a 0x-prefixed lowercase hex string"""
+    text = value.hex() if hasattr(value, "hex") else str(value)
+    text = text.lower()
+    return text if text.startswith("0x") else "0x" + text
+
+def _topic_address(topic: Any) -> str:
+    return Web3.to_checksum_address("0x" + normalize_hex(topic)[-40:])
+
+def file_topic(file_hash: str) -> str:
+    """Indexed string event arguments are stored as the keccak of the string"""
+    return normalize_hex(Web3.keccak(text=file_hash))
+
+EVENT_SIGNATURES = {
+    "FileUploaded": "FileUploaded(string,address,string,uint256)",
+    "AccessGranted": "AccessGranted(string,address,address)",
+    "AccessRevoked": "AccessRevoked(string,address,address)",
+    "NodeRegistered": "NodeRegistered(address,uint256)",
+    "TrustScoreUpdated": "TrustScoreUpdated(address,uint256,uint256)",
+    "FragmentStored": "FragmentStored(uint256,address,string)",
+}
+EVENT_TOPICS = {normalize_hex(Web3.keccak(text=signature)): name for name, signature in EVENT_SIGNATURES.items()}
+
+# Trust threshold used by the contract's getTrustedNodes()
+TRUSTED_NODE_THRESHOLD = 70
+
+class ChainIndex:
+    """
+    Queryable local view of contract state
+
+    State is kept in four tables keyed by strings so it can be checkpointed as
+    JSON: files (file topic), permissions ("topic:account"), nodes (address,
+    with trust score and isActive) and fragments (fragment id). Every write records the previous value in an
+    undo journal tagged with its block number. Owned and granted file topics
+    are also indexed per account, so an account's files are found without
+    walking every file.
+    """
+
+    TABLES = ("files", "permissions", "nodes", "fragments")
+
+    def __init__(self):
+        self.tables: Dict[str, Dict[str, Any]] = {name: {} for name in self.TABLES}
+        # (block_number, table, key, previous value or None)
+        self.journal: List[Tuple[int, str, str, Any]] = []
+        self.last_block = -1
+        self.synced = False
+        self._topics: Dict[str, str] = {}
+        # account => {file topic: "owner" | "granted"}
+        self._accounts: Dict[str, Dict[str, str]] = {}
+
+    # ---- writes ----
+
+    def _account_row(self, table: str, key: str, value: Any) -> Optional[Tuple[str, str, str]]:
+        """(account, file topic, access) a files or permissions row gives, if any"""
+        if value is None:
+            return None
+        if table == "files":
+            return value["owner"], key, "owner"
+        if table == "permissions":
+            topic, _, account = key.partition(":")
+            return account, topic, "granted"
+        return None
+
+    def _store(self, table: str, key: str, value: Any) -> None:
+        """Write a row (None deletes it), keeping the per-account index in step"""
+        rows = self.tables[table]
+        previous = self._account_row(table, key, rows.get(key))
+        if previous is not None:
+            files = self._accounts.get(previous[0], {})
+            if files.get(previous[1]) == previous[2]:
+                del files[previous[1]]
+                # An owner granted access to their own file stays listed as the owner
+                if previous[2] == "owner" and f"{previous[1]}:{previous[0]}" in self.tables["permissions"]:
+                    files[previous[1]] = "granted"
+        if value is None:
+            rows.pop(key, None)
+        else:
+            rows[key] = value
+        current = self._account_row(table, key, value)
+        if current is not None:
+            files = self._accounts.setdefault(current[0], {})
+            if files.get(current[1]) != "owner":
+                files[current[1]] = current[2]
+
+    def _reindex_accounts(self) -> None:
+        self._accounts = {}
+        for table in ("permissions", "files"):
+            for key, value in self.tables[table].items():
+                account, topic, access = self._account_row(table, key, value)
+                self._accounts.setdefault(account, {})[topic] = access
+
+    def _set(self, block_number: int, table: str, key: str, value: Any) -> None:
+        self.journal.append((block_number, table, key, self.tables[table].get(key)))
+        self._store(table, key, value)
+
+    def apply(self, event: str, topics: List[str], data: bytes, block_number: int) -> None:
+        """Fold one decoded contract log into the index"""
+        if event == "FileUploaded":
+            file_name, timestamp = abi_decode(["string", "uint256"], data)
+            self._set(block_number, "files", topics[1], {
+                "owner": _topic_address(topics[2]),
+                "file_name": file_name,
+                "timestamp": timestamp,
+                "block": block_number
+            })
+        elif event == "AccessGranted":
+            self._set(block_number, "permissions", f"{topics[1]}:{_topic_address(topics[3])}", True)
+        elif event == "AccessRevoked":
+            self._set(block_number, "permissions", f"{topics[1]}:{_topic_address(topics[3])}", None)
+        elif event == "NodeRegistered":
+            (trust_score,) = abi_decode(["uint256"], data)
+            self._set(block_number, "nodes", _topic_address(topics[1]), {
+                "trust_score": trust_score,
+                "active": True,  # registerNode sets isActive
+                "order": len(self.tables["nodes"]),
+                "block": block_number
+            })
+        elif event == "TrustScoreUpdated":
+            address = _topic_address(topics[1])
+            _, new_score = abi_decode(["uint256", "uint256"], data)
+            node = dict(self.tables["nodes"].get(address) or {"order": len(self.tables["nodes"])})
+            # updateTrustScore reverts for a node that is not active
+            node.update(trust_score=new_score, active=True, block=block_number)
+            self._set(block_number, "nodes", address, node)
+        elif event == "FragmentStored":
+            fragment_id = str(int(normalize_hex(topics[1]), 16))
+            (fragment_hash,) = abi_decode(["string"], data)
+            fragment = self.tables["fragments"].get(fragment_id) or {"fragment_hash": fragment_hash, "nodes": []}
+            self._set(block_number, "fragments", fragment_id, {
+                "fragment_hash": fragment_hash,
+                "nodes": fragment["nodes"] + [_topic_address(topics[2])]
+            })
+
+    def rollback(self, block_number: int) -> None:
+        """Undo every change made after block_number"""
+        while self.journal and self.journal[-1][0] > block_number:
+            _, table, key, previous = self.journal.pop()
+            self._store(table, key, previous)
+        self.last_block = min(self.last_block, block_number)
+
+    def prune_journal(self, keep_after: int) -> None:
+        """Forget undo entries that are too deep to be reorganized"""
+        cut = 0
+        while cut < len(self.journal) and self.journal[cut][0] <= keep_after:
+            cut += 1
+        del self.journal[:cut]
+
+    def reset(self) -> None:
+        """Forget everything; queries fall back to RPC until the index has caught up again"""
+        self.tables = {name: {} for name in self.TABLES}
+        self._accounts = {}
+        self.journal = []
+        self.last_block = -1
+        self.synced = False
+
+    # ---- queries ----
+
+    def _topic(self, file_hash: str) -> str:
+        topic = self._topics.get(file_hash)
+        if topic is None:
+            topic = self._topics[file_hash] = file_topic(file_hash)
+        return topic
+
+    def file_record(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        return self.tables["files"].get(self._topic(file_hash))
+
+    def owner_of(self, file_hash: str) -> Optional[str]:
+        record = self.file_record(file_hash)
+        return record["owner"] if record else None
+
+    def has_access(self, file_hash: str, account: str) -> bool:
+        topic = self._topic(file_hash)
+        record = self.tables["files"].get(topic)
+        if record is None:
+            return False
+        return record["owner"] == account or f"{topic}:{account}" in self.tables["permissions"]
+
+    def resolve(self, account: str, file_hashes: List[str]) -> Dict[str, Optional[str]]:
+        """Same contract as AccessResolver.resolve, answered from memory"""
+        decisions: Dict[str, Optional[str]] = {}
+        for file_hash in file_hashes:
+            topic = self._topic(file_hash)
+            record = self.tables["files"].get(topic)
+            if record is None:
+                continue
+            if record["owner"] == account:
+                decisions[file_hash] = "owner"
+            elif f"{topic}:{account}" in self.tables["permissions"]:
+                decisions[file_hash] = "granted"
+            else:
+                decisions[file_hash] = None
+        return decisions
+
+    def account_files(self, account: str) -> Dict[str, str]:
+        """{file topic: "owner" | "granted"} for every registered file the account can access"""
+        files = self.tables["files"]
+        return {topic: access for topic, access in self._accounts.get(account, {}).items() if topic in files}
+
+    def is_registered(self, file_hash: str) -> bool:
+        return self._topic(file_hash) in self.tables["files"]
+
+    def all_nodes(self) -> List[str]:
+        """Node addresses in registration order (as getAllStorageNodes)"""
+        nodes = self.tables["nodes"]
+        return sorted(nodes, key=lambda address: nodes[address]["order"])
+
+    def node_active(self, address: str) -> Optional[bool]:
+        """A node's isActive, or None if its row was indexed before the flag was recorded"""
+        node = self.tables["nodes"].get(address)
+        return node.get("active") if node is not None else None
+
+    def trusted_nodes(self) -> Dict[str, int]:
+        """{address: trust_score} for active trusted nodes in registration order (as getTrustedNodes)"""
+        nodes = self.tables["nodes"]
+        return {
+            address: nodes[address]["trust_score"]
+            for address in self.all_nodes()
+            if nodes[address].get("active") is not False and nodes[address]["trust_score"] >= TRUSTED_NODE_THRESHOLD
+        }
+
+    def fragment_nodes(self, fragment_id: int) -> List[str]:
+        fragment = self.tables["fragments"].get(str(fragment_id))
+        return list(fragment["nodes"]) if fragment else []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "synced": self.synced,
+            "last_block": self.last_block,
+            **{name: len(rows) for name, rows in self.tables.items()}
+        }
+
+    # ---- checkpoints ----
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"last_block": self.last_block, "tables": self.tables, "journal": self.journal}
+
+    def load_json(self, state: Dict[str, Any]) -> None:
+        self.last_block = state["last_block"]
+        self.tables = {name: dict(state["tables"].get(name, {})) for name in self.TABLES}
+        self.journal = [tuple(entry) for entry in state["journal"]]
+        self._reindex_accounts()
+
+class ChainIndexer:
+    """
+    Follows contract logs into a ChainIndex
+
+    Each sync cycle: check the last checkpointed block hash (rolling back to the
+    fork point on a reorg), fetch logs up to head - confirmations in windows of
+    `batch_blocks`, apply them, and record the new checkpoint. `chain` is a
+    ChainClient, or any stub with async block_number / get_block / get_logs
+    and an `available` flag.
+
+    Checkpoints also record the genesis block hash. A restarted dev chain can
+    redeploy to the same contract address; its different genesis (or a head
+    below the checkpoint, or a checkpointed block that no longer exists) makes
+    the index start over instead of waiting for blocks that will never come.
+    """
+
+    def __init__(self, chain: Any, contract_address: str, index: ChainIndex, checkpoint_path: Optional[str] = None,
+                 confirmations: int = 0, reorg_depth: int = 64, batch_blocks: int = 2000,
+                 poll_interval: float = 1.0, start_block: int = 0):
+        self.chain = chain
+        self.contract_address = contract_address
+        self.index = index
+        self.checkpoint_path = checkpoint_path
+        self.confirmations = confirmations
+        self.reorg_depth = reorg_depth
+        self.batch_blocks = batch_blocks
+        self.poll_interval = poll_interval
+        self.start_block = start_block
+        # Recent (block_number, block_hash) checkpoints used to find a fork point
+        self.checkpoints: List[Tuple[int, str]] = []
+        self.reorgs = 0
+        self.resets = 0
+        self.last_error: Optional[str] = None
+        # Hash of the chain's block 0, checked once per process against the checkpoint's
+        self.genesis: Optional[str] = None
+        self._genesis_checked = False
+        self._dirty = False
+        self.load_checkpoint()
+
+    async def _block_hash(self, block_number: int) -> str:
+        block = await self.chain.get_block(block_number)
+        return normalize_hex(block["hash"])
+
+    # ---- reorg handling ----
+
+    def _reset(self, reason: str) -> None:
+        print(f"⚠️ {reason}, rebuilding index")
+        self.index.reset()
+        self.checkpoints = []
+        self.resets += 1
+        self._dirty = True
+
+    async def _check_genesis(self) -> None:
+        genesis = await self._block_hash(0)
+        if self.genesis is not None and genesis != self.genesis:
+            self._reset("Chain was restarted (different genesis block)")
+        self.genesis = genesis
+        self._genesis_checked = True
+
+    async def _check_reorg(self) -> None:
+        if not self.checkpoints:
+            return
+        block_number, block_hash = self.checkpoints[-1]
+        if block_number > await self.chain.block_number():
+            self._reset(f"Chain head is below checkpointed block {block_number}")
+            return
+        try:
+            current = await self._block_hash(block_number)
+        except BlockNotFound:
+            self._reset(f"Checkpointed block {block_number} no longer exists")
+            return
+        if current == block_hash:
+            return
+
+        self.reorgs += 1
+        fork_point = None
+        for block_number, block_hash in reversed(self.checkpoints[:-1]):
+            if await self._block_hash(block_number) == block_hash:
+                fork_point = block_number
+                break
+
+        if fork_point is None:
+            self._reset("Chain reorganization deeper than the journal")
+        else:
+            print(f"⚠️ Chain reorganization detected, rolling back to block {fork_point}")
+            self.index.rollback(fork_point)
+            self.checkpoints = [entry for entry in self.checkpoints if entry[0] <= fork_point]
+            self._dirty = True
+
+    # ---- sync ----
+
+    async def sync_once(self) -> int:
+        """Catch the index up with the chain; returns the number of logs applied"""
+        if not self._genesis_checked:
+            await self._check_genesis()
+        await self._check_reorg()
+        head = await self.chain.block_number()
+        target = head - self.confirmations
+        from_block = max(self.index.last_block + 1, self.start_block)
+        applied = 0
+
+        while from_block <= target:
+            to_block = min(from_block + self.batch_blocks - 1, target)
+            logs = await self.chain.get_logs({
+                "address": self.contract_address,
+                "fromBlock": from_block,
+                "toBlock": to_block
+            })
+            for log in sorted(logs, key=lambda entry: (entry["blockNumber"], entry["logIndex"])):
+                topics = [normalize_hex(topic) for topic in log["topics"]]
+                event = EVENT_TOPICS.get(topics[0]) if topics else None
+                if event is not None:
+                    self.index.apply(event, topics, bytes(log["data"]), log["blockNumber"])
+                    applied += 1
+                # Blocks that changed the index double as fork-point candidates, at no extra RPC
+                if "blockHash" in log and (not self.checkpoints or self.checkpoints[-1][0] < log["blockNumber"]):
+                    self.checkpoints.append((log["blockNumber"], normalize_hex(log["blockHash"])))
+
+            self.index.last_block = to_block
+            if not self.checkpoints or self.checkpoints[-1][0] < to_block:
+                self.checkpoints.append((to_block, await self._block_hash(to_block)))
+            self._dirty = True
+            from_block = to_block + 1
+
+        # Anything deeper than reorg_depth is final
+        horizon = self.index.last_block - self.reorg_depth
+        self.index.prune_journal(horizon)
+        self.checkpoints = [entry for entry in self.checkpoints if entry[0] > horizon] or self.checkpoints[-1:]
+        self.index.synced = self.index.last_block >= target
+        return applied
+
+    async def run(self) -> None:
+        """Poll forever; errors are recorded and retried on the next cycle"""
+        while True:
+            if not self.chain.available:
+                # The chain client reconnects on its own; nothing to do until it does
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                await self.sync_once()
+                self.last_error = None
+                if self._dirty:
+                    await asyncio.to_thread(self.save_checkpoint)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"⚠️ Chain indexer error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    # ---- persistence ----
+
+    def save_checkpoint(self) -> None:
+        if not self.checkpoint_path:
+            return
+        state = {
+            "contract": self.contract_address,
+            "genesis": self.genesis,
+            "index": self.index.to_json(),
+            "checkpoints": self.checkpoints,
+        }
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp_path, self.checkpoint_path)
+        self._dirty = False
+
+    def load_checkpoint(self) -> None:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("contract") != self.contract_address:
+                # A different deployment; start over
+                return
+            self.index.load_json(state["index"])
+            self.genesis = state.get("genesis")
+            self.checkpoints = [tuple(entry) for entry in state["checkpoints"]]
+            print(f"✅ Chain index restored at block {self.index.last_block}")
+        except Exception as e:
+            print(f"⚠️ Could not load chain index checkpoint: {e}")
+            self.index.reset()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.index.stats(), "reorgs": self.reorgs, "resets": self.resets, "last_error": self.last_error}
@@ -0,0 +1,158 @@
+"""
+Background upload jobs
+
+Large uploads are spooled to disk by the request handler and processed later
+by a fixed number of worker tasks, so the HTTP request returns as soon as the
+bytes are received. The queue is bounded: when it is full new jobs are
+rejected instead of piling up, which keeps memory use and the latency of
+queued jobs bounded under bursts. Each job exposes its progress for polling;
+finished jobs are kept for `retention` seconds.
+"""
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+    pass
+
+class Job:
+    """State and progress of one queued upload"""
+
+    def __init__(self, kind: str, params: Dict[str, Any], total_bytes: int = 0):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = "queued"  # queued -> processing -> completed | failed
+        self.total_bytes = total_bytes
+        self.processed_bytes = 0
+        self.fragments_done = 0
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        progress = self.processed_bytes / self.total_bytes if self.total_bytes else (1.0 if self.finished else 0.0)
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": round(1.0 if self.status == "completed" else progress, 4),
+            "processed_bytes": self.processed_bytes,
+            "total_bytes": self.total_bytes,
+            "fragments_done": self.fragments_done,
+            "file_hash": self.result.get("file_hash") if self.result else None,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+class JobQueue:
+    """Bounded queue of jobs run by a fixed pool of worker tasks"""
+
+    def __init__(self, handler: Callable[[Job], Awaitable[Dict[str, Any]]], workers: int = 2,
+                 max_pending: int = 64, retention: float = 3600.0,
+                 cleanup: Optional[Callable[[Job], None]] = None):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.retention = retention
+        # Called once a job is done with its inputs (completed, failed or dropped)
+        self.cleanup = cleanup
+        self.jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # Jobs that never ran are dropped with the process
+        for job in self.jobs.values():
+            if job.status == "queued" and self.cleanup is not None:
+                self.cleanup(job)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def has_room(self) -> bool:
+        return self._queue is not None and not self._queue.full()
+
+    def submit(self, job: Job) -> Job:
+        """Queue a job, raising QueueFullError when the queue is full"""
+        if self._queue is None:
+            raise QueueFullError("Job queue is not running")
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Job queue is full ({self.max_pending} pending)")
+        self._prune()
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _prune(self) -> None:
+        """Forget finished jobs older than the retention period"""
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status = "processing"
+            job.started_at = time.time()
+            try:
+                job.result = await self.handler(job)
+                job.status = "completed"
+                self.completed += 1
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Server shutting down"
+                raise
+            except Exception as e:
+                job.status = "failed"
+                job.error = getattr(e, "detail", None) or str(e)
+                self.failed += 1
+                print(f"❌ Job {job.id} failed: {job.error}")
+            finally:
+                job.finished_at = time.time()
+                if self.cleanup is not None:
+                    self.cleanup(job)
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "processing": sum(1 for job in self.jobs.values() if job.status == "processing"),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
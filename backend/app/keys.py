@@ -0,0 +1,373 @@
+"""
+Key management with envelope encryption
+
+A master key (from CHAINVAULT_MASTER_KEY or a local keyfile) never encrypts
+data itself. It wraps data keys with AES-256-GCM, and the wrapped keys are
+kept in a JSON keyring next to the data. Each upload gets its own data key and
+every fragment payload names the key it was sealed with, so:
+- any process that can read the keyfile (or has the env key) and the keyring
+  can decrypt every fragment, which lets several workers or hosts serve one
+  data directory and lets data survive restarts
+- rotating the master key only rewraps the data keys; fragment bodies are
+  not touched
+
+Upload data keys are not stored one by one: an upload's key id is a generation
+id plus a random suffix, and its key is derived (HKDF) from that generation's
+wrapped key. A process starts a new generation every `generation_uploads`
+uploads or `generation_seconds` seconds, so the keyring (and every process's
+key table) grows with time, not with the number of uploads, and an upload
+touches the keyring file only when it starts a generation. Keys written one per
+upload by older versions are still read.
+
+The keyring is a JSON-lines file: a header naming the master key, then one
+wrapped key per line. New keys are appended under an exclusive flock (a
+rotation rewrites the file), and processes read what was appended when they
+meet a key id they do not know, so keys created by another worker are picked
+up without a restart.
+"""
+import base64
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+KEY_SIZE = 32
+NONCE_SIZE = 12
+DATA_KEY_ID_BYTES = 8
+# An upload key id is GENERATION_ID_BYTES of generation id followed by a random suffix
+GENERATION_ID_BYTES = 4
+# Keyring id of a generation key: the prefix plus the generation id in hex
+GENERATION_PREFIX = "gen-"
+
+# Data key for the formats that carry no key id (Fernet, and AEAD payloads
+# written before envelope encryption); kept in the keyring like any other
+BASE_KEY_ID = "base"
+
+class KeyManagementError(Exception):
+    """Raised when the master key does not match the keyring or a key cannot be unwrapped"""
+    pass
+
+def master_key_id(master_key: bytes) -> str:
+    """Public identifier of a master key (a hash prefix, never the key)"""
+    return hashlib.sha256(b"chainvault-master-key" + master_key).hexdigest()[:16]
+
+def _decode_key(text: str) -> bytes:
+    key = base64.urlsafe_b64decode(text.strip().encode("ascii"))
+    if len(key) != KEY_SIZE:
+        raise KeyManagementError(f"Master key must be {KEY_SIZE} bytes, got {len(key)}")
+    return key
+
+def _write_keyfile(path: str, key: bytes, exclusive: bool = False) -> None:
+    """Write a base64 key file readable only by its owner"""
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_EXCL if exclusive else os.O_TRUNC)
+    fd = os.open(path, flags, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(base64.urlsafe_b64encode(key).decode("ascii") + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def load_master_key(value: Optional[str], path: Optional[str]) -> Tuple[bytes, str]:
+    """
+    (master key, source): from `value` (base64) if set, else from the keyfile at
+    `path` (created on first use), else a random key that lives with the process
+    """
+    if value:
+        return _decode_key(value), "env"
+    if path is None:
+        return os.urandom(KEY_SIZE), "ephemeral"
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if not os.path.exists(path):
+        try:
+            _write_keyfile(path, os.urandom(KEY_SIZE), exclusive=True)
+            print(f"🔑 Generated master key at {path}")
+        except FileExistsError:
+            pass  # Another worker created it first
+    with open(path, "r") as f:
+        return _decode_key(f.read()), "keyfile"
+
+class KeyManager:
+    """Data keys wrapped by a master key, persisted in a keyring file"""
+
+    # Derived upload keys kept ready
+    CACHED_KEYS = 1024
+
+    def __init__(self, master_key: bytes, source: str = "ephemeral", keyring_path: Optional[str] = None,
+                 keyfile_path: Optional[str] = None, generation_uploads: int = 10000,
+                 generation_seconds: float = 86400.0):
+        self.source = source
+        self.keyring_path = keyring_path
+        self.keyfile_path = keyfile_path
+        self._master = master_key
+        self.master_key_id = master_key_id(master_key)
+        # key id => unwrapped data key
+        self._keys: Dict[str, bytes] = {}
+        # key id => keyring entry ({"wrapped", "created_at"}), for rewriting the keyring
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        # Generation this process derives upload keys from: (generation id, key), uploads, start time
+        self.generation_uploads = generation_uploads
+        self.generation_seconds = generation_seconds
+        self._generation: Optional[Tuple[str, bytes]] = None
+        self._generation_uses = 0
+        self._generation_started = 0.0
+        self._generation_lock = threading.Lock()
+        # Upload key id => derived key, oldest first
+        self._derived: "OrderedDict[str, bytes]" = OrderedDict()
+        self.derived_keys = 0
+        # Inode and bytes of the keyring file already read
+        self._keyring_inode: Optional[int] = None
+        self._keyring_offset = 0
+        self.rotations = 0
+
+        if keyring_path is not None:
+            os.makedirs(os.path.dirname(keyring_path) or ".", exist_ok=True)
+            self._finish_rotation()
+            with self._file_lock():
+                self._read_keyring()
+        if BASE_KEY_ID not in self._keys:
+            self._add_key(BASE_KEY_ID, os.urandom(KEY_SIZE))
+
+    # ---- wrapping ----
+
+    @staticmethod
+    def _wrap(master: bytes, key_id: str, key: bytes) -> str:
+        nonce = os.urandom(NONCE_SIZE)
+        return base64.b64encode(nonce + AESGCM(master).encrypt(nonce, key, key_id.encode())).decode("ascii")
+
+    @staticmethod
+    def _unwrap(master: bytes, key_id: str, wrapped: str) -> bytes:
+        blob = base64.b64decode(wrapped)
+        try:
+            return AESGCM(master).decrypt(blob[:NONCE_SIZE], blob[NONCE_SIZE:], key_id.encode())
+        except Exception:
+            raise KeyManagementError(f"Data key {key_id} cannot be unwrapped with master key {master_key_id(master)}")
+
+    def _entry(self, key_id: str, key: bytes) -> Dict[str, Any]:
+        return {"wrapped": self._wrap(self._master, key_id, key), "created_at": datetime.now().isoformat()}
+
+    # ---- keyring file ----
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """Exclusive lock shared by every process using this keyring"""
+        with open(self.keyring_path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _finish_rotation(self) -> None:
+        """Complete a master key rotation interrupted after the keyring was rewritten"""
+        pending = self.keyfile_path + ".new" if self.keyfile_path else None
+        if pending is None or not os.path.exists(pending) or not os.path.exists(self.keyring_path):
+            return
+        with open(self.keyring_path, "rb") as f:
+            keyring_master = json.loads(f.readline()).get("master_key_id")
+        with open(pending, "r") as f:
+            new_master = _decode_key(f.read())
+        if keyring_master == master_key_id(new_master):
+            os.replace(pending, self.keyfile_path)
+            self._master, self.master_key_id = new_master, keyring_master
+            print(f"🔑 Completed master key rotation to {keyring_master}")
+        else:
+            os.unlink(pending)
+
+    def _read_keyring(self) -> None:
+        """Load keys appended to the keyring file since the last read (caller holds the file lock)"""
+        if not os.path.exists(self.keyring_path):
+            return
+        with open(self.keyring_path, "rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self._keyring_inode:
+                # New file (first read, or rewritten by a rotation): start from its header
+                self._keyring_inode, self._keyring_offset = inode, 0
+            f.seek(self._keyring_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Torn append; the writer's retry rewrites it
+                record = json.loads(line)
+                self._keyring_offset += len(line)
+                if "master_key_id" in record:
+                    self._check_master(record["master_key_id"])
+                    continue
+                key_id = record.pop("key_id")
+                if key_id not in self._keys:
+                    self._keys[key_id] = self._unwrap(self._master, key_id, record["wrapped"])
+                self._entries[key_id] = record
+
+    def _check_master(self, keyring_master: str) -> None:
+        if keyring_master != self.master_key_id and self.source == "keyfile":
+            # Another process rotated the master key; pick up the new keyfile
+            self._master, _ = load_master_key(None, self.keyfile_path)
+            self.master_key_id = master_key_id(self._master)
+        if keyring_master != self.master_key_id:
+            raise KeyManagementError(
+                f"Keyring {self.keyring_path} is wrapped with master key {keyring_master}, "
+                f"but master key {self.master_key_id} is loaded"
+            )
+
+    @staticmethod
+    def _line(record: Dict[str, Any]) -> bytes:
+        return json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def _write_keyring(self) -> None:
+        """Atomically replace the keyring file with every key (caller holds the file lock)"""
+        tmp_path = self.keyring_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._line({"version": 1, "master_key_id": self.master_key_id}))
+            for key_id, entry in self._entries.items():
+                f.write(self._line(dict(entry, key_id=key_id)))
+            f.flush()
+            os.fsync(f.fileno())
+            self._keyring_offset = f.tell()
+            self._keyring_inode = os.fstat(f.fileno()).st_ino
+        os.replace(tmp_path, self.keyring_path)
+
+    def _add_key(self, key_id: str, key: bytes) -> None:
+        with self._lock:
+            if self.keyring_path is None:
+                self._keys[key_id] = key
+                self._entries[key_id] = self._entry(key_id, key)
+                return
+            with self._file_lock():
+                # Catch up with keys (or a rotation) from other processes first
+                self._read_keyring()
+                if key_id in self._keys:
+                    return
+                entry = self._entry(key_id, key)
+                if self._keyring_inode is None:
+                    self._keys[key_id] = key
+                    self._entries[key_id] = entry
+                    self._write_keyring()
+                    return
+                # Appending keeps the cost of a new key independent of the keyring size
+                with open(self.keyring_path, "ab") as f:
+                    f.truncate(self._keyring_offset)  # Drop a torn append left by a crashed writer
+                    f.write(self._line(dict(entry, key_id=key_id)))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._keyring_offset = f.tell()
+                self._keys[key_id] = key
+                self._entries[key_id] = entry
+
+    # ---- keys ----
+
+    @property
+    def base_key(self) -> bytes:
+        """Base data key in Fernet key format"""
+        return base64.urlsafe_b64encode(self._keys[BASE_KEY_ID])
+
+    @staticmethod
+    def _derive(generation_key: bytes, key_id: str) -> bytes:
+        return HKDF(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=None,
+                    info=b"chainvault-data-key" + bytes.fromhex(key_id)).derive(generation_key)
+
+    def _current_generation(self) -> Tuple[str, bytes]:
+        """Generation to derive the next upload key from, starting (and persisting) a new one when due"""
+        with self._generation_lock:
+            if (self._generation is None or self._generation_uses >= self.generation_uploads
+                    or time.time() - self._generation_started >= self.generation_seconds):
+                key = os.urandom(KEY_SIZE)
+                while True:
+                    generation_id = os.urandom(GENERATION_ID_BYTES).hex()
+                    self._add_key(GENERATION_PREFIX + generation_id, key)
+                    # Another process may have taken the same id first
+                    if self._keys[GENERATION_PREFIX + generation_id] == key:
+                        break
+                self._generation = (generation_id, key)
+                self._generation_uses = 0
+                self._generation_started = time.time()
+            self._generation_uses += 1
+            return self._generation
+
+    def create_data_key(self) -> Tuple[str, bytes]:
+        """New (key id, data key) for an upload; its generation key is persisted before it is used"""
+        generation_id, generation_key = self._current_generation()
+        key_id = generation_id + os.urandom(DATA_KEY_ID_BYTES - GENERATION_ID_BYTES).hex()
+        key = self._derive(generation_key, key_id)
+        self._remember(key_id, key)
+        self.derived_keys += 1
+        return key_id, key
+
+    def _remember(self, key_id: str, key: bytes) -> None:
+        with self._lock:
+            self._derived[key_id] = key
+            if len(self._derived) > self.CACHED_KEYS:
+                self._derived.popitem(last=False)
+
+    def _lookup(self, key_id: str) -> Optional[bytes]:
+        # Keys stored one per upload (older keyrings) first, then keys derived from a generation
+        key = self._keys.get(key_id) or self._derived.get(key_id)
+        if key is not None:
+            return key
+        generation_key = self._keys.get(GENERATION_PREFIX + key_id[:2 * GENERATION_ID_BYTES])
+        if generation_key is None:
+            return None
+        key = self._derive(generation_key, key_id)
+        self._remember(key_id, key)
+        return key
+
+    def data_key(self, key_id: str) -> bytes:
+        """Unwrapped data key; the keyring is reloaded once for ids created by other processes"""
+        key = self._lookup(key_id)
+        if key is None and self.keyring_path is not None:
+            with self._lock, self._file_lock():
+                self._read_keyring()
+            key = self._lookup(key_id)
+        if key is None:
+            raise KeyManagementError(f"Unknown data key {key_id}")
+        return key
+
+    def rotate_master_key(self, new_master: Optional[bytes] = None) -> str:
+        """
+        Rewrap every data key with a new master key and return its id
+        Only the keyring (and keyfile) change; stored fragments stay as they are.
+        """
+        if self.source == "env":
+            raise KeyManagementError("Master key comes from CHAINVAULT_MASTER_KEY; rotate it by restarting with both keys")
+        new_master = new_master or os.urandom(KEY_SIZE)
+        new_id = master_key_id(new_master)
+        with self._lock:
+            if self.keyring_path is None:
+                self._entries = {key_id: dict(entry, wrapped=self._wrap(new_master, key_id, self._keys[key_id]))
+                                 for key_id, entry in self._entries.items()}
+                self._master, self.master_key_id = new_master, new_id
+                self.rotations += 1
+                return new_id
+            with self._file_lock():
+                self._read_keyring()
+                # The new key is staged next to the keyfile until the keyring is rewrapped,
+                # so a crash at any point leaves a key that opens the keyring
+                pending = self.keyfile_path + ".new"
+                _write_keyfile(pending, new_master)
+                self._entries = {key_id: dict(entry, wrapped=self._wrap(new_master, key_id, self._keys[key_id]))
+                                 for key_id, entry in self._entries.items()}
+                self._master, self.master_key_id = new_master, new_id
+                self._write_keyring()
+                os.replace(pending, self.keyfile_path)
+        self.rotations += 1
+        print(f"🔑 Rotated master key to {new_id} ({len(self._keys)} data keys rewrapped)")
+        return new_id
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "master_key_id": self.master_key_id,
+            "master_key_source": self.source,
+            "data_keys": len(self._keys),
+            "key_generations": sum(1 for key_id in self._keys if key_id.startswith(GENERATION_PREFIX)),
+            "derived_keys_issued": self.derived_keys,
+            "rotations": self.rotations,
+            "persistent": self.keyring_path is not None
+        }
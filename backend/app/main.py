@@ -1,18 +1,98 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Body, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import hashlib
+import hmac
 import os
 import io
 import base64
-from cryptography.fernet import Fernet
-from typing import List, Dict, Any
+import uuid
+import asyncio
+import tempfile
+import tarfile
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import partial
+from urllib.parse import quote
+from typing import List, Dict, Any, AsyncIterator, Awaitable, Callable, Iterator, Optional, Tuple, Union
 import json
 from datetime import datetime
 from web3 import Web3
 import json as json_lib
 
-app = FastAPI(title="ChainVault Backend", version="1.0.0")
+from . import crypto_executor as crypto
+from .crypto_executor import CryptoExecutor
+from .storage import (CatalogLog, FragmentStore, RefCountedStore, SegmentFragmentStore, SharedRefCountedStore,
+                      SQLiteCatalog, create_fragment_store, lock_file)
+from .access import AccessResolver
+from .indexer import ChainIndex, ChainIndexer
+from .chunking import CDCChunker
+from .chain import ChainClient
+from .trust import TrustCache
+from .merkle import inclusion_proof, merkle_root, verify_inclusion
+from .jobs import Job, JobQueue, QueueFullError
+from .fragments import FragmentTable
+from .compression import decompress_chunk, resolve_codec
+from .ciphers import FragmentCipher, payload_key_id
+from .keys import BASE_KEY_ID, KeyManagementError, KeyManager, load_master_key
+from .placement import PlacementEngine
+from .scrub import Scrubber
+from .cache import FragmentCache
+from .catalog import SORT_FIELDS, CatalogIndex, StripeIndex, decode_cursor, encode_cursor
+from .metrics import FRAGMENT_BUCKETS, MetricsMiddleware, MetricsRegistry, StageTimer, hit_ratio, monitor_event_loop
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop background resources with the application"""
+    # Connects lazily; a slow or unreachable RPC never holds up startup
+    await chain.start()
+    upload_jobs.start()
+    indexer_task = asyncio.create_task(chain_indexer.run()) if chain_indexer is not None else None
+    loop_monitor = asyncio.create_task(monitor_event_loop(loop_lag, loop_blocked, LOOP_LAG_INTERVAL)) if METRICS_ENABLED else None
+    scrub_task = asyncio.create_task(scrubber.run()) if scrub_leader else None
+    sync_task = asyncio.create_task(sync_shared_state()) if SHARED_STATE else None
+    compaction_task = asyncio.create_task(compact_periodically()) if COMPACTION_INTERVAL > 0 and segment_stores() else None
+    yield
+    if sync_task is not None:
+        sync_task.cancel()
+    if compaction_task is not None:
+        compaction_task.cancel()
+    if compaction is not None:
+        # Stores are closed below; a compaction already running must finish first
+        await asyncio.wait([compaction])
+    if scrub_task is not None:
+        scrub_task.cancel()
+        try:
+            await scrub_task
+        except asyncio.CancelledError:
+            pass
+        scrubber.save_checkpoint()
+    if loop_monitor is not None:
+        loop_monitor.cancel()
+    if indexer_task is not None:
+        indexer_task.cancel()
+        try:
+            await indexer_task
+        except asyncio.CancelledError:
+            pass
+        chain_indexer.save_checkpoint()
+    await upload_jobs.stop()
+    await chain.stop()
+    crypto_pool.shutdown()
+    fragment_store.close()
+    placement.close()
+    if catalog_log is not None:
+        catalog_log.close()
+
+async def sync_catalog_dependency() -> None:
+    """Apply other workers' catalog changes before every request, so all workers answer alike"""
+    if SHARED_STATE:
+        sync_catalog()
+
+app = FastAPI(title="ChainVault Backend", version="1.0.0", lifespan=lifespan,
+              dependencies=[Depends(sync_catalog_dependency)])
 
 # Enable CORS for frontend communication
 app.add_middleware(
@@ -21,24 +101,140 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Disposition", "Content-Range", "Accept-Ranges", "X-ChainVault-File-Hash", "X-ChainVault-Fragments-Used",
+                    "X-ChainVault-Total-Fragments", "X-ChainVault-Failed-Fragments", "X-ChainVault-File-Count"],
 )
 
 # ============ BLOCKCHAIN CONFIGURATION ============
-BLOCKCHAIN_RPC = "http://127.0.0.1:8545"
+BLOCKCHAIN_RPC = os.getenv("CHAINVAULT_RPC_URL", "http://127.0.0.1:8545")
 BLOCKCHAIN_CHAIN_ID = 31337
 CONTRACT_ADDRESS = "0x5FbDB2315678afecb367f032d93F642f64180aa3"
+# Seconds an access decision stays cached (events invalidate it sooner)
+ACCESS_CACHE_TTL = float(os.getenv("CHAINVAULT_ACCESS_CACHE_TTL", 30))
+# Background event indexer; handlers answer ownership/permission/trust queries from it once synced
+INDEXER_ENABLED = os.getenv("CHAINVAULT_INDEXER", "1") == "1"
+INDEXER_CONFIRMATIONS = int(os.getenv("CHAINVAULT_INDEXER_CONFIRMATIONS", 0))
+INDEXER_POLL_INTERVAL = float(os.getenv("CHAINVAULT_INDEXER_POLL_INTERVAL", 1.0))
+# Pooled keep-alive RPC connections; health is checked in the background every RPC_HEALTH_INTERVAL seconds
+RPC_POOL_SIZE = int(os.getenv("CHAINVAULT_RPC_POOL_SIZE", 32))
+RPC_TIMEOUT = float(os.getenv("CHAINVAULT_RPC_TIMEOUT", 10))
+RPC_HEALTH_INTERVAL = float(os.getenv("CHAINVAULT_RPC_HEALTH_INTERVAL", 5))
+# Node trust scores are served from cache for TRUST_CACHE_TTL seconds, then served stale
+# for up to TRUST_CACHE_STALE more seconds while a background refresh runs
+TRUST_CACHE_TTL = float(os.getenv("CHAINVAULT_TRUST_CACHE_TTL", 30))
+TRUST_CACHE_STALE = float(os.getenv("CHAINVAULT_TRUST_CACHE_STALE", 300))
 
-# Initialize Web3 connection
-try:
-    w3 = Web3(Web3.HTTPProvider(BLOCKCHAIN_RPC))
-    if w3.is_connected():
-        print("✅ Connected to blockchain at", BLOCKCHAIN_RPC)
-    else:
-        print("⚠️ Warning: Could not connect to blockchain")
-        w3 = None
-except Exception as e:
-    print(f"⚠️ Blockchain connection error: {e}")
-    w3 = None
+# ============ PIPELINE CONFIGURATION ============
+# Fragment size used by the upload pipeline; uploads are read in chunks of this size
+# so memory per upload stays bounded regardless of file size
+FRAGMENT_SIZE = int(os.getenv("CHAINVAULT_FRAGMENT_SIZE", 1024 * 64))
+# "cdc" cuts fragments at content-defined boundaries averaging FRAGMENT_SIZE, so an edit
+# only changes the fragments around it; "fixed" cuts at FRAGMENT_SIZE offsets.
+# Parity fragments are as long as the longest fragment of their stripe, and CDC fragments
+# range up to 4x FRAGMENT_SIZE, so with erasure coding CDC costs about 1.65x storage for
+# k=4, m=2 instead of 1.5x. The default is therefore "fixed" while parity is enabled.
+CHUNKING = os.getenv("CHAINVAULT_CHUNKING", "fixed" if int(os.getenv("CHAINVAULT_ERASURE_M", 2)) else "cdc")
+# Fragment crypto runs on a "process" or "thread" pool; workers default to the core count
+CRYPTO_EXECUTOR_MODE = os.getenv("CHAINVAULT_CRYPTO_EXECUTOR", "process")
+CRYPTO_WORKERS = int(os.getenv("CHAINVAULT_CRYPTO_WORKERS", 0)) or None
+CRYPTO_BATCH_SIZE = int(os.getenv("CHAINVAULT_CRYPTO_BATCH_SIZE", 8))
+# Compress fragments before encryption: "auto" (zstd, lz4 or zlib, whichever is installed),
+# a codec name, or "none". Fragments that do not compress are stored as-is.
+COMPRESSION = os.getenv("CHAINVAULT_COMPRESSION", "auto")
+# Fragment cipher: "aes-gcm" or "chacha20" (raw binary AEAD), or "fernet" (the original
+# token format). Fragments in any of these formats can always be read.
+CIPHER_ENGINE = os.getenv("CHAINVAULT_CIPHER", "aes-gcm")
+# Reed-Solomon erasure coding: every stripe of ERASURE_DATA_SHARDS fragments gets
+# ERASURE_PARITY_SHARDS parity fragments, and any ERASURE_DATA_SHARDS of them rebuild
+# the stripe. ERASURE_PARITY_SHARDS=0 disables parity.
+ERASURE_DATA_SHARDS = int(os.getenv("CHAINVAULT_ERASURE_K", 4))
+ERASURE_PARITY_SHARDS = int(os.getenv("CHAINVAULT_ERASURE_M", 2))
+# Verified plaintext of recently read fragments is kept in memory (up to FRAGMENT_CACHE_BYTES) so
+# hot files are not decrypted and re-hashed on every retrieval. 0 disables it, so no plaintext
+# outlives a request (for deployments where that matters).
+FRAGMENT_CACHE_BYTES = int(os.getenv("CHAINVAULT_FRAGMENT_CACHE_BYTES", 64 * 1024 * 1024))
+
+# ============ STORAGE CONFIGURATION ============
+# "segment" keeps fragments and the catalog on disk under DATA_DIR; "memory" keeps everything in-process.
+# "sqlite" keeps them in SQLite databases under DATA_DIR that several worker processes (uvicorn --workers N)
+# share: each worker keeps an in-memory copy of the catalog, brought up to date with the others' changes
+# before every request and every CATALOG_SYNC_INTERVAL seconds. With STORAGE_SYNC, every segment record
+# and catalog log record is fsynced as it is written, so a stored upload survives a power loss, not
+# just a process crash.
+STORAGE_BACKEND = os.getenv("CHAINVAULT_STORAGE_BACKEND", "segment")
+STORAGE_SYNC = os.getenv("CHAINVAULT_STORAGE_SYNC", "0") == "1"
+DATA_DIR = os.getenv("CHAINVAULT_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+CATALOG_SYNC_INTERVAL = float(os.getenv("CHAINVAULT_CATALOG_SYNC_INTERVAL", 1.0))
+SHARED_STATE = STORAGE_BACKEND == "sqlite"
+
+# ============ PLACEMENT CONFIGURATION ============
+# Every new fragment payload is also copied to REPLICATION trusted storage nodes (0 disables
+# placement). Reads ask the best replica and hedge to the next one after HEDGE_DELAY seconds;
+# at most FETCH_CONCURRENCY replica reads run at once. Nodes are stand-in stores under DATA_DIR/nodes.
+REPLICATION = int(os.getenv("CHAINVAULT_REPLICATION", 2))
+HEDGE_DELAY = float(os.getenv("CHAINVAULT_HEDGE_DELAY", 0.05))
+FETCH_CONCURRENCY = int(os.getenv("CHAINVAULT_FETCH_CONCURRENCY", 32))
+
+# ============ SCRUB CONFIGURATION ============
+# A background scrubber re-verifies every stored fragment copy (local store and node replicas) once
+# every SCRUB_INTERVAL seconds (0: only when POST /scrub asks), rewriting bad copies from good ones
+# or from parity. It reads at most SCRUB_RATE_BYTES payload bytes per second, SCRUB_CONCURRENCY
+# batches of SCRUB_BATCH_SIZE fragments at a time, and only while the crypto pool has an idle worker.
+SCRUB_INTERVAL = float(os.getenv("CHAINVAULT_SCRUB_INTERVAL", 86400))
+SCRUB_RATE_BYTES = int(os.getenv("CHAINVAULT_SCRUB_RATE_BYTES", 8 * 1024 * 1024))
+SCRUB_BATCH_SIZE = int(os.getenv("CHAINVAULT_SCRUB_BATCH_SIZE", 16))
+SCRUB_CONCURRENCY = int(os.getenv("CHAINVAULT_SCRUB_CONCURRENCY", 2))
+
+# ============ COMPACTION CONFIGURATION ============
+# With the segment backend, deleted and replaced payloads stay in their segment files until the
+# segment is compacted. Every COMPACTION_INTERVAL seconds (0: only when POST /storage/compact asks)
+# sealed segments, local and on nodes, whose bytes are at least COMPACTION_DEAD_RATIO dead are rewritten.
+COMPACTION_INTERVAL = float(os.getenv("CHAINVAULT_COMPACTION_INTERVAL", 300))
+COMPACTION_DEAD_RATIO = float(os.getenv("CHAINVAULT_COMPACTION_DEAD_RATIO", 0.5))
+
+# ============ KEY CONFIGURATION ============
+# Master key (base64, 32 bytes) from CHAINVAULT_MASTER_KEY, else from MASTER_KEY_FILE, which is
+# generated on first start. With the memory backend and no key configured, keys die with the process.
+MASTER_KEY = os.getenv("CHAINVAULT_MASTER_KEY")
+MASTER_KEY_FILE = os.getenv("CHAINVAULT_MASTER_KEY_FILE",
+                            os.path.join(DATA_DIR, "master.key") if STORAGE_BACKEND != "memory" else None)
+# Upload data keys are derived from a wrapped generation key; a process starts a new one this often
+KEY_GENERATION_UPLOADS = int(os.getenv("CHAINVAULT_KEY_GENERATION_UPLOADS", 10000))
+KEY_GENERATION_SECONDS = float(os.getenv("CHAINVAULT_KEY_GENERATION_SECONDS", 86400))
+
+# ============ ADMIN CONFIGURATION ============
+# Operator actions (POST /keys/rotate, /scrub and /storage/compact) need this token in the
+# X-ChainVault-Admin-Token header; while it is unset they are disabled
+ADMIN_TOKEN = os.getenv("CHAINVAULT_ADMIN_TOKEN")
+
+# ============ UPLOAD JOB CONFIGURATION ============
+# Background uploads (/upload?background=true) are spooled to disk and processed by
+# UPLOAD_WORKERS tasks; at most UPLOAD_QUEUE_SIZE jobs wait, further uploads get a 503
+UPLOAD_WORKERS = int(os.getenv("CHAINVAULT_UPLOAD_WORKERS", 2))
+UPLOAD_QUEUE_SIZE = int(os.getenv("CHAINVAULT_UPLOAD_QUEUE_SIZE", 64))
+UPLOAD_JOB_RETENTION = float(os.getenv("CHAINVAULT_UPLOAD_JOB_RETENTION", 3600))  # Seconds finished jobs stay pollable
+UPLOAD_SPOOL_CHUNK = 1024 * 1024
+
+# ============ LISTING CONFIGURATION ============
+# Largest page GET /files?limit= returns; without a limit every matching file is listed
+MAX_FILES_PAGE = int(os.getenv("CHAINVAULT_MAX_FILES_PAGE", 1000))
+
+# ============ BATCH CONFIGURATION ============
+# /upload/batch and /retrieve/batch take at most BATCH_MAX_FILES files. Uploads run BATCH_UPLOAD_CONCURRENCY
+# files through the pipeline at once; the returned manifest splits chain registration into registerFiles
+# calls of at most BATCH_REGISTER_FRAGMENTS fragments (gas grows with fragments). Batch retrieval
+# decrypts up to BATCH_PREFETCH_FILES files of at most BATCH_PREFETCH_BYTES ahead of the archive stream.
+BATCH_MAX_FILES = int(os.getenv("CHAINVAULT_BATCH_MAX_FILES", 10000))
+BATCH_UPLOAD_CONCURRENCY = int(os.getenv("CHAINVAULT_BATCH_UPLOAD_CONCURRENCY", 4))
+BATCH_REGISTER_FRAGMENTS = int(os.getenv("CHAINVAULT_BATCH_REGISTER_FRAGMENTS", 256))
+BATCH_PREFETCH_FILES = int(os.getenv("CHAINVAULT_BATCH_PREFETCH_FILES", 8))
+BATCH_PREFETCH_BYTES = int(os.getenv("CHAINVAULT_BATCH_PREFETCH_BYTES", 1024 * 1024))
+
+# ============ METRICS CONFIGURATION ============
+# GET /metrics serves Prometheus metrics: per-fragment and per-file stage timings, RPC calls,
+# request latency and bytes, cache hit ratios and event-loop lag (sampled every LOOP_LAG_INTERVAL seconds)
+METRICS_ENABLED = os.getenv("CHAINVAULT_METRICS", "1") == "1"
+LOOP_LAG_INTERVAL = float(os.getenv("CHAINVAULT_LOOP_LAG_INTERVAL", 0.25))
 
 # Smart Contract ABI (minimal interface for access control)
 CONTRACT_ABI = [
@@ -52,6 +248,20 @@ CONTRACT_ABI = [
         "stateMutability": "view",
         "type": "function"
     },
+    {
+        "inputs": [{"internalType": "string", "name": "", "type": "string"}],
+        "name": "files",
+        "outputs": [
+            {"internalType": "string", "name": "fileHash", "type": "string"},
+            {"internalType": "address", "name": "owner", "type": "address"},
+            {"internalType": "uint256", "name": "timestamp", "type": "uint256"},
+            {"internalType": "uint256", "name": "fileSize", "type": "uint256"},
+            {"internalType": "string", "name": "fileName", "type": "string"},
+            {"internalType": "bool", "name": "exists", "type": "bool"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    },
     {
         "inputs": [{"internalType": "string", "name": "fileHash", "type": "string"}],
         "name": "getFileMetadata",
@@ -73,31 +283,251 @@ CONTRACT_ABI = [
         ],
         "stateMutability": "view",
         "type": "function"
+    },
+    {
+        "inputs": [],
+        "name": "getAllStorageNodes",
+        "outputs": [{"internalType": "address[]", "name": "", "type": "address[]"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [],
+        "name": "getTrustedNodes",
+        "outputs": [{"internalType": "address[]", "name": "", "type": "address[]"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "address", "name": "", "type": "address"}],
+        "name": "storageNodes",
+        "outputs": [
+            {"internalType": "address", "name": "nodeAddress", "type": "address"},
+            {"internalType": "uint256", "name": "trustScore", "type": "uint256"},
+            {"internalType": "uint256", "name": "totalStored", "type": "uint256"},
+            {"internalType": "uint256", "name": "successfulRetrievals", "type": "uint256"},
+            {"internalType": "uint256", "name": "failedRetrievals", "type": "uint256"},
+            {"internalType": "bool", "name": "isActive", "type": "bool"},
+            {"internalType": "uint256", "name": "lastActivity", "type": "uint256"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
     }
 ]
 
-# Initialize contract instance
-try:
-    if w3 is not None:
-        contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI)
-        print("✅ Smart contract interface initialized")
-    else:
-        contract = None
-except Exception as e:
-    print(f"⚠️ Contract initialization error: {e}")
-    contract = None
+# Metrics updated as requests run; cache and queue figures are collected when /metrics is scraped
+metrics = MetricsRegistry()
+fragment_stage_seconds = metrics.histogram(
+    "chainvault_fragment_stage_seconds", "Time spent on one fragment in each pipeline stage", ["stage"], FRAGMENT_BUCKETS)
+file_stage_seconds = metrics.histogram(
+    "chainvault_file_stage_seconds", "Time spent on one file in each stage (total = whole operation)", ["operation", "stage"])
+rpc_calls = metrics.counter("chainvault_rpc_calls_total", "Contract and chain RPC calls", ["method"])
+rpc_seconds = metrics.histogram("chainvault_rpc_seconds", "RPC round-trip time (batched calls share one round trip)", ["method"])
+request_seconds = metrics.histogram("chainvault_http_request_seconds", "HTTP request latency", ["endpoint", "method", "status"])
+request_bytes = metrics.counter("chainvault_http_received_bytes_total", "HTTP request body bytes", ["endpoint"])
+response_bytes = metrics.counter("chainvault_http_sent_bytes_total", "HTTP response body bytes", ["endpoint"])
+loop_lag = metrics.histogram("chainvault_event_loop_lag_seconds", "How late the event loop woke from a timed sleep")
+loop_blocked = metrics.counter("chainvault_event_loop_blocked_seconds_total", "Time the event loop was blocked past its timers")
+
+def observe_fragment_stages(times: Dict[str, List[float]]) -> None:
+    for stage, values in times.items():
+        for seconds in values:
+            fragment_stage_seconds.observe(seconds, stage)
+
+def file_timer() -> Optional[StageTimer]:
+    """Stage timer for one upload or retrieval (None when metrics are off)"""
+    return StageTimer() if METRICS_ENABLED else None
+
+def observe_file_stages(operation: str, timer: Optional[StageTimer]) -> None:
+    if timer is None:
+        return
+    for stage, seconds in timer.stages.items():
+        file_stage_seconds.observe(seconds, operation, stage)
+    file_stage_seconds.observe(timer.elapsed(), operation, "total")
+
+def observe_rpc(method: str, seconds: float, calls: int) -> None:
+    rpc_calls.inc(method, amount=calls)
+    rpc_seconds.observe(seconds, method)
 
-# In-memory storage for demo purposes
-# In production, this would be a proper database
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, latency=request_seconds, received=request_bytes, sent=response_bytes)
+
+# Async contract client, started by the app lifespan
+chain = ChainClient(
+    BLOCKCHAIN_RPC, CONTRACT_ADDRESS, CONTRACT_ABI,
+    pool_size=RPC_POOL_SIZE,
+    request_timeout=RPC_TIMEOUT,
+    health_interval=RPC_HEALTH_INTERVAL,
+    observer=observe_rpc if METRICS_ENABLED else None
+)
+
+# Batched, cached resolver for GET /files?account=
+access_resolver = AccessResolver(chain, ttl=ACCESS_CACHE_TTL)
+
+# Encrypted fragment payloads live in the fragment store under the hash of their
+# plaintext, shared by every file that contains them; the catalog below only
+# holds metadata and each fragment's storage_key
+if SHARED_STATE:
+    # Reference counts live in the shared database, next to the payloads
+    fragment_store = SharedRefCountedStore(create_fragment_store(STORAGE_BACKEND, DATA_DIR, sync=STORAGE_SYNC))
+    catalog_log = SQLiteCatalog(os.path.join(DATA_DIR, "catalog.db"))
+else:
+    fragment_store = RefCountedStore(create_fragment_store(STORAGE_BACKEND, DATA_DIR, sync=STORAGE_SYNC))
+    catalog_log = CatalogLog(os.path.join(DATA_DIR, "catalog.log"), sync=STORAGE_SYNC) if STORAGE_BACKEND != "memory" else None
+
+# File catalog, replayed from the catalog log when the storage backend is persistent
+# (with shared state, this worker's copy of the catalog: see sync_catalog)
 uploaded_files: Dict[str, Dict[str, Any]] = {}
-file_fragments: Dict[str, List[Dict[str, Any]]] = {}
+file_fragments: Dict[str, FragmentTable] = {}
+if catalog_log is not None:
+    uploaded_files, file_fragments = catalog_log.load(FragmentTable.from_records)
+    print(f"✅ Loaded {len(uploaded_files)} files from {DATA_DIR}")
+    orphaned = fragment_store.load_refs(fragments.stored_payloads() for fragments in file_fragments.values())
+    if orphaned:
+        print(f"🧹 Removed {orphaned} unreferenced fragments")
+
+# Owner, event topic, upload time and filename indexes for GET /files, kept current by cache_file/uncache_file
+catalog_index = CatalogIndex.build(uploaded_files)
+
+# Erasure stripes by payload, for rebuilding a damaged payload from parity; kept current by cache_file/uncache_file
+stripe_index = StripeIndex.build(file_fragments)
+
+# Running catalog totals, kept current by cache_file/uncache_file so stats never walk every file
+catalog_totals = {
+    "fragments": sum(len(fragments) for fragments in file_fragments.values()),
+    "size_bytes": sum(metadata["original_size"] for metadata in uploaded_files.values()),
+    "table_bytes": sum(fragments.nbytes for fragments in file_fragments.values()),
+    "compressed_fragments": sum(fragments.compressed_count for fragments in file_fragments.values())
+}
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Spooled background uploads, named upload-<pid>-*.part after the worker process that queued them;
+# jobs do not survive their process, so leftovers of processes that are gone are removed
+SPOOL_DIR = os.path.join(DATA_DIR, "spool") if STORAGE_BACKEND != "memory" else None
+if SPOOL_DIR is not None:
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    for name in os.listdir(SPOOL_DIR):
+        if not name.endswith(".part"):
+            continue
+        owner = name.split("-")[1] if name.count("-") >= 2 else ""
+        # A file named after this process's pid is left over from an earlier process that had it
+        if not owner.isdigit() or int(owner) == os.getpid() or not process_alive(int(owner)):
+            os.unlink(os.path.join(SPOOL_DIR, name))
+
+# Local index of contract state, kept current by the background indexer
+chain_index = ChainIndex()
+chain_indexer = None
+if INDEXER_ENABLED:
+    chain_indexer = ChainIndexer(
+        chain, CONTRACT_ADDRESS, chain_index,
+        checkpoint_path=os.path.join(DATA_DIR, "chain_index.json") if STORAGE_BACKEND != "memory" else None,
+        confirmations=INDEXER_CONFIRMATIONS,
+        poll_interval=INDEXER_POLL_INTERVAL
+    )
+# Cached storage node records for node selection and trust updates
+trust_cache = TrustCache(chain, chain_index, ttl=TRUST_CACHE_TTL, stale_ttl=TRUST_CACHE_STALE)
+
+# Master key and wrapped data keys; persisted next to the data so every worker process
+# (and every restart) can decrypt what the others stored
+key_manager = KeyManager(*load_master_key(MASTER_KEY, MASTER_KEY_FILE),
+                         keyring_path=os.path.join(DATA_DIR, "keyring.jsonl") if STORAGE_BACKEND != "memory" else None,
+                         keyfile_path=MASTER_KEY_FILE, generation_uploads=KEY_GENERATION_UPLOADS,
+                         generation_seconds=KEY_GENERATION_SECONDS)
+# Base key, for fragments written without a per-upload data key
+ENCRYPTION_KEY = key_manager.base_key
+cipher_suite = FragmentCipher(ENCRYPTION_KEY, CIPHER_ENGINE)
+
+def verify_replica(payload: bytes) -> bool:
+    """Whether a node's copy of a payload authenticates under its data key (run on placement reader threads)"""
+    key_id = payload_key_id(payload)
+    try:
+        data_key = key_manager.data_key(key_id) if key_id is not None else None
+    except KeyManagementError:
+        return False
+    return cipher_suite.authenticate(payload, data_key)
+
+# Storage nodes are stood in for by a fragment store per node address under NODES_DIR
+NODES_DIR = os.path.join(DATA_DIR, "nodes")
+
+def open_storage_node(address: str) -> FragmentStore:
+    return create_fragment_store(STORAGE_BACKEND, os.path.join(NODES_DIR, address))
+
+def node_addresses() -> List[str]:
+    return sorted(os.listdir(NODES_DIR)) if STORAGE_BACKEND != "memory" and os.path.isdir(NODES_DIR) else []
+
+# Replicates fragment payloads to trusted nodes and fetches them back with hedged reads
+placement = PlacementEngine(open_storage_node, trust_cache, replication=REPLICATION,
+                            hedge_delay=HEDGE_DELAY, max_fetches=FETCH_CONCURRENCY, verify=verify_replica)
+if node_addresses():
+    orphaned = placement.load(node_addresses(), fragment_store.__contains__)
+    if orphaned:
+        print(f"🧹 Removed {orphaned} unreferenced fragment replicas")
+
 # Track which nodes store which fragments for trust-aware operations
-fragment_storage: Dict[str, List[str]] = {}  # fragment_hash => [node_addresses]
-node_trust_cache: Dict[str, int] = {}  # node_address => trust_score (cached)
+fragment_storage: Dict[str, List[str]] = placement.replicas  # fragment_hash => [node_addresses]
+
+# Files whose catalog fragment hashes have been checked against their Merkle root
+verified_trees: set = set()
+
+# Content-defined chunker shared by all uploads (None = fixed-size fragments)
+cdc_chunker = CDCChunker(FRAGMENT_SIZE) if CHUNKING == "cdc" else None
+if cdc_chunker is not None and ERASURE_PARITY_SHARDS:
+    print(f"⚠️ CDC chunking with erasure coding: parity is padded to each stripe's longest fragment, "
+          f"so storage overhead exceeds {(ERASURE_DATA_SHARDS + ERASURE_PARITY_SHARDS) / ERASURE_DATA_SHARDS:.2f}x")
+
+# Parallel executor for fragment encryption/decryption, so large files do not block the event loop
+crypto_pool = CryptoExecutor(ENCRYPTION_KEY, mode=CRYPTO_EXECUTOR_MODE, workers=CRYPTO_WORKERS,
+                             batch_size=CRYPTO_BATCH_SIZE, compression=resolve_codec(COMPRESSION),
+                             engine=CIPHER_ENGINE, observer=observe_fragment_stages if METRICS_ENABLED else None)
+
+@metrics.collector
+def collect_component_metrics():
+    """Cache, queue and placement figures the components already count"""
+    access = access_resolver.stats()
+    caches = {"trust_nodes": trust_cache.stats(), "file_owners": access["owners"], "file_access": access["access"],
+              "fragment_plaintext": fragment_cache.stats()}
+    yield ("chainvault_cache_hits_total", "counter", "Cache lookups answered from cache (stale hits included)",
+           [({"cache": name}, stats["hits"] + stats.get("stale_hits", 0)) for name, stats in caches.items()])
+    yield ("chainvault_cache_misses_total", "counter", "Cache lookups that went to the chain",
+           [({"cache": name}, stats["misses"]) for name, stats in caches.items()])
+    yield ("chainvault_cache_hit_ratio", "gauge", "Share of cache lookups answered from cache",
+           [({"cache": name}, hit_ratio(stats["hits"] + stats.get("stale_hits", 0), stats["misses"]))
+            for name, stats in caches.items()])
+    store = fragment_store.stats()
+    yield ("chainvault_fragment_dedup_hits_total", "counter", "Fragments stored by referencing an existing payload",
+           [({}, store["dedup_hits"])])
+    yield ("chainvault_stored_fragments", "gauge", "Fragment payloads in the fragment store", [({}, store["fragments"])])
+    yield ("chainvault_files", "gauge", "Files in the catalog", [({}, len(uploaded_files))])
+    jobs = upload_jobs.stats()
+    yield ("chainvault_upload_jobs", "gauge", "Background upload jobs by state",
+           [({"state": "pending"}, jobs["pending"]), ({"state": "processing"}, jobs["processing"])])
+    yield ("chainvault_upload_jobs_finished_total", "counter", "Background upload jobs by outcome",
+           [({"outcome": outcome}, jobs[outcome]) for outcome in ("completed", "failed", "rejected")])
+    replicas = placement.stats()
+    yield ("chainvault_replica_fetches_total", "counter", "Fragment payload fetches from replicas", [({}, replicas["fetches"])])
+    yield ("chainvault_replica_events_total", "counter", "Hedged reads, backup replica answers, node failures and local fallbacks",
+           [({"event": event}, replicas[event]) for event in ("hedged", "backup_reads", "failures", "corrupt_replicas", "local_fallbacks")])
+    scrub = scrubber.stats()
+    yield ("chainvault_scrub_checked_total", "counter", "Fragment copies and payload bytes verified by the scrubber",
+           [({"unit": "copies"}, scrub["copies_checked"]), ({"unit": "bytes"}, scrub["bytes_checked"])])
+    yield ("chainvault_scrub_problems_total", "counter", "Bad fragment copies found by the scrubber",
+           [({"problem": problem}, scrub[problem]) for problem in ("corrupt", "missing")])
+    yield ("chainvault_scrub_repaired_total", "counter", "Bad fragment copies rewritten by the scrubber", [({}, scrub["repaired"])])
+    yield ("chainvault_scrub_unrepaired_fragments", "gauge", "Fragments with bad copies the scrubber could not repair",
+           [({}, scrub["unrepaired"])])
+    yield ("chainvault_scrub_progress", "gauge", "Share of the current scrub pass done (1 between passes)",
+           [({}, scrub["current_pass"]["progress"] if scrub["current_pass"] else 1.0)])
 
-# Encryption key (in production, this should be securely managed)
-ENCRYPTION_KEY = Fernet.generate_key()
-cipher_suite = Fernet(ENCRYPTION_KEY)
+# Verified plaintext fragments by original hash, shared by every file containing them
+fragment_cache = FragmentCache(FRAGMENT_CACHE_BYTES)
 
 class FileProcessor:
     """Handles file encryption, fragmentation, and hashing"""
@@ -109,7 +539,7 @@ class FileProcessor:
     
     @staticmethod
     def encrypt_file(file_content: bytes) -> bytes:
-        """Encrypt file content using Fernet encryption"""
+        """Encrypt file content with the configured cipher engine"""
         return cipher_suite.encrypt(file_content)
     
     @staticmethod
@@ -118,98 +548,682 @@ class FileProcessor:
         return cipher_suite.decrypt(encrypted_content)
     
     @staticmethod
-    def encrypt_fragment(data: bytes) -> str:
-        """Encrypt individual fragment data and return as base64"""
-        encrypted = cipher_suite.encrypt(data)
-        return base64.b64encode(encrypted).decode('utf-8')
+    def encrypt_fragment(data: bytes) -> bytes:
+        """Encrypt individual fragment data into raw binary ciphertext"""
+        return cipher_suite.encrypt(data)
     
     @staticmethod
-    def decrypt_fragment(encrypted_b64: str) -> bytes:
-        """Decrypt individual fragment data from base64"""
-        encrypted = base64.b64decode(encrypted_b64.encode('utf-8'))
+    def decrypt_fragment(encrypted: Union[bytes, str]) -> bytes:
+        """Decrypt individual fragment data (raw ciphertext, or the legacy base64 Fernet token)"""
+        if isinstance(encrypted, str):
+            encrypted = base64.b64decode(encrypted.encode('utf-8'))
         return cipher_suite.decrypt(encrypted)
     
     @staticmethod
-    def fragment_file(file_content: bytes, chunk_size: int = 1024 * 64) -> List[Dict[str, Any]]:
+    def build_fragment(chunk: bytes, fragment_id: int, position: int) -> Dict[str, Any]:
+        """Hash and encrypt a single chunk into a fragment record"""
+        return crypto.build_fragment(chunk, fragment_id, position)
+    
+    @staticmethod
+    def fragment_file(file_content: bytes, chunk_size: int = FRAGMENT_SIZE) -> List[Dict[str, Any]]:
         """
-        Fragment file into chunks and encrypt each fragment individually
+        Fragment file into chunks and compress (when it pays off) and encrypt each fragment individually
         Default chunk size: 64KB
-        This allows recovery even if some fragments are missing
+        With erasure coding enabled, parity fragments are added so the file can be
+        recovered even if some fragments are missing
         """
-        fragments = []
-        total_size = len(file_content)
-        
-        for i in range(0, total_size, chunk_size):
-            chunk = file_content[i:i + chunk_size]
-            fragment_hash = hashlib.sha256(chunk).hexdigest()
-            
-            # Encrypt each fragment individually
-            encrypted_data = FileProcessor.encrypt_fragment(chunk)
-            
-            fragment = {
-                "fragment_id": len(fragments) + 1,
-                "fragment_hash": fragment_hash,
-                "size": len(chunk),
-                "data": encrypted_data,  # Already encrypted and base64 encoded
-                "position": i,
-                "original_hash": fragment_hash  # Store original hash of unencrypted data
-            }
-            fragments.append(fragment)
+        fragmenter = StreamingFragmenter(chunk_size, cdc_chunker)
+        fragmenter.feed(file_content)
+        fragmenter.finish()
+        jobs = [job + (False,) for job in fragmenter.drain()]
+        if ERASURE_PARITY_SHARDS:
+            return number_fragments(crypto.encode_stripe_batch(erasure_stripes(jobs)))
+        return crypto.encrypt_batch(jobs)
+    
+    @staticmethod
+    def fragment_payload(fragment: Dict[str, Any]) -> Any:
+        """Encrypted payload of a fragment record, inline or from the fragment store"""
+        if 'data' in fragment:
+            return fragment['data']
+        return fragment_store.get(fragment['storage_key'])
+    
+    @staticmethod
+    async def fetch_payload(fragment: Dict[str, Any]) -> Any:
+        """Like fragment_payload, reading from the fragment's storage node replicas when it has any"""
+        if 'data' in fragment:
+            return fragment['data']
+        storage_key = fragment['storage_key']
+        return await placement.fetch(storage_key, partial(fragment_store.get, storage_key))
+    
+    @staticmethod
+    def payload_data_key(payload: Any) -> Optional[bytes]:
+        """Data key for a payload that names one (None for the base key formats or an unknown key)"""
+        key_id = payload_key_id(payload) if isinstance(payload, (bytes, bytearray, memoryview)) else None
+        if key_id is None:
+            return None
+        try:
+            return key_manager.data_key(key_id)
+        except KeyManagementError as e:
+            print(f"⚠️ {e}")
+            return None
+    
+    @staticmethod
+    def decrypt_job(fragment: Dict[str, Any], payload: Any = None) -> Tuple[Any, Any, str, Optional[str], Optional[bytes]]:
+        """(fragment_id, payload, original_hash, codec, data_key) job for crypto.decrypt_batch"""
+        if payload is None:
+            payload = FileProcessor.fragment_payload(fragment)
+        return (fragment['fragment_id'], payload, fragment['original_hash'], fragment.get('codec'),
+                FileProcessor.payload_data_key(payload))
+    
+    @staticmethod
+    async def fetch_jobs(fragments: List[Dict[str, Any]],
+                         timer: Optional[StageTimer] = None) -> List[Tuple[Any, Any, str, Optional[str], Optional[bytes]]]:
+        """decrypt_job for each fragment, with the payloads fetched from storage nodes concurrently"""
+        started = time.perf_counter()
+        if not fragment_storage:
+            jobs = [FileProcessor.decrypt_job(fragment) for fragment in fragments]
+        else:
+            payloads = await asyncio.gather(*(FileProcessor.fetch_payload(fragment) for fragment in fragments))
+            jobs = [FileProcessor.decrypt_job(fragment, payload) for fragment, payload in zip(fragments, payloads)]
+        if timer is not None:
+            timer.add("fetch", time.perf_counter() - started)
+        return jobs
+    
+    @staticmethod
+    def decrypt_fragment_record(fragment: Dict[str, Any]) -> bytes:
+        """Decrypt a stored fragment record, accepting both fragment formats"""
+        fragment_id, payload, _, codec, data_key = FileProcessor.decrypt_job(fragment)
+        return decompress_chunk(crypto.decrypt_data(payload, fragment_id, data_key), codec)
+    
+    @staticmethod
+    def data_fragment_hashes(fragments: FragmentTable) -> List[str]:
+        """Merkle leaves: plaintext hashes of the data fragments in file order"""
+        return fragments.data_hashes()
+    
+    @staticmethod
+    def verify_fragment_tree(file_hash: str, metadata: Dict[str, Any], fragments: FragmentTable) -> bool:
+        """
+        Check the catalog's fragment hashes against the file's Merkle root, once per
+        catalog entry; each fragment is then verified against its own hash as it is read
+        """
+        if "merkle_root" not in metadata or file_hash in verified_trees:
+            return True
+        if merkle_root(FileProcessor.data_fragment_hashes(fragments)) != metadata["merkle_root"]:
+            return False
+        verified_trees.add(file_hash)
+        return True
+    
+    @staticmethod
+    def reassemble_file(fragments: List[Dict[str, Any]]) -> bytearray:
+        """
+        Reassemble file from fragments by decrypting each fragment
+        The output buffer is preallocated and each fragment is written at its
+        recorded position, so reassembly is linear in the file size
+        """
+        chunks = [FileProcessor.decrypt_fragment_record(fragment) for fragment in fragments]
+        return FileProcessor.place_chunks(fragments, chunks)
+    
+    @staticmethod
+    async def reassemble_file_parallel(fragments: List[Dict[str, Any]], timer: Optional[StageTimer] = None) -> bytearray:
+        """Same as reassemble_file, with fragment batches decrypted on the crypto pool"""
+        # Each fragment is checked against its hash, so corruption fails on the first bad fragment
+        cached = [fragment_cache.get(fragment['original_hash']) for fragment in fragments]
+        jobs = await FileProcessor.fetch_jobs([fragment for fragment, chunk in zip(fragments, cached) if chunk is None], timer)
+        decrypted = await crypto_pool.map(crypto.decrypt_batch, jobs, timer)
+        chunks = list(FileProcessor.merge_cached(fragments, cached, decrypted))
+        started = time.perf_counter()
+        combined_data = FileProcessor.place_chunks(fragments, chunks)
+        if timer is not None:
+            timer.add("reassemble", time.perf_counter() - started)
+        return combined_data
+    
+    @staticmethod
+    def place_chunks(fragments: List[Dict[str, Any]], chunks: List[bytes]) -> bytearray:
+        """Write decrypted chunks into a preallocated buffer at their fragment positions"""
+        if not fragments:
+            return bytearray()
+        
+        total_size = max(fragment['position'] + fragment['size'] for fragment in fragments)
+        combined_data = bytearray(total_size)
+        view = memoryview(combined_data)
         
-        return fragments
+        for fragment, chunk_data in zip(fragments, chunks):
+            position = fragment['position']
+            view[position:position + len(chunk_data)] = chunk_data
+        
+        view.release()
+        return combined_data
     
     @staticmethod
-    def reassemble_file(fragments: List[Dict[str, Any]]) -> bytes:
-        """Reassemble file from fragments by decrypting each fragment"""
-        # Sort fragments by position
-        sorted_fragments = sorted(fragments, key=lambda x: x['position'])
-        
-        # Combine fragment data
-        combined_data = b""
-        for fragment in sorted_fragments:
-            try:
-                # Try new format: individually encrypted fragments
-                chunk_data = FileProcessor.decrypt_fragment(fragment['data'])
-            except Exception as decrypt_error:
-                # Fallback to old format: just base64 encoded (no encryption at fragment level)
-                try:
-                    chunk_data = base64.b64decode(fragment['data'].encode('utf-8'))
-                except Exception as decode_error:
-                    print(f"Error processing fragment {fragment.get('fragment_id')}: decrypt={decrypt_error}, decode={decode_error}")
-                    raise
-            
-            combined_data += chunk_data
+    def merge_cached(fragments: List[Dict[str, Any]], cached: List[Optional[bytes]],
+                     decrypted: List[bytes]) -> Iterator[bytes]:
+        """Chunks of fragments in order: cached ones as they are, the rest from decrypted (which are cached)"""
+        decrypted_iter = iter(decrypted)
+        for fragment, chunk_data in zip(fragments, cached):
+            if chunk_data is None:
+                chunk_data = next(decrypted_iter)
+                fragment_cache.put(fragment['original_hash'], chunk_data)
+            yield chunk_data
+    
+    @staticmethod
+    async def iter_fragments(fragments: List[Dict[str, Any]], timer: Optional[StageTimer] = None) -> AsyncIterator[bytes]:
+        """
+        Decrypt fragments in file order on the crypto pool, verifying each against
+        its original hash, so a file can be streamed without materializing it
+        Fragments in the plaintext cache skip the pool.
+        """
+        ordered = sorted(fragments, key=lambda x: x['position'])
+        # (fragments, cached chunks) of each batch handed to the pool, in order
+        plans: deque = deque()
+        # Payloads are fetched lazily, one batch ahead of the pool
+        async def batches() -> AsyncIterator[List[Tuple[Any, ...]]]:
+            for batch in crypto_pool.batches(ordered):
+                cached = [fragment_cache.get(fragment['original_hash']) for fragment in batch]
+                plans.append((batch, cached))
+                yield await FileProcessor.fetch_jobs([fragment for fragment, chunk in zip(batch, cached) if chunk is None], timer)
+        async for chunks in crypto_pool.imap(crypto.decrypt_batch, batches(), timer):
+            batch, cached = plans.popleft()
+            for chunk_data in FileProcessor.merge_cached(batch, cached, chunks):
+                yield chunk_data
+    
+    @staticmethod
+    def group_stripes(fragments: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Erasure-coded fragment records grouped by stripe, in file order"""
+        stripes: Dict[int, List[Dict[str, Any]]] = {}
+        for fragment in fragments:
+            stripes.setdefault(fragment['stripe'], []).append(fragment)
+        return [sorted(stripes[stripe], key=lambda x: x['shard']) for stripe in sorted(stripes)]
+    
+    @staticmethod
+    def is_recoverable(metadata: Dict[str, Any], fragments: List[Dict[str, Any]],
+                       available: List[Dict[str, Any]]) -> bool:
+        """Whether the available fragments are enough to rebuild the file"""
+        available_ids = {fragment['fragment_id'] for fragment in available}
+        if "erasure" not in metadata:
+            return all(fragment['fragment_id'] in available_ids for fragment in fragments)
+        
+        k = metadata["erasure"]["k"]
+        for stripe in FileProcessor.group_stripes(fragments):
+            data = [fragment for fragment in stripe if not fragment.get('parity')]
+            present = sum(fragment['fragment_id'] in available_ids for fragment in stripe)
+            # A short final stripe is padded with zero shards that never go missing
+            if present + k - len(data) < k and not all(fragment['fragment_id'] in available_ids for fragment in data):
+                return False
+        return True
+    
+    @staticmethod
+    async def iter_stripes(metadata: Dict[str, Any], fragments: List[Dict[str, Any]],
+                           available: List[Dict[str, Any]], timer: Optional[StageTimer] = None) -> AsyncIterator[bytes]:
+        """
+        Decrypt an erasure-coded file in file order on the crypto pool, rebuilding
+        missing data fragments from parity. Parity payloads are only read for
+        stripes that are missing data fragments.
+        """
+        k, m = metadata["erasure"]["k"], metadata["erasure"]["m"]
+        available_ids = {fragment['fragment_id'] for fragment in available}
+        
+        async def stripe_job(stripe: List[Dict[str, Any]], with_parity: bool = False) -> Tuple[Any, ...]:
+            data = [fragment for fragment in stripe if not fragment.get('parity')]
+            parity = [fragment for fragment in stripe if fragment.get('parity')]
+            use = [fragment for fragment in (data if not with_parity else stripe) if fragment['fragment_id'] in available_ids]
+            return (
+                k, m, parity[0]['size'] if parity else 0,
+                [(fragment['size'], fragment['original_hash']) for fragment in data],
+                [(fragment['shard'],) + job for fragment, job in zip(use, await FileProcessor.fetch_jobs(use, timer))]
+            )
+        
+        def needs_parity(stripe: List[Dict[str, Any]]) -> bool:
+            return not all(fragment['fragment_id'] in available_ids for fragment in stripe if not fragment.get('parity'))
+        
+        def data_hashes(stripe: List[Dict[str, Any]]) -> List[str]:
+            return [fragment['original_hash'] for fragment in stripe if not fragment.get('parity')]
+        
+        stripes = FileProcessor.group_stripes(fragments)
+        per_batch = max(1, crypto_pool.batch_size // k)
+        # (stripe, cached data chunks or None) of each batch handed to the pool, in order;
+        # stripes whose data fragments are all cached skip the pool
+        plans: deque = deque()
+        # Payloads are fetched lazily, one batch ahead of the pool
+        async def batches() -> AsyncIterator[List[Tuple[Any, ...]]]:
+            for i in range(0, len(stripes), per_batch):
+                plan = [(stripe, fragment_cache.get_many(data_hashes(stripe))) for stripe in stripes[i:i + per_batch]]
+                plans.append(plan)
+                yield [await stripe_job(stripe, needs_parity(stripe)) for stripe, cached in plan if cached is None]
+        async for results in crypto_pool.imap(crypto.decode_stripe_batch, batches(), timer):
+            decoded = iter(results)
+            for stripe, chunks in plans.popleft():
+                if chunks is None:
+                    chunks = next(decoded)
+                    if chunks is None and not needs_parity(stripe):
+                        # A data fragment was corrupt; retry the stripe with its parity fragments
+                        chunks = (await crypto_pool.submit(crypto.decode_stripe_batch, [await stripe_job(stripe, True)], timer))[0]
+                    if chunks is None:
+                        raise ValueError(f"Stripe {stripe[0]['stripe']} cannot be recovered")
+                    # Every rebuilt or decrypted chunk was checked against its original hash
+                    for original_hash, chunk_data in zip(data_hashes(stripe), chunks):
+                        fragment_cache.put(original_hash, chunk_data)
+                for chunk_data in chunks:
+                    yield chunk_data
+    
+    @staticmethod
+    async def iter_file(metadata: Dict[str, Any], fragments: List[Dict[str, Any]],
+                        available: List[Dict[str, Any]], timer: Optional[StageTimer] = None) -> AsyncIterator[bytes]:
+        """Decrypted file content in order, from the available fragments"""
+        if "erasure" in metadata:
+            source = FileProcessor.iter_stripes(metadata, fragments, available, timer)
+        else:
+            source = FileProcessor.iter_fragments(available, timer)
+        async for chunk_data in source:
+            yield chunk_data
+    
+    @staticmethod
+    def range_fragments(fragments: List[Dict[str, Any]], start: int, end: int) -> List[Dict[str, Any]]:
+        """Data fragments overlapping bytes [start, end), found by bisecting fragment positions"""
+        data = [fragment for fragment in fragments if not fragment.get('parity')]
+        positions = [fragment['position'] for fragment in data]
+        first = bisect_right(positions, start) - 1
+        last = bisect_left(positions, end)
+        return data[max(first, 0):last]
+    
+    @staticmethod
+    def range_sources(metadata: Dict[str, Any], fragments: List[Dict[str, Any]],
+                      available: List[Dict[str, Any]], start: int, end: int) -> Tuple[List[Dict[str, Any]], Optional[List[Dict[str, Any]]]]:
+        """
+        Fragments to read for bytes [start, end): (needed data fragments, None) when
+        they are all available, else (needed, the stripes to rebuild them from), or
+        (needed, []) when they cannot be recovered
+        """
+        needed = FileProcessor.range_fragments(fragments, start, end)
+        available_ids = {fragment['fragment_id'] for fragment in available}
+        if all(fragment['fragment_id'] in available_ids for fragment in needed):
+            return needed, None
+        if "erasure" not in metadata:
+            return needed, []
+        stripes = {fragment['stripe'] for fragment in needed}
+        selected = [fragment for fragment in fragments if fragment['stripe'] in stripes]
+        if not FileProcessor.is_recoverable(metadata, selected, available):
+            return needed, []
+        return needed, selected
+    
+    @staticmethod
+    async def iter_range(metadata: Dict[str, Any], needed: List[Dict[str, Any]], stripes: Optional[List[Dict[str, Any]]],
+                         available: List[Dict[str, Any]], start: int, end: int,
+                         timer: Optional[StageTimer] = None) -> AsyncIterator[bytes]:
+        """
+        Decrypt only the fragments overlapping bytes [start, end) and yield that slice
+        Each fragment is still verified against its original hash.
+        """
+        if stripes is None:
+            source = FileProcessor.iter_fragments(needed, timer)
+            offset = needed[0]['position']
+        else:
+            source = FileProcessor.iter_stripes(metadata, stripes, available, timer)
+            offset = min(fragment['position'] for fragment in stripes if not fragment.get('parity'))
         
+        try:
+            async for chunk_data in source:
+                low, high = max(start - offset, 0), min(end - offset, len(chunk_data))
+                if low < high:
+                    yield chunk_data[low:high]
+                offset += len(chunk_data)
+                if offset >= end:
+                    break
+        finally:
+            await source.aclose()
+    
+    @staticmethod
+    async def collect(chunks: AsyncIterator[bytes], size: int, timer: Optional[StageTimer] = None) -> bytearray:
+        """Gather streamed chunks into one preallocated buffer"""
+        combined_data = bytearray(size)
+        view = memoryview(combined_data)
+        offset = 0
+        copying = 0.0
+        async for chunk_data in chunks:
+            started = time.perf_counter()
+            view[offset:offset + len(chunk_data)] = chunk_data
+            offset += len(chunk_data)
+            copying += time.perf_counter() - started
+        view.release()
+        if timer is not None:
+            timer.add("reassemble", copying)
         return combined_data
 
-def get_trusted_nodes_from_blockchain() -> Dict[str, int]:
+class StreamingFragmenter:
     """
-    Fetch node trust scores from blockchain
-    Returns: {node_address: trust_score}
+    Incrementally hash and cut a byte stream into fragment jobs
+    
+    Data can be fed in arbitrarily sized pieces; every time a full chunk is
+    buffered it becomes a (fragment_id, position, chunk) job that the caller
+    takes with drain() and hands to the crypto pool, so at most one partial
+    chunk plus the undrained jobs are held at a time. With a CDCChunker, chunk
+    boundaries are content-defined instead of every chunk_size bytes.
     """
-    try:
-        if not contract or not w3 or not w3.is_connected():
-            return {}
+    
+    def __init__(self, chunk_size: int = FRAGMENT_SIZE, chunker: Optional[CDCChunker] = None):
+        self.chunk_size = chunk_size
+        self.chunker = chunker
+        self.fragment_count = 0
+        self.total_size = 0
+        self._emitted = 0
+        self._file_hasher = hashlib.sha256()
+        self._pending = bytearray()
+        self._ready: List[Tuple[int, int, bytes]] = []
+    
+    def _emit(self, chunk: bytes) -> None:
+        self.fragment_count += 1
+        self._ready.append((self.fragment_count, self._emitted, chunk))
+        self._emitted += len(chunk)
+    
+    def _cut(self, final: bool) -> None:
+        """Emit the content-defined chunks whose boundaries are settled"""
+        offset = 0
+        for length in self.chunker.split(self._pending, final):
+            self._emit(bytes(self._pending[offset:offset + length]))
+            offset += length
+        del self._pending[:offset]
+    
+    @property
+    def ready_count(self) -> int:
+        """Number of completed chunks waiting to be drained"""
+        return len(self._ready)
+    
+    def drain(self, multiple: int = 1) -> List[Tuple[int, int, bytes]]:
+        """Take completed fragment jobs, as many as fit in a multiple of `multiple`"""
+        count = len(self._ready) - len(self._ready) % multiple
+        jobs, self._ready = self._ready[:count], self._ready[count:]
+        return jobs
+    
+    def feed(self, data: bytes) -> None:
+        """Consume the next piece of the stream"""
+        if not data:
+            return
+        self._file_hasher.update(data)
         
-        nodes_dict = {}
+        if self.chunker is not None:
+            self._pending += data
+            self.total_size += len(data)
+            self._cut(final=False)
+            return
+        
+        view = memoryview(data)
+        
+        # Top up a partially filled chunk first
+        if self._pending:
+            needed = self.chunk_size - len(self._pending)
+            self._pending += view[:needed]
+            self.total_size += min(needed, len(view))
+            view = view[needed:]
+            if len(self._pending) < self.chunk_size:
+                return
+            self._emit(bytes(self._pending))
+            self._pending.clear()
+        
+        # Fragment whole chunks straight from the input without copying it
+        while len(view) >= self.chunk_size:
+            self.total_size += self.chunk_size
+            self._emit(bytes(view[:self.chunk_size]))
+            view = view[self.chunk_size:]
+        
+        if len(view):
+            self.total_size += len(view)
+            self._pending += view
+    
+    def finish(self) -> str:
+        """Flush the trailing partial chunk and return the SHA-256 of the whole stream"""
+        if self.chunker is not None:
+            self._cut(final=True)
+        elif self._pending:
+            self._emit(bytes(self._pending))
+            self._pending.clear()
+        return self._file_hasher.hexdigest()
+
+def store_fragment(fragment: Dict[str, Any], held: List[str], to_place: Optional[List[Tuple[str, bytes]]] = None) -> Dict[str, Any]:
+    """
+    Move a fragment's encrypted payload into the fragment store under its
+    plaintext hash, keeping only the key; the reference taken is added to held.
+    New payloads are also queued on to_place (if given) for copying to storage nodes.
+    """
+    storage_key = fragment["original_hash"]
+    data = fragment.pop("data", None)
+    if data is not None:
+        fragment_store.add(storage_key, data, fragment.get("codec"))
+        held.append(storage_key)
+        if to_place is not None:
+            to_place.append((storage_key, data))
+    fragment["storage_key"] = storage_key
+    # The stored payload may have been written by another upload: record how that one is compressed
+    codec = fragment_store.codec(storage_key)
+    fragment.pop("codec", None)
+    if codec is not None:
+        fragment["codec"] = codec
+    return fragment
+
+def store_fragments(fragments: List[Dict[str, Any]], held: List[str]) -> List[Tuple[str, bytes]]:
+    """
+    store_fragment() for a batch of fragments, returning the new (storage key,
+    payload) pairs to copy to storage nodes. Blocking: call it from a worker thread.
+    """
+    to_place: List[Tuple[str, bytes]] = []
+    for fragment in fragments:
+        store_fragment(fragment, held, to_place)
+    return to_place
+
+async def claim_stored_chunks(jobs: List[Tuple[int, int, bytes]], held: List[str]) -> List[Tuple[int, int, bytes, bool]]:
+    """
+    Mark chunks whose payload is already stored, taking a reference to it (added
+    to held), so they are not encrypted and written again
+    """
+    if not jobs:
+        return []
+    hashes = await asyncio.to_thread(lambda: [hashlib.sha256(chunk).hexdigest() for _, _, chunk in jobs])
+    claimed = []
+    for job, chunk_hash in zip(jobs, hashes):
+        stored = fragment_store.acquire(chunk_hash)
+        if stored:
+            held.append(chunk_hash)
+        claimed.append(job + (stored,))
+    return claimed
+
+def erasure_stripes(jobs: List[Tuple[int, int, bytes, bool]]) -> List[Tuple[int, int, int, List[Tuple[int, int, bytes, bool]]]]:
+    """Group stripe-aligned fragment jobs into (stripe, k, m, jobs) encode jobs"""
+    k, m = ERASURE_DATA_SHARDS, ERASURE_PARITY_SHARDS
+    return [((jobs[i][0] - 1) // k, k, m, jobs[i:i + k]) for i in range(0, len(jobs), k)]
+
+def number_fragments(fragments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Order fragment records data first, then parity, numbering parity fragments after the data"""
+    data = [fragment for fragment in fragments if not fragment.get("parity")]
+    parity = [fragment for fragment in fragments if fragment.get("parity")]
+    for fragment_id, fragment in enumerate(parity, start=len(data) + 1):
+        fragment["fragment_id"] = fragment_id
+    return data + parity
+
+def release_payload(storage_key: str) -> None:
+    """Drop one reference to a stored payload, deleting its node replicas with the last one"""
+    if fragment_store.release(storage_key):
+        # Another worker may have placed it: then look for it on every node
+        placement.drop(storage_key, node_addresses() if SHARED_STATE else ())
+
+def release_fragments(fragments: FragmentTable) -> None:
+    """Drop the references a file's fragments hold on stored payloads"""
+    for storage_key in fragments.storage_keys():
+        release_payload(storage_key)
+
+def uncache_file(file_hash: str) -> Optional[FragmentTable]:
+    """Remove a file from the in-memory catalog, returning its fragments (their references are still held)"""
+    verified_trees.discard(file_hash)
+    metadata = uploaded_files.pop(file_hash, None)
+    if metadata is not None:
+        catalog_index.remove(file_hash)
+        catalog_totals["size_bytes"] -= metadata["original_size"]
+    fragments = file_fragments.pop(file_hash, None)
+    if fragments is not None:
+        stripe_index.remove(file_hash, fragments)
+        fragment_cache.discard(fragments.hashes())
+        catalog_totals["fragments"] -= len(fragments)
+        catalog_totals["table_bytes"] -= fragments.nbytes
+        catalog_totals["compressed_fragments"] -= fragments.compressed_count
+    return fragments
+
+def forget_file(file_hash: str) -> None:
+    """Remove a file from the in-memory catalog and release its fragments"""
+    fragments = uncache_file(file_hash)
+    if fragments is not None:
+        release_fragments(fragments)
+
+def cache_file(file_hash: str, metadata: Dict[str, Any], fragments: FragmentTable) -> None:
+    """Add a file to the in-memory catalog, replacing any previous copy without releasing it"""
+    uncache_file(file_hash)
+    uploaded_files[file_hash] = metadata
+    file_fragments[file_hash] = fragments
+    catalog_index.add(file_hash, metadata)
+    stripe_index.add(file_hash, fragments)
+    catalog_totals["size_bytes"] += metadata["original_size"]
+    catalog_totals["fragments"] += len(fragments)
+    catalog_totals["table_bytes"] += fragments.nbytes
+    catalog_totals["compressed_fragments"] += fragments.compressed_count
+
+def record_file(file_hash: str, metadata: Dict[str, Any], fragments: FragmentTable) -> None:
+    """Add a file to the in-memory catalog, replacing (and releasing) any previous copy"""
+    forget_file(file_hash)
+    cache_file(file_hash, metadata, fragments)
+
+def save_file(file_hash: str, metadata: Dict[str, Any], fragments: FragmentTable) -> None:
+    """Record a file in the catalog and the catalog log, replacing (and releasing) any previous copy"""
+    if catalog_log is None or not catalog_log.shared:
+        record_file(file_hash, metadata, fragments)
+        if catalog_log is not None:
+            catalog_log.put(file_hash, metadata, fragments)
+        return
+    # Release the copy the shared catalog held, which another worker may have written since the last sync
+    previous = catalog_log.put(file_hash, metadata, fragments)
+    cache_file(file_hash, metadata, fragments)
+    if previous is not None:
+        release_fragments(FragmentTable.from_records(previous))
+
+def delete_saved_file(file_hash: str) -> None:
+    """Remove a file from the catalog and the catalog log and release its fragments"""
+    if catalog_log is None or not catalog_log.shared:
+        forget_file(file_hash)
+        if catalog_log is not None:
+            catalog_log.delete(file_hash)
+        return
+    previous = catalog_log.delete(file_hash)
+    uncache_file(file_hash)
+    # None: another worker deleted it first, and released its fragments
+    if previous is not None:
+        release_fragments(FragmentTable.from_records(previous))
+
+# Storage keys of files other workers stored, whose node replicas this worker has not looked up yet
+unlocated_payloads: set = set()
+
+def sync_catalog() -> None:
+    """Apply the catalog changes other worker processes made since the last sync (shared state only)"""
+    changes = catalog_log.changes(FragmentTable.from_records)
+    if changes is None:
+        print("🔄 Catalog change feed no longer reaches this worker's position; reloading the catalog")
+        files, tables = catalog_log.load(FragmentTable.from_records)
+        changes = [(file_hash, None, None) for file_hash in uploaded_files if file_hash not in files]
+        changes.extend((file_hash, metadata, tables[file_hash]) for file_hash, metadata in files.items())
+    for file_hash, metadata, fragments in changes:
+        if metadata is None:
+            uncache_file(file_hash)
+        else:
+            cache_file(file_hash, metadata, fragments)
+            if placement.enabled:
+                unlocated_payloads.update(key for key in fragments.storage_keys() if key not in placement.replicas)
+        access_resolver.invalidate_file(file_hash)
+
+async def sync_shared_state() -> None:
+    """
+    Keep this worker current with the others between requests: the catalog (which
+    the scrubber reads) and the node replicas of payloads other workers placed
+    """
+    while True:
+        await asyncio.sleep(CATALOG_SYNC_INTERVAL)
         try:
-            node_addresses = contract.functions.getTrustedNodes().call()
-            for address in node_addresses:
-                try:
-                    node_info = contract.functions.storageNodes(address).call()
-                    trust_score = int(node_info[1])  # trustScore is at index 1
-                    nodes_dict[address] = trust_score
-                except Exception as e:
-                    print(f"Error fetching node {address}: {e}")
-                    continue
+            sync_catalog()
+            if unlocated_payloads:
+                keys = list(unlocated_payloads)
+                unlocated_payloads.clear()
+                found = await asyncio.to_thread(placement.locate, keys, node_addresses())
+                for key, addresses in found.items():
+                    if key in fragment_store:
+                        placement.replicas.setdefault(key, addresses)
         except Exception as e:
-            print(f"Error fetching trusted nodes: {e}")
-        
-        return nodes_dict
+            print(f"⚠️ Shared state sync failed: {e}")
+
+def segment_stores() -> List[SegmentFragmentStore]:
+    """Fragment stores that need compacting: the local store and the node stores, with the segment backend"""
+    if STORAGE_BACKEND != "segment":
+        return []
+    return [fragment_store.store] + [placement.node(address) for address in node_addresses()]
+
+def compact_segment_stores(min_dead_ratio: float, include_active: bool) -> Dict[str, int]:
+    """Compact every segment store (blocking; runs on a worker thread)"""
+    totals = {"segments": 0, "reclaimed_bytes": 0}
+    for store in segment_stores():
+        if include_active or store.compactable(min_dead_ratio):
+            for name, value in store.compact(min_dead_ratio, include_active).items():
+                totals[name] += value
+    return totals
+
+# Compaction in progress, if any: one at a time, and awaited on shutdown
+compaction: Optional[asyncio.Future] = None
+
+async def compact_storage(min_dead_ratio: float = COMPACTION_DEAD_RATIO, include_active: bool = False) -> Dict[str, int]:
+    """Run a compaction on a worker thread, or wait for the one already running (and return its result)"""
+    global compaction
+    if compaction is None or compaction.done():
+        compaction = asyncio.ensure_future(asyncio.to_thread(compact_segment_stores, min_dead_ratio, include_active))
+    # Shielded: a cancelled caller leaves the compaction to finish
+    result = await asyncio.shield(compaction)
+    if result["segments"]:
+        print(f"🧹 Compacted {result['segments']} segments, reclaiming {result['reclaimed_bytes']} bytes")
+    return result
+
+async def compact_periodically() -> None:
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL)
+        try:
+            await compact_storage()
+        except Exception as e:
+            print(f"⚠️ Segment compaction failed: {e}")
+
+async def get_trusted_nodes_from_blockchain() -> Dict[str, int]:
+    """
+    Fetch node trust scores from blockchain (through the trust cache)
+    Returns: {node_address: trust_score}
+    """
+    try:
+        return await trust_cache.trusted_nodes()
     except Exception as e:
         print(f"Error in get_trusted_nodes_from_blockchain: {e}")
         return {}
 
+async def placement_nodes() -> Dict[str, int]:
+    """Trusted nodes for placement and replica ranking; none while the chain is unreachable"""
+    if not chain.available:
+        return {}
+    return await placement.trusted()
+
+def fragment_stripes(storage_key: str) -> Iterator[Tuple[int, int, List[Dict[str, Any]]]]:
+    """(k, m, fragment records) of every erasure stripe holding a payload, to rebuild it from parity"""
+    for file_hash, stripe in stripe_index.stripes(storage_key):
+        fragments = file_fragments.get(file_hash)
+        erasure = uploaded_files.get(file_hash, {}).get("erasure")
+        if fragments is None or erasure is None:
+            continue
+        yield erasure["k"], erasure["m"], [fragments[row] for row in fragments.stripe_rows(stripe)]
+
+# Re-verifies stored fragment copies in the background and repairs them from replicas or parity
+scrubber = Scrubber(fragment_store, placement, crypto_pool, FileProcessor.payload_data_key, fragment_stripes,
+                    nodes=placement_nodes, interval=SCRUB_INTERVAL, rate=SCRUB_RATE_BYTES,
+                    batch_size=SCRUB_BATCH_SIZE, concurrency=SCRUB_CONCURRENCY,
+                    checkpoint_path=os.path.join(DATA_DIR, "scrub.json") if STORAGE_BACKEND != "memory" else None)
+# Workers sharing state scrub the same payloads, so only the one holding the scrub lock runs the scrubber
+scrub_lock = lock_file(os.path.join(DATA_DIR, "scrub.lock")) if SHARED_STATE else None
+scrub_leader = not SHARED_STATE or scrub_lock is not None
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -225,69 +1239,327 @@ async def health_check():
     return {
         "status": "healthy",
         "files_stored": len(uploaded_files),
-        "fragments_stored": sum(len(frags) for frags in file_fragments.values()),
-        "encryption_key_loaded": ENCRYPTION_KEY is not None
+        "fragments_stored": catalog_totals["fragments"],
+        "encryption_key_loaded": ENCRYPTION_KEY is not None,
+        "keys": key_manager.stats(),
+        "storage_backend": fragment_store.name,
+        "blockchain_connected": chain.available,
+        "trust_cache": trust_cache.stats(),
+        "placement": placement.stats(),
+        "upload_jobs": upload_jobs.stats(),
+        "chain_index": chain_indexer.stats() if chain_indexer is not None else None
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics in the text exposition format"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def ingest_upload(read: Callable[[int], Awaitable[bytes]], filename: str, content_type: Optional[str],
+                        owner_address: Optional[str], job: Optional[Job] = None) -> Dict[str, Any]:
+    """
+    Fragment, encrypt and store an upload read through `read`, record it in the
+    catalog and return the upload response; job (if any) receives progress
+    """
+    # Stream the upload through the fragmenter chunk by chunk; completed
+    # chunks are encrypted in batches on the crypto pool while reading continues
+    fragmenter = StreamingFragmenter(FRAGMENT_SIZE, cdc_chunker)
+    # Storage keys this upload holds references to, released if it fails
+    held: List[str] = []
+    timer = file_timer()
+    # Trusted nodes new payloads are replicated to (empty when placement is off or no node is trusted)
+    started = time.perf_counter()
+    nodes = await placement_nodes()
+    if timer is not None:
+        timer.add("nodes", time.perf_counter() - started)
+    # Encrypted fragments waiting to be stored, and the tasks storing them: segment appends,
+    # reference counts and node copies run on worker threads, a pipeline batch at a time,
+    # while the upload goes on
+    to_store: List[Dict[str, Any]] = []
+    storing: List[asyncio.Future] = []
+    async def store_batch(fragments: List[Dict[str, Any]]) -> None:
+        started = time.perf_counter()
+        to_place = await asyncio.to_thread(store_fragments, fragments, held)
+        if timer is not None:
+            timer.add("store", time.perf_counter() - started)
+        if job is not None:
+            job.fragments_done += len(fragments)
+        if nodes and to_place:
+            await asyncio.to_thread(placement.place_many, to_place, nodes)
+    def store_queued() -> None:
+        if to_store:
+            storing.append(asyncio.ensure_future(store_batch(to_store[:])))
+            to_store.clear()
+    def sink(fragment: Dict[str, Any]) -> Dict[str, Any]:
+        # Stored in place by store_batch before the upload's records are read
+        to_store.append(fragment)
+        return fragment
+    # Every upload is sealed under its own data key (the Fernet format has no key id and uses the base key)
+    if CIPHER_ENGINE == "fernet":
+        key_id, data_key = BASE_KEY_ID, None
+    else:
+        key_id, key = await asyncio.to_thread(key_manager.create_data_key)
+        data_key = (key_id, key)
+    if ERASURE_PARITY_SHARDS:
+        # Whole stripes go to the pool together so parity is computed next to the data
+        stripe_size = ERASURE_DATA_SHARDS
+        pipeline = crypto_pool.pipeline(partial(crypto.encode_stripe_batch, data_key=data_key), sink=sink, timer=timer)
+        make_jobs = erasure_stripes
+    else:
+        stripe_size = 1
+        pipeline = crypto_pool.pipeline(partial(crypto.encrypt_batch, data_key=data_key), sink=sink, timer=timer)
+        make_jobs = list
+    batch_fragments = max(stripe_size, crypto_pool.batch_size // stripe_size * stripe_size)
+    try:
+        while True:
+            started = time.perf_counter()
+            data = await read(FRAGMENT_SIZE)
+            if not data:
+                break
+            chunking = time.perf_counter()
+            fragmenter.feed(data)
+            if timer is not None:
+                timer.add("read", chunking - started)
+                timer.add("chunk", time.perf_counter() - chunking)
+            if job is not None:
+                job.processed_bytes = fragmenter.total_size
+            if fragmenter.ready_count >= batch_fragments:
+                jobs = await claim_stored_chunks(fragmenter.drain(stripe_size), held)
+                await pipeline.submit(make_jobs(jobs))
+                store_queued()
+        
+        if fragmenter.total_size == 0:
+            raise HTTPException(status_code=400, detail="Empty file uploaded")
+        
+        # Original file hash is available once the stream is drained
+        original_hash = fragmenter.finish()
+        jobs = await claim_stored_chunks(fragmenter.drain(), held)
+        await pipeline.submit(make_jobs(jobs))
+        records = await pipeline.finish()
+        store_queued()
+        if storing:
+            started = time.perf_counter()
+            await asyncio.gather(*storing)
+            if timer is not None:
+                timer.add("store_wait", time.perf_counter() - started)
+        fragments = FragmentTable.from_records(number_fragments(records))
+    except BaseException:
+        pipeline.cancel()
+        # Writes still running would take references (or write copies) after the release below
+        if storing:
+            await asyncio.wait(storing)
+        for storage_key in held:
+            release_payload(storage_key)
+        raise
+    
+    # Store file metadata
+    file_metadata = {
+        "original_filename": filename,
+        "original_size": fragmenter.total_size,
+        "file_hash": original_hash,
+        "fragment_count": fragments.data_count,
+        "merkle_root": merkle_root(FileProcessor.data_fragment_hashes(fragments)),
+        "key_id": key_id,
+        "upload_timestamp": datetime.now().isoformat(),
+        "content_type": content_type,
+        "owner": owner_address if owner_address else "unknown"  # Store owner address
+    }
+    if ERASURE_PARITY_SHARDS:
+        file_metadata["erasure"] = {
+            "k": ERASURE_DATA_SHARDS,
+            "m": ERASURE_PARITY_SHARDS,
+            "data_fragments": fragmenter.fragment_count,
+            "parity_fragments": len(fragments) - fragments.data_count
+        }
+    
+    # Record in the catalog; re-uploading identical content replaces the previous copy
+    save_file(original_hash, file_metadata, fragments)
+    observe_file_stages("upload", timer)
+    
+    # Prepare response for frontend/blockchain: the contract records the file's data fragments,
+    # the same leaves merkle_root covers; parity fragments are described in metadata["erasure"]
+    fragment_hashes = fragments.data_hashes()
+    fragment_sizes = fragments.data_sizes()
+    
+    return {
+        "success": True,
+        "file_hash": original_hash,
+        "file_name": filename,
+        "file_size": fragmenter.total_size,
+        "fragment_count": len(fragment_hashes),
+        "merkle_root": file_metadata["merkle_root"],
+        "fragment_hashes": fragment_hashes,
+        "fragment_sizes": fragment_sizes,
+        "metadata": file_metadata
     }
 
+async def spool_upload(file: UploadFile) -> Tuple[str, int]:
+    """Copy an upload to a spool file, returning (path, size)"""
+    spool = tempfile.NamedTemporaryFile(dir=SPOOL_DIR, prefix=f"upload-{os.getpid()}-", suffix=".part", delete=False)
+    size = 0
+    try:
+        with spool:
+            while True:
+                data = await file.read(UPLOAD_SPOOL_CHUNK)
+                if not data:
+                    break
+                await asyncio.to_thread(spool.write, data)
+                size += len(data)
+    except BaseException:
+        os.unlink(spool.name)
+        raise
+    return spool.name, size
+
+async def process_upload_job(job: Job) -> Dict[str, Any]:
+    """Run a spooled upload through the normal upload pipeline"""
+    params = job.params
+    with open(params["spool_path"], "rb") as spool:
+        read = lambda size: asyncio.to_thread(spool.read, size)
+        result = await ingest_upload(read, params["filename"], params["content_type"], params["owner_address"], job)
+    print(f"✅ Upload job {job.id} stored {result['file_hash']} ({result['fragment_count']} fragments)")
+    return result
+
+def discard_spool(job: Job) -> None:
+    try:
+        os.unlink(job.params["spool_path"])
+    except FileNotFoundError:
+        pass
+
+upload_jobs = JobQueue(process_upload_job, workers=UPLOAD_WORKERS, max_pending=UPLOAD_QUEUE_SIZE,
+                       retention=UPLOAD_JOB_RETENTION, cleanup=discard_spool)
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...), owner_address: str = Form(None)):
+async def upload_file(file: UploadFile = File(...), owner_address: str = Form(None), background: bool = False):
     """
     Upload and process a file:
-    1. Read file content
-    2. Generate SHA-256 hash
-    3. Fragment file (no full encryption first - each fragment encrypted individually)
+    1. Stream file content in FRAGMENT_SIZE chunks
+    2. Update the SHA-256 hash incrementally as chunks arrive
+    3. Fragment and encrypt each chunk as soon as it is complete (no full-file buffer);
+       chunks another file already stored are referenced instead of stored again
     4. Return metadata for blockchain storage
     
+    With ?background=true the file is only spooled to disk and a job is queued;
+    the response (202) carries a job_id to poll at /jobs/{job_id}.
+    
     Form parameters:
     - file: The file to upload
     - owner_address: (Optional) Owner's wallet address for access control
     """
+    if background:
+        return await queue_upload(file, owner_address)
+    
     try:
-        # Read file content
-        file_content = await file.read()
-        
-        if len(file_content) == 0:
-            raise HTTPException(status_code=400, detail="Empty file uploaded")
-        
-        # Generate original file hash
-        original_hash = FileProcessor.generate_file_hash(file_content)
-        
-        # Fragment file and encrypt each fragment individually
-        fragments = FileProcessor.fragment_file(file_content)
-        
-        # Store file metadata
-        file_metadata = {
-            "original_filename": file.filename,
-            "original_size": len(file_content),
-            "file_hash": original_hash,
-            "fragment_count": len(fragments),
-            "upload_timestamp": datetime.now().isoformat(),
-            "content_type": file.content_type,
-            "owner": owner_address if owner_address else "unknown"  # Store owner address
-        }
-        
-        # Store in memory
-        uploaded_files[original_hash] = file_metadata
-        file_fragments[original_hash] = fragments
-        
-        # Prepare response for frontend/blockchain
-        fragment_hashes = [frag["fragment_hash"] for frag in fragments]
-        fragment_sizes = [frag["size"] for frag in fragments]
-        
-        return {
-            "success": True,
-            "file_hash": original_hash,
-            "file_name": file.filename,
-            "file_size": len(file_content),
-            "fragment_count": len(fragments),
-            "fragment_hashes": fragment_hashes,
-            "fragment_sizes": fragment_sizes,
-            "metadata": file_metadata
-        }
-        
+        return await ingest_upload(file.read, file.filename, file.content_type, owner_address)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"File processing failed: {str(e)}")
 
+async def queue_upload(file: UploadFile, owner_address: Optional[str]) -> JSONResponse:
+    """Spool an upload and queue it for background processing"""
+    # Reject before reading the body when the queue is already full
+    if not upload_jobs.has_room():
+        upload_jobs.rejected += 1
+        raise HTTPException(status_code=503, detail="Upload queue is full, retry later", headers={"Retry-After": "5"})
+    
+    spool_path, size = await spool_upload(file)
+    if size == 0:
+        os.unlink(spool_path)
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    
+    job = Job("upload", {
+        "spool_path": spool_path,
+        "filename": file.filename,
+        "content_type": file.content_type,
+        "owner_address": owner_address
+    }, total_bytes=size)
+    try:
+        upload_jobs.submit(job)
+    except QueueFullError as e:
+        os.unlink(spool_path)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    
+    return JSONResponse(status_code=202, content={
+        "success": True,
+        "job_id": job.id,
+        "status": job.status,
+        "file_name": file.filename,
+        "file_size": size,
+        "status_url": f"/jobs/{job.id}"
+    })
+
+def registration_manifest(uploads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Contract registration for a batch of successful uploads: registerFiles arguments,
+    split into calls of at most BATCH_REGISTER_FRAGMENTS fragments (a file is never split).
+    Only data fragments are registered (the Merkle root's leaves); parity stays off chain.
+    """
+    calls: List[Dict[str, List[Any]]] = []
+    fragments_in_call = 0
+    registered = set()
+    for upload in uploads:
+        fragments = file_fragments.get(upload["file_hash"])
+        if upload["file_hash"] in registered or fragments is None:
+            # The contract rejects a file registered twice; a file deleted since its upload is not registered
+            continue
+        registered.add(upload["file_hash"])
+        fragment_hashes = fragments.data_hashes()
+        if not calls or (fragments_in_call + len(fragment_hashes) > BATCH_REGISTER_FRAGMENTS and calls[-1]["file_hashes"]):
+            calls.append({"file_hashes": [], "file_names": [], "file_sizes": [], "fragment_hashes": [], "fragment_sizes": []})
+            fragments_in_call = 0
+        call = calls[-1]
+        call["file_hashes"].append(upload["file_hash"])
+        call["file_names"].append(upload["file_name"])
+        call["file_sizes"].append(upload["file_size"])
+        call["fragment_hashes"].append(fragment_hashes)
+        call["fragment_sizes"].append(fragments.data_sizes())
+        fragments_in_call += len(fragment_hashes)
+    return {"function": "registerFiles", "file_count": len(registered), "calls": calls}
+
+@app.post("/upload/batch")
+async def upload_batch(files: List[UploadFile] = File(...), owner_address: str = Form(None)):
+    """
+    Upload several files in one request
+    Files go through the fragment pipeline BATCH_UPLOAD_CONCURRENCY at a time. Each
+    file succeeds or fails on its own; the response lists a result per file (in
+    request order) and a manifest for registering the stored files on chain
+    with registerFiles.
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_FILES} files per batch")
+    slots = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+    
+    async def upload_one(file: UploadFile) -> Dict[str, Any]:
+        async with slots:
+            try:
+                return await ingest_upload(file.read, file.filename, file.content_type, owner_address)
+            except HTTPException as e:
+                return {"success": False, "file_name": file.filename, "error": e.detail}
+            except Exception as e:
+                print(f"❌ Batch upload of {file.filename} failed: {e}")
+                return {"success": False, "file_name": file.filename, "error": f"File processing failed: {str(e)}"}
+    
+    results = await asyncio.gather(*(upload_one(file) for file in files))
+    uploaded = [result for result in results if result["success"]]
+    print(f"✅ Batch upload: {len(uploaded)}/{len(results)} files stored")
+    return {
+        "success": len(uploaded) == len(results),
+        "uploaded": len(uploaded),
+        "failed": len(results) - len(uploaded),
+        "files": results,
+        "manifest": registration_manifest(uploaded)
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status and progress of a background upload; includes file_hash and the upload result once completed"""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 @app.get("/file/{file_hash}")
 async def get_file_info(file_hash: str):
     """Get file metadata by hash"""
@@ -295,38 +1567,90 @@ async def get_file_info(file_hash: str):
         raise HTTPException(status_code=404, detail="File not found")
     
     metadata = uploaded_files[file_hash]
-    fragments = file_fragments.get(file_hash, [])
+    fragments = file_fragments.get(file_hash) or FragmentTable()
     
     return {
         "file_hash": file_hash,
         "metadata": metadata,
-        "fragment_count": len(fragments),
+        "fragment_count": fragments.data_count,
+        "parity_fragment_count": len(fragments) - fragments.data_count,
         "fragments": [
             {
-                "fragment_id": frag["fragment_id"],
-                "fragment_hash": frag["fragment_hash"],
-                "size": frag["size"]
-            } for frag in fragments
+                "fragment_id": fragment_id,
+                "fragment_hash": fragments.hash_hex(index),
+                "size": size,
+                "parity": bool(parity),
+                "nodes": fragment_storage.get(fragments.hash_hex(index), [])
+            } for index, (fragment_id, size, parity) in enumerate(zip(fragments.ids, fragments.sizes, fragments.parity))
         ]
     }
 
-@app.post("/retrieve/{file_hash}")
-async def retrieve_file(file_hash: str, simulate_node_failure: bool = False):
-    """
-    Retrieve and decrypt a file:
-    1. Get fragments from storage
-    2. Simulate node failures if requested
-    3. Reassemble file from available fragments
-    4. Verify integrity and return file
-    """
+def find_data_fragment(file_hash: str, fragment_id: int) -> Tuple[int, Dict[str, Any], List[str]]:
+    """(leaf index, fragment record, Merkle leaves) of a data fragment of a stored file"""
     if file_hash not in uploaded_files:
         raise HTTPException(status_code=404, detail="File not found")
+    if "merkle_root" not in uploaded_files[file_hash]:
+        raise HTTPException(status_code=400, detail="File was stored without a Merkle root")
     
-    fragments = file_fragments.get(file_hash, [])
-    if not fragments:
-        raise HTTPException(status_code=404, detail="File fragments not found")
+    fragments = file_fragments.get(file_hash) or FragmentTable()
+    index = fragments.index_of(fragment_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Fragment not found")
+    if fragments.parity[index]:
+        raise HTTPException(status_code=400, detail="Parity fragments are not part of the Merkle tree")
     
-    # Simulate node failure for demo
+    return fragments.leaf_index(index), fragments[index], fragments.data_hashes()
+
+@app.get("/file/{file_hash}/proof/{fragment_id}")
+async def get_fragment_proof(file_hash: str, fragment_id: int):
+    """
+    Merkle inclusion proof for one data fragment
+    Hash the leaf (0x00 + fragment hash), then fold in each proof hash (0x01 + left + right)
+    up to merkle_root; the leaf index and tree size say which side each sibling is on
+    """
+    leaf_index, fragment, leaves = find_data_fragment(file_hash, fragment_id)
+    root, proof = inclusion_proof(leaves, leaf_index)
+    if root != uploaded_files[file_hash]["merkle_root"]:
+        raise HTTPException(status_code=500, detail="File integrity check failed")
+    
+    return {
+        "file_hash": file_hash,
+        "fragment_id": fragment_id,
+        "fragment_hash": fragment["original_hash"],
+        "position": fragment["position"],
+        "size": fragment["size"],
+        "leaf_index": leaf_index,
+        "tree_size": len(leaves),
+        "proof": proof,
+        "merkle_root": root
+    }
+
+@app.post("/verify/{file_hash}/fragment/{fragment_id}")
+async def verify_fragment(file_hash: str, fragment_id: int, uploaded_fragment: UploadFile = File(...)):
+    """
+    Spot-check one fragment: hash the uploaded fragment content and prove it is
+    part of the file's Merkle tree, without uploading the whole file
+    """
+    leaf_index, fragment, leaves = find_data_fragment(file_hash, fragment_id)
+    fragment_hash = hashlib.sha256(await uploaded_fragment.read()).hexdigest()
+    root = uploaded_files[file_hash]["merkle_root"]
+    _, proof = inclusion_proof(leaves, leaf_index)
+    is_valid = fragment_hash == fragment["original_hash"] and verify_inclusion(
+        fragment_hash, leaf_index, len(leaves), proof, root
+    )
+    
+    return {
+        "file_hash": file_hash,
+        "fragment_id": fragment_id,
+        "uploaded_hash": fragment_hash,
+        "is_valid": is_valid,
+        "merkle_root": root,
+        "verification_timestamp": datetime.now().isoformat(),
+        "message": "Fragment integrity verified" if is_valid else "Fragment has been tampered with"
+    }
+
+def select_available_fragments(fragments: List[Dict[str, Any]], simulate_node_failure: bool) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Return (available_fragments, failed_nodes), dropping 1-2 fragments when simulating node failure"""
     available_fragments = fragments.copy()
     failed_nodes = []
     
@@ -343,19 +1667,292 @@ async def retrieve_file(file_hash: str, simulate_node_failure: bool = False):
                 "fragment_hash": failed_fragment["fragment_hash"]
             })
     
+    return available_fragments, failed_nodes
+
+async def timed_stream(operation: str, timer: Optional[StageTimer], chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Pass a response stream through, recording its stage timings once it has been sent in full"""
+    async for chunk_data in chunks:
+        yield chunk_data
+    observe_file_stages(operation, timer)
+
+async def stream_verified_file(file_hash: str, metadata: Dict[str, Any], fragments: List[Dict[str, Any]],
+                               available: List[Dict[str, Any]], timer: Optional[StageTimer] = None) -> AsyncIterator[bytes]:
+    """
+    Yield decrypted fragments in order, each verified against its hash
+    Files without a Merkle root are also hashed as a whole, raising at the end of
+    the stream if the reconstructed file hash does not match
+    """
+    file_hasher = hashlib.sha256() if "merkle_root" not in metadata else None
+    async for chunk_data in FileProcessor.iter_file(metadata, fragments, available, timer):
+        if file_hasher is not None:
+            file_hasher.update(chunk_data)
+        yield chunk_data
+    
+    if file_hasher is None:
+        return
+    reconstructed_hash = file_hasher.hexdigest()
+    if reconstructed_hash != file_hash:
+        print(f"❌ Hash mismatch while streaming: expected {file_hash}, got {reconstructed_hash}")
+        raise ValueError("File integrity check failed")
+
+def parse_byte_range(size: int, range_header: Optional[str], offset: Optional[int],
+                     length: Optional[int]) -> Optional[Tuple[int, int]]:
+    """
+    Requested byte range as (start, end) with end exclusive, or None for the whole file
+    offset/length query parameters take precedence over a Range header; only
+    single ranges are served, so a multi-range header is ignored
+    """
+    if offset is not None or length is not None:
+        start = offset or 0
+        if start < 0 or (length is not None and length < 1):
+            raise HTTPException(status_code=400, detail="Invalid offset or length")
+        end = size if length is None else min(start + length, size)
+    elif range_header:
+        unit, _, spec = range_header.partition("=")
+        if unit.strip().lower() != "bytes" or "," in spec:
+            return None
+        first, _, last = spec.strip().partition("-")
+        try:
+            if first:
+                start = int(first)
+                end = min(int(last) + 1, size) if last else size
+            else:
+                # Suffix range: the last N bytes
+                start, end = max(size - int(last), 0), size
+        except ValueError:
+            return None
+    else:
+        return None
+    
+    if start >= size or start >= end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+def content_disposition(filename: str) -> str:
+    """
+    Attachment header for a stored filename: an ASCII filename="..." fallback plus the
+    exact name as RFC 5987 filename*, since header values must encode as Latin-1
+    """
+    fallback = "".join(char for char in filename if 32 <= ord(char) < 127 and char not in '"\\')
+    fallback = fallback.strip() or "download"
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+TAR_BLOCK = 512
+
+def archive_member(file_hash: str, metadata: Dict[str, Any], names: set) -> bytes:
+    """Tar (PAX) header of a file in a batch archive, named after the uploaded file"""
+    name = os.path.basename(metadata["original_filename"].replace("\\", "/")) or file_hash
+    if name in names:
+        stem, ext = os.path.splitext(name)
+        name = f"{stem}-{file_hash[:12]}{ext}"
+    names.add(name)
+    info = tarfile.TarInfo(name)
+    info.size = metadata["original_size"]
+    info.mode = 0o644
+    info.mtime = int(datetime.fromisoformat(metadata["upload_timestamp"]).timestamp())
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+def tar_padding(size: int) -> bytes:
+    return b"\0" * (-size % TAR_BLOCK)
+
+async def stream_archive(members: List[Tuple[str, Dict[str, Any], List[Dict[str, Any]], bytes]],
+                         timer: Optional[StageTimer] = None) -> AsyncIterator[bytes]:
+    """
+    Yield a tar archive of (file_hash, metadata, fragments, header) members, each
+    file decrypted and verified as in stream_verified_file. Small files are
+    decrypted BATCH_PREFETCH_FILES ahead, so many tiny files keep the crypto
+    pool busy instead of waiting on it one by one.
+    """
+    prefetched: Dict[int, asyncio.Future] = {}
+    
+    def prefetch(index: int) -> None:
+        if index >= len(members) or index in prefetched:
+            return
+        file_hash, metadata, fragments, _ = members[index]
+        if metadata["original_size"] <= BATCH_PREFETCH_BYTES:
+            prefetched[index] = asyncio.ensure_future(FileProcessor.collect(
+                stream_verified_file(file_hash, metadata, fragments, fragments, timer), metadata["original_size"]
+            ))
+    
+    try:
+        for index, (file_hash, metadata, fragments, header) in enumerate(members):
+            for ahead in range(index, index + BATCH_PREFETCH_FILES):
+                prefetch(ahead)
+            yield header
+            if index in prefetched:
+                yield bytes(await prefetched.pop(index))
+            else:
+                async for chunk_data in stream_verified_file(file_hash, metadata, fragments, fragments, timer):
+                    yield chunk_data
+            yield tar_padding(metadata["original_size"])
+        # End-of-archive marker: two zero blocks
+        yield b"\0" * (2 * TAR_BLOCK)
+    finally:
+        for task in prefetched.values():
+            task.cancel()
+
+@app.post("/retrieve/batch")
+async def retrieve_batch(file_hashes: List[str] = Body(..., embed=True)):
+    """
+    Retrieve several files as one tar archive stream
+    Body: {"file_hashes": [...]}. Members are named after the uploaded filenames
+    (suffixed with the file hash when two names collide) and every fragment is
+    verified as it is decrypted; a failure mid-stream aborts the response.
+    """
+    file_hashes = list(dict.fromkeys(file_hashes))
+    if not file_hashes:
+        raise HTTPException(status_code=400, detail="No file hashes given")
+    if len(file_hashes) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_FILES} files per batch")
+    missing = [file_hash for file_hash in file_hashes if file_hash not in uploaded_files or not file_fragments.get(file_hash)]
+    if missing:
+        raise HTTPException(status_code=404, detail={"message": "Files not found", "file_hashes": missing})
+    
+    timer = file_timer()
+    if fragment_storage:
+        await placement_nodes()
+    members = []
+    names: set = set()
+    for file_hash in file_hashes:
+        metadata = uploaded_files[file_hash]
+        table = file_fragments[file_hash]
+        if not FileProcessor.verify_fragment_tree(file_hash, metadata, table):
+            print(f"❌ Fragment hashes of {file_hash} do not match its Merkle root")
+            raise HTTPException(status_code=500, detail="File integrity check failed")
+        members.append((file_hash, metadata, list(table), archive_member(file_hash, metadata, names)))
+    
+    size = sum(len(header) + metadata["original_size"] + len(tar_padding(metadata["original_size"]))
+               for _, metadata, _, header in members) + 2 * TAR_BLOCK
+    return StreamingResponse(
+        timed_stream("retrieve_batch", timer, stream_archive(members, timer)),
+        media_type="application/x-tar",
+        headers={
+            "Content-Length": str(size),
+            "Content-Disposition": 'attachment; filename="chainvault-batch.tar"',
+            "X-ChainVault-File-Count": str(len(members))
+        }
+    )
+
+@app.api_route("/retrieve/{file_hash}", methods=["GET", "POST"])
+async def retrieve_file(file_hash: str, simulate_node_failure: bool = False, stream: bool = False,
+                        offset: Optional[int] = None, length: Optional[int] = None,
+                        range_header: Optional[str] = Header(None, alias="Range")):
+    """
+    Retrieve and decrypt a file:
+    1. Get fragments from storage
+    2. Simulate node failures if requested
+    3. Reassemble file from available fragments, rebuilding missing ones from parity
+    4. Verify integrity and return file
+    
+    With stream=true the file is returned as a binary body, decrypted fragment by
+    fragment, and the retrieval details are sent as X-ChainVault-* headers instead
+    of a base64 JSON payload.
+    
+    A Range header (bytes=start-end) or offset/length query parameters return just
+    that slice as a 206 binary body; only the fragments overlapping it are decrypted.
+    """
+    if file_hash not in uploaded_files:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    table = file_fragments.get(file_hash)
+    if not table:
+        raise HTTPException(status_code=404, detail="File fragments not found")
+    
+    metadata = uploaded_files[file_hash]
+    timer = file_timer()
+    if not FileProcessor.verify_fragment_tree(file_hash, metadata, table):
+        print(f"❌ Fragment hashes of {file_hash} do not match its Merkle root")
+        raise HTTPException(status_code=500, detail="File integrity check failed")
+    
+    # Fragment record dicts for this request; the catalog itself only keeps the compact table
+    fragments = list(table)
+    if fragment_storage:
+        # Current trust scores rank the replicas each fragment is fetched from
+        started = time.perf_counter()
+        await placement_nodes()
+        if timer is not None:
+            timer.add("nodes", time.perf_counter() - started)
+    # Simulate node failure for demo
+    available_fragments, failed_nodes = select_available_fragments(fragments, simulate_node_failure)
+    
+    byte_range = parse_byte_range(metadata["original_size"], range_header, offset, length)
+    if byte_range is not None:
+        start, end = byte_range
+        needed, stripes = FileProcessor.range_sources(metadata, fragments, available_fragments, start, end)
+        if stripes == []:
+            raise HTTPException(status_code=500, detail="File integrity check failed")
+        if stripes is None:
+            fragments_used = len(needed)
+        else:
+            available_ids = {frag["fragment_id"] for frag in available_fragments}
+            fragments_used = sum(frag["fragment_id"] in available_ids for frag in stripes)
+        
+        return StreamingResponse(
+            timed_stream("retrieve_range", timer,
+                         FileProcessor.iter_range(metadata, needed, stripes, available_fragments, start, end, timer)),
+            status_code=206,
+            media_type=metadata.get("content_type") or "application/octet-stream",
+            headers={
+                "Content-Length": str(end - start),
+                "Content-Range": f"bytes {start}-{end - 1}/{metadata['original_size']}",
+                "Accept-Ranges": "bytes",
+                "X-ChainVault-File-Hash": file_hash,
+                "X-ChainVault-Fragments-Used": str(fragments_used),
+                "X-ChainVault-Total-Fragments": str(len(fragments)),
+                "X-ChainVault-Failed-Fragments": ",".join(frag["fragment_hash"] for frag in failed_nodes)
+            }
+        )
+    
+    # Fail before decrypting anything (or sending headers) when too many fragments are missing to rebuild the file
+    if not FileProcessor.is_recoverable(metadata, fragments, available_fragments):
+        raise HTTPException(status_code=500, detail="File integrity check failed")
+    
+    if stream:
+        return StreamingResponse(
+            timed_stream("retrieve_stream", timer, stream_verified_file(file_hash, metadata, fragments, available_fragments, timer)),
+            media_type=metadata.get("content_type") or "application/octet-stream",
+            headers={
+                "Content-Length": str(metadata["original_size"]),
+                "Content-Disposition": content_disposition(metadata["original_filename"]),
+                "Accept-Ranges": "bytes",
+                "X-ChainVault-File-Hash": file_hash,
+                "X-ChainVault-Fragments-Used": str(len(available_fragments)),
+                "X-ChainVault-Total-Fragments": str(len(fragments)),
+                "X-ChainVault-Failed-Fragments": ",".join(frag["fragment_hash"] for frag in failed_nodes)
+            }
+        )
+    
     try:
-        # Reassemble file from available fragments (each fragment is already encrypted individually)
-        decrypted_content = FileProcessor.reassemble_file(available_fragments)
+        # Reassemble file from available fragments (each fragment is already encrypted individually);
+        # erasure-coded files rebuild missing fragments from parity
+        if "erasure" in metadata:
+            decrypted_content = await FileProcessor.collect(
+                FileProcessor.iter_stripes(metadata, fragments, available_fragments, timer), metadata["original_size"], timer
+            )
+        else:
+            decrypted_content = await FileProcessor.reassemble_file_parallel(available_fragments, timer)
         
-        # Verify integrity
-        reconstructed_hash = FileProcessor.generate_file_hash(decrypted_content)
+        # Every fragment was verified against a Merkle leaf; files stored before Merkle
+        # roots are verified by rehashing (which releases the GIL, so keep it off the event loop)
+        if "merkle_root" in metadata:
+            reconstructed_hash = file_hash
+        else:
+            reconstructed_hash = await asyncio.to_thread(FileProcessor.generate_file_hash, decrypted_content)
         if reconstructed_hash != file_hash:
             error_msg = f"Hash mismatch: expected {file_hash}, got {reconstructed_hash}"
             print(f"❌ {error_msg}")
             raise HTTPException(status_code=500, detail="File integrity check failed")
         
         # Encode for response
-        file_data = base64.b64encode(decrypted_content).decode('utf-8')
+        started = time.perf_counter()
+        file_data = (await asyncio.to_thread(base64.b64encode, decrypted_content)).decode('utf-8')
+        if timer is not None:
+            timer.add("encode", time.perf_counter() - started)
+        observe_file_stages("retrieve", timer)
         
         print(f"✅ File retrieval successful: {file_hash}, fragments used: {len(available_fragments)}/{len(fragments)}")
         
@@ -363,8 +1960,8 @@ async def retrieve_file(file_hash: str, simulate_node_failure: bool = False):
             "success": True,
             "file_hash": file_hash,
             "file_data": file_data,
-            "original_filename": uploaded_files[file_hash]["original_filename"],
-            "content_type": uploaded_files[file_hash]["content_type"],
+            "original_filename": metadata["original_filename"],
+            "content_type": metadata["content_type"],
             "fragments_used": len(available_fragments),
             "total_fragments": len(fragments),
             "failed_nodes": failed_nodes,
@@ -390,15 +1987,17 @@ async def update_trust_scores(failed_node_indices: List[int] = None, file_hash:
     - file_hash: Hash of the file that was recovered
     """
     try:
-        if not contract or not w3 or not w3.is_connected():
+        if not chain.available:
             return {
                 "success": False,
                 "detail": "Blockchain not available"
             }
         
-        # Get current trusted nodes
+        # Get current trusted nodes from the trust cache, as the chain lists them
+        # (failed_node_indices index into the on-chain getTrustedNodes() order)
         try:
-            node_addresses = contract.functions.getTrustedNodes().call()
+            trusted = await trust_cache.trusted_nodes(local_scores=False)
+            node_addresses = list(trusted)
         except Exception as e:
             print(f"Error fetching nodes: {e}")
             return {
@@ -413,8 +2012,7 @@ async def update_trust_scores(failed_node_indices: List[int] = None, file_hash:
             if 0 <= node_idx < len(node_addresses):
                 node_address = node_addresses[node_idx]
                 try:
-                    current_node_info = contract.functions.storageNodes(node_address).call()
-                    current_trust = int(current_node_info[1])
+                    current_trust = trusted[node_address]
                     
                     # Penalize: reduce by 15%
                     new_trust = max(0, int(current_trust * 0.85))
@@ -428,8 +2026,8 @@ async def update_trust_scores(failed_node_indices: List[int] = None, file_hash:
                         "penalty": current_trust - new_trust
                     })
                     
-                    # Cache the new trust score
-                    node_trust_cache[node_address] = new_trust
+                    # Cache the new trust score until the chain reports an update
+                    trust_cache.set_local_score(node_address, new_trust)
                 except Exception as e:
                     print(f"Error updating node {node_address}: {e}")
         
@@ -442,6 +2040,22 @@ async def update_trust_scores(failed_node_indices: List[int] = None, file_hash:
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Trust score update failed: {str(e)}")
 
+@app.get("/nodes/ranked")
+async def ranked_nodes(min_trust: int = 0, limit: int = None):
+    """
+    Active storage nodes ranked by trust score (highest first), served from the trust cache
+    
+    Query parameters:
+    - min_trust: Only include nodes with at least this trust score
+    - limit: Maximum number of nodes to return
+    """
+    nodes = await trust_cache.ranked(min_trust=min_trust, limit=limit)
+    return {
+        "nodes": nodes,
+        "count": len(nodes),
+        "cache": trust_cache.stats()
+    }
+
 @app.post("/verify/{file_hash}")
 async def verify_file_integrity(file_hash: str, uploaded_file: UploadFile = File(...)):
     """
@@ -475,8 +2089,53 @@ async def verify_file_integrity(file_hash: str, uploaded_file: UploadFile = File
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Verification failed: {str(e)}")
 
+def file_listing_entry(file_hash: str) -> Dict[str, Any]:
+    metadata = uploaded_files[file_hash]
+    return {
+        "file_hash": file_hash,
+        "filename": metadata["original_filename"],
+        "size": metadata["original_size"],
+        "upload_time": metadata["upload_timestamp"],
+        "fragment_count": metadata["fragment_count"]
+    }
+
+async def account_file_access(account: str) -> Dict[str, str]:
+    """
+    {file_hash: "owner" | "granted"} for the catalog files an account can access
+    Ownership and grants come from the chain; files not registered on chain fall
+    back to the owner recorded at upload.
+    """
+    access: Dict[str, str] = {}
+    if chain_index.synced:
+        # Straight from the index's per-account rows: O(files the account can access)
+        for topic, access_type in chain_index.account_files(account).items():
+            file_hash = catalog_index.by_topic(topic)
+            if file_hash is not None:
+                access[file_hash] = access_type
+        for file_hash in catalog_index.owned_by(account):
+            if file_hash not in access and not chain_index.is_registered(file_hash):
+                access[file_hash] = "owner"
+        return access
+    
+    # While the index catches up, every file is checked (in at most two cached, batched RPCs)
+    decisions: Dict[str, Any] = {}
+    if chain.available:
+        try:
+            decisions = await access_resolver.resolve(account, list(uploaded_files))
+        except Exception as e:
+            print(f"⚠️ Error checking blockchain access: {str(e)}")
+    for file_hash, access_type in decisions.items():
+        if access_type:
+            access[file_hash] = access_type
+    for file_hash in catalog_index.owned_by(account):
+        if file_hash not in decisions:
+            # Not resolvable on chain: fall back to the owner recorded at upload
+            access[file_hash] = "owner"
+    return access
+
 @app.get("/files")
-async def list_files(account: str = None):
+async def list_files(account: str = None, limit: Optional[int] = None, cursor: Optional[str] = None,
+                     sort: str = "upload_time", order: str = "asc", prefix: Optional[str] = None):
     """
     List files accessible to the current user
     
@@ -485,25 +2144,35 @@ async def list_files(account: str = None):
       - Files owned by the account
       - Files where account has been granted access
     
-    Query parameter:
+    Query parameters:
     - account: User's wallet address (0x...)
+    - limit: page size (all matching files when omitted); next_cursor fetches the next page
+    - cursor: next_cursor of the previous page
+    - sort: "upload_time" or "filename"; order: "asc" or "desc"
+    - prefix: only files whose name starts with this (case-insensitive)
     """
+    if sort not in SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(SORT_FIELDS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    if limit is not None and not 1 <= limit <= MAX_FILES_PAGE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_FILES_PAGE}")
+    try:
+        after = decode_cursor(cursor, sort) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     try:
-        # If no account provided, return all files (fallback)
+        # If no account provided, page through all files (fallback)
         if not account:
-            return {
-                "files": [
-                    {
-                        "file_hash": file_hash,
-                        "filename": metadata["original_filename"],
-                        "size": metadata["original_size"],
-                        "upload_time": metadata["upload_timestamp"],
-                        "fragment_count": metadata["fragment_count"]
-                    }
-                    for file_hash, metadata in uploaded_files.items()
-                ],
-                "total_files": len(uploaded_files)
+            file_hashes, total, last = catalog_index.page(sort, order == "desc", after, limit, prefix)
+            response = {
+                "files": [file_listing_entry(file_hash) for file_hash in file_hashes],
+                "total_files": total
             }
+            if last is not None:
+                response["next_cursor"] = encode_cursor(sort, last)
+            return response
         
         # Normalize the account address
         account = account.lower()
@@ -517,76 +2186,22 @@ async def list_files(account: str = None):
         # Convert to checksum address
         account = Web3.to_checksum_address(account)
         
+        access = await account_file_access(account)
+        file_hashes, total, last = catalog_index.page(sort, order == "desc", after, limit, prefix, candidates=access)
         accessible_files = []
+        for file_hash in file_hashes:
+            entry = file_listing_entry(file_hash)
+            entry["access_type"] = access[file_hash]
+            accessible_files.append(entry)
         
-        # Check each file for access
-        for file_hash, metadata in uploaded_files.items():
-            try:
-                # Try to query blockchain if available
-                if contract and w3 and w3.is_connected():
-                    # Check if user is owner
-                    try:
-                        file_metadata = contract.functions.getFileMetadata(file_hash).call()
-                        file_owner = file_metadata[1]  # owner is at index 1
-                        
-                        # Check if user owns the file
-                        if Web3.to_checksum_address(file_owner) == account:
-                            accessible_files.append({
-                                "file_hash": file_hash,
-                                "filename": metadata["original_filename"],
-                                "size": metadata["original_size"],
-                                "upload_time": metadata["upload_timestamp"],
-                                "fragment_count": metadata["fragment_count"],
-                                "access_type": "owner"
-                            })
-                            continue
-                        
-                        # Check if user has access permission
-                        has_access = contract.functions.hasFileAccess(file_hash, account).call()
-                        if has_access:
-                            accessible_files.append({
-                                "file_hash": file_hash,
-                                "filename": metadata["original_filename"],
-                                "size": metadata["original_size"],
-                                "upload_time": metadata["upload_timestamp"],
-                                "fragment_count": metadata["fragment_count"],
-                                "access_type": "granted"
-                            })
-                    
-                    except Exception as e:
-                        print(f"⚠️ Error checking blockchain access for {file_hash}: {str(e)}")
-                        # Fallback: check if owner is in metadata (if we stored it)
-                        if "owner" in metadata:
-                            if metadata["owner"].lower() == account.lower():
-                                accessible_files.append({
-                                    "file_hash": file_hash,
-                                    "filename": metadata["original_filename"],
-                                    "size": metadata["original_size"],
-                                    "upload_time": metadata["upload_timestamp"],
-                                    "fragment_count": metadata["fragment_count"],
-                                    "access_type": "owner"
-                                })
-                else:
-                    # Blockchain not available, use fallback (check metadata)
-                    if "owner" in metadata and metadata["owner"].lower() == account.lower():
-                        accessible_files.append({
-                            "file_hash": file_hash,
-                            "filename": metadata["original_filename"],
-                            "size": metadata["original_size"],
-                            "upload_time": metadata["upload_timestamp"],
-                            "fragment_count": metadata["fragment_count"],
-                            "access_type": "owner"
-                        })
-            
-            except Exception as e:
-                print(f"Error processing file {file_hash}: {str(e)}")
-                continue
-        
-        return {
+        response = {
             "files": accessible_files,
-            "total_files": len(accessible_files),
+            "total_files": total,
             "account": account
         }
+        if last is not None:
+            response["next_cursor"] = encode_cursor(sort, last)
+        return response
     
     except HTTPException:
         raise
@@ -601,28 +2216,113 @@ async def delete_file(file_hash: str):
         raise HTTPException(status_code=404, detail="File not found")
     
     # Remove from storage
-    del uploaded_files[file_hash]
-    if file_hash in file_fragments:
-        del file_fragments[file_hash]
+    delete_saved_file(file_hash)
+    access_resolver.invalidate_file(file_hash)
     
     return {
         "success": True,
         "message": f"File {file_hash} deleted successfully"
     }
 
+@app.get("/keys")
+async def get_key_status():
+    """Master key id and data key counts (never key material)"""
+    return key_manager.stats()
+
+def require_admin(token: Optional[str] = Header(None, alias="X-ChainVault-Admin-Token")) -> None:
+    """Dependency of operator endpoints: the request must carry ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Operator endpoints are disabled; set CHAINVAULT_ADMIN_TOKEN to enable them")
+    if token is None or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-ChainVault-Admin-Token")
+
+@app.post("/keys/rotate", dependencies=[Depends(require_admin)])
+async def rotate_master_key():
+    """
+    Replace the master key and rewrap every data key with it
+    Fragment payloads are not re-encrypted; only the keyring and keyfile change.
+    """
+    previous = key_manager.master_key_id
+    try:
+        new_id = await asyncio.to_thread(key_manager.rotate_master_key)
+    except KeyManagementError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "success": True,
+        "previous_master_key_id": previous,
+        "master_key_id": new_id,
+        "data_keys_rewrapped": key_manager.stats()["data_keys"]
+    }
+
+@app.get("/scrub")
+async def get_scrub_status(limit: int = 100):
+    """
+    Scrubber progress, throughput caps and totals, with the fragments it could not
+    repair and its most recent findings (at most `limit` of each)
+    """
+    limit = max(0, limit)
+    return {
+        **scrubber.stats(),
+        "scrubbing_worker": scrub_leader,
+        "unrepaired_fragments": list(scrubber.unrepaired.values())[:limit],
+        "recent_findings": list(scrubber.findings)[-limit:][::-1] if limit else []
+    }
+
+@app.post("/scrub", dependencies=[Depends(require_admin)])
+async def start_scrub(run: bool = True, rate_bytes: Optional[int] = None, concurrency: Optional[int] = None):
+    """
+    Start a scrub pass now (run=true) and/or change the scrubber's throughput caps
+    (rate_bytes: payload bytes per second, 0 for uncapped; concurrency: batches verified at once)
+    """
+    scrubber.set_limits(rate=rate_bytes, concurrency=concurrency)
+    started = scrubber.request() if run else False
+    if not scrub_leader:
+        message = "The scrubber runs in another worker process"
+    else:
+        message = "Scrub pass started" if started else ("Scrub pass already running" if run else "Limits updated")
+    return {
+        "success": True,
+        "started": started,
+        "message": message,
+        "scrub": scrubber.stats()
+    }
+
+@app.post("/storage/compact", dependencies=[Depends(require_admin)])
+async def compact_segments(min_dead_ratio: float = COMPACTION_DEAD_RATIO, include_active: bool = True):
+    """
+    Reclaim the space of deleted and replaced payloads now (segment backend): segments,
+    local and on nodes, with at least min_dead_ratio of their bytes dead are rewritten,
+    including the segment being written to unless include_active=false
+    """
+    if not segment_stores():
+        return {"success": True, "message": f"The {STORAGE_BACKEND} backend needs no compaction",
+                "segments": 0, "reclaimed_bytes": 0}
+    if not 0 <= min_dead_ratio <= 1:
+        raise HTTPException(status_code=400, detail="min_dead_ratio must be between 0 and 1")
+    result = await compact_storage(min_dead_ratio, include_active)
+    return {"success": True, **result, "storage": fragment_store.stats()}
+
 @app.get("/storage/stats")
 async def get_storage_stats():
     """Get storage statistics"""
     total_files = len(uploaded_files)
-    total_fragments = sum(len(frags) for frags in file_fragments.values())
-    total_size = sum(metadata["original_size"] for metadata in uploaded_files.values())
+    total_fragments = catalog_totals["fragments"]
+    total_size = catalog_totals["size_bytes"]
     
     return {
         "total_files": total_files,
         "total_fragments": total_fragments,
         "total_size_bytes": total_size,
         "total_size_mb": round(total_size / (1024 * 1024), 2),
-        "average_fragments_per_file": round(total_fragments / total_files, 2) if total_files > 0 else 0
+        "average_fragments_per_file": round(total_fragments / total_files, 2) if total_files > 0 else 0,
+        "fragment_metadata_bytes": catalog_totals["table_bytes"],
+        "stripe_index": stripe_index.stats(),
+        "compression": crypto_pool.compression or "none",
+        "compressed_fragments": catalog_totals["compressed_fragments"],
+        "fragment_store": fragment_store.stats(),
+        "fragment_cache": fragment_cache.stats(),
+        "replicated_fragments": len(fragment_storage),
+        "scrub": scrubber.stats()
     }
 
 if __name__ == "__main__":
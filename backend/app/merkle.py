@@ -0,0 +1,67 @@
+"""
+Merkle tree over a file's fragment hashes
+
+Leaves are the data fragments' plaintext SHA-256 hashes in file order. Leaf
+and interior hashes are domain separated (RFC 6962: 0x00 for leaves, 0x01 for
+nodes) and an unpaired last node is promoted to the next level unchanged, so a
+fragment cannot be passed off as an interior node. An inclusion proof is the
+list of sibling hashes from the leaf to the root: O(log n) hashes.
+"""
+import hashlib
+from typing import List, Tuple
+
+def leaf_hash(fragment_hash: str) -> bytes:
+    """Leaf for a fragment's hex SHA-256"""
+    return hashlib.sha256(b"\x00" + bytes.fromhex(fragment_hash)).digest()
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+def _next_level(level: List[bytes]) -> List[bytes]:
+    parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        parents.append(level[-1])
+    return parents
+
+def merkle_root(fragment_hashes: List[str]) -> str:
+    """Hex root over fragment hashes in order (the hash of nothing for an empty list)"""
+    if not fragment_hashes:
+        return hashlib.sha256(b"").hexdigest()
+    level = [leaf_hash(fragment_hash) for fragment_hash in fragment_hashes]
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0].hex()
+
+def inclusion_proof(fragment_hashes: List[str], index: int) -> Tuple[str, List[str]]:
+    """(root, sibling hashes from leaf to root) proving fragment_hashes[index]"""
+    if not 0 <= index < len(fragment_hashes):
+        raise IndexError(f"Leaf {index} out of range")
+    level = [leaf_hash(fragment_hash) for fragment_hash in fragment_hashes]
+    proof = []
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(level[sibling].hex())
+        level = _next_level(level)
+        index //= 2
+    return level[0].hex(), proof
+
+def verify_inclusion(fragment_hash: str, index: int, tree_size: int, proof: List[str], root: str) -> bool:
+    """Check that fragment_hash is leaf `index` of the tree of `tree_size` leaves with this root"""
+    if not 0 <= index < tree_size:
+        return False
+    node = leaf_hash(fragment_hash)
+    siblings = iter(proof)
+    size = tree_size
+    try:
+        while size > 1:
+            if index % 2:
+                node = node_hash(bytes.fromhex(next(siblings)), node)
+            elif index + 1 < size:
+                node = node_hash(node, bytes.fromhex(next(siblings)))
+            # else: unpaired last node, promoted unchanged
+            index //= 2
+            size = (size + 1) // 2
+    except (StopIteration, ValueError):
+        return False
+    return next(siblings, None) is None and node.hex() == root
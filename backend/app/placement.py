@@ -0,0 +1,279 @@
+"""
+Trust-aware fragment placement and replica fetching
+
+PlacementEngine copies every newly stored fragment payload to `replication`
+storage nodes picked from the trusted nodes, and reads payloads back from them:
+- placement uses weighted rendezvous hashing. Each (payload, node) pair gets a
+  pseudo-random score scaled by the node's trust score and the best
+  `replication` nodes win, so higher-trust nodes hold proportionally more
+  payloads, a payload's nodes are stable while the node set is, and a node
+  joining or leaving only moves the payloads it wins or held
+- a fetch asks the best replica first (highest trust score, then lowest
+  observed latency); if it has not answered after `hedge_delay` seconds the
+  next replica is asked as well and the first answer that passes `verify`
+  (the payload's AEAD tag, checked on the reader thread) wins. A replica that
+  fails or returns a bad payload is penalized in the trust cache and the next
+  one is tried; the local fragment store is the last resort.
+- uploads place payloads with place_many() on a worker thread, a pipeline
+  batch at a time, so node writes never block the event loop
+
+Nodes are reached through a FragmentStore per node address, opened by the
+`open_node` callable. The stand-in nodes used by the API are fragment stores
+in a directory per node, so replica lists are rebuilt on startup by listing
+what each node holds (and, when worker processes share the nodes, by asking
+them about payloads the other workers placed).
+"""
+import asyncio
+import hashlib
+import heapq
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .storage import FragmentStore, StorageError
+
+# Weight of a new latency sample in a node's moving average
+LATENCY_ALPHA = 0.2
+
+class PlacementEngine:
+    """Assigns fragment payloads to storage nodes and fetches them back with hedged reads"""
+
+    def __init__(self, open_node: Callable[[str], FragmentStore], trust_cache: Any, replication: int = 2,
+                 hedge_delay: float = 0.05, max_fetches: int = 32, failure_penalty: float = 0.85,
+                 verify: Optional[Callable[[bytes], bool]] = None):
+        self.open_node = open_node
+        self.trust_cache = trust_cache
+        self.replication = replication
+        self.hedge_delay = hedge_delay
+        # Trust score multiplier applied to a node each time it fails a read or write
+        self.failure_penalty = failure_penalty
+        # Checks a replica's payload before a fetch uses it (called on reader threads)
+        self.verify = verify
+        # storage key => addresses of the nodes holding a replica
+        self.replicas: Dict[str, List[str]] = {}
+        self._nodes: Dict[str, FragmentStore] = {}
+        # Last trust scores seen and moving-average read latency (seconds), by node address
+        self._trust: Dict[str, int] = {}
+        self._latency: Dict[str, float] = {}
+        self._node_failures: Dict[str, int] = {}
+        # Placement and replica reads run on worker threads: guards the replica lists and counters they update
+        self._place_lock = threading.Lock()
+        self._fetch_slots = asyncio.Semaphore(max_fetches)
+        # Own pool, so reads stuck on a slow node cannot starve other work of threads
+        self._readers = ThreadPoolExecutor(max_fetches, thread_name_prefix="chainvault-fetch")
+        self.placed = 0
+        self.fetches = 0
+        self.hedged = 0
+        self.backup_reads = 0  # Fetches answered by a replica other than the first choice
+        self.failures = 0
+        self.corrupt = 0  # Replica payloads that failed verification
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.replication > 0
+
+    def node(self, address: str) -> FragmentStore:
+        store = self._nodes.get(address)
+        if store is None:
+            store = self._nodes[address] = self.open_node(address)
+        return store
+
+    def load(self, addresses: Iterable[str], is_live: Callable[[str], bool]) -> int:
+        """
+        Rebuild replica lists from the payloads held by the given nodes, deleting
+        replicas of payloads that are no longer stored; returns how many were deleted
+        """
+        orphans = 0
+        for address in addresses:
+            store = self.node(address)
+            for key in store.keys():
+                if is_live(key):
+                    self.replicas.setdefault(key, []).append(address)
+                else:
+                    store.delete(key)
+                    orphans += 1
+        return orphans
+
+    async def trusted(self) -> Dict[str, int]:
+        """{address: trust score} of the nodes payloads may be placed on (empty when placement is off)"""
+        if not self.enabled:
+            return {}
+        try:
+            trusted = await self.trust_cache.trusted_nodes()
+        except Exception as e:
+            print(f"⚠️ Trusted nodes unavailable for placement: {e}")
+            return {}
+        self._trust.update(trusted)
+        return trusted
+
+    # ---- placement ----
+
+    @staticmethod
+    def _weight(key: str, address: str, trust: int) -> float:
+        digest = hashlib.sha256(f"{key}:{address}".encode("ascii")).digest()
+        # Uniform in (0, 1), so the log is finite and negative
+        uniform = (int.from_bytes(digest[:8], "big") + 0.5) / 2 ** 64
+        return -max(trust, 1) / math.log(uniform)
+
+    def choose(self, key: str, trusted: Dict[str, int]) -> List[str]:
+        """Nodes a payload belongs on, best first"""
+        return heapq.nlargest(self.replication, trusted,
+                              key=lambda address: self._weight(key, address, trusted[address]))
+
+    def place(self, key: str, payload: bytes, trusted: Dict[str, int]) -> List[str]:
+        """Copy a payload to its nodes (once per key) and return the nodes that took it"""
+        if not trusted or key in self.replicas:
+            return self.replicas.get(key, [])
+        placed = []
+        for address in self.choose(key, trusted):
+            try:
+                self.node(address).put(key, payload)
+            except Exception as e:
+                self.record_failure(address, e)
+                continue
+            placed.append(address)
+        if placed:
+            with self._place_lock:
+                self.replicas.setdefault(key, placed)
+                self.placed += 1
+        return placed
+
+    def place_many(self, payloads: Iterable[Tuple[str, bytes]], trusted: Dict[str, int]) -> int:
+        """Place a batch of (key, payload) pairs (blocking: run it on a worker thread); returns how many were placed"""
+        return sum(1 for key, payload in payloads if self.place(key, payload, trusted))
+
+    def locate(self, keys: Iterable[str], addresses: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        {key: addresses holding it} for the given payloads, by asking each node;
+        finds the replicas of payloads another process placed
+        """
+        addresses = list(addresses)
+        found: Dict[str, List[str]] = {}
+        for key in keys:
+            holders = [address for address in addresses if key in self.node(address)]
+            if holders:
+                found[key] = holders
+        return found
+
+    def drop(self, key: str, addresses: Iterable[str] = ()) -> None:
+        """
+        Delete every replica of a payload that is no longer stored; `addresses` are
+        also searched when its replicas are unknown here (placed by another process)
+        """
+        held = self.replicas.pop(key, None)
+        if held is None:
+            held = self.locate([key], addresses).get(key, [])
+        for address in held:
+            try:
+                self.node(address).delete(key)
+            except Exception as e:
+                self.record_failure(address, e)
+
+    # ---- fetching ----
+
+    def rank(self, addresses: List[str]) -> List[str]:
+        """Replicas in the order to ask them: highest trust, then lowest latency"""
+        # A replica slower than the hedge delay would be hedged against anyway, so it goes last
+        return sorted(addresses, key=lambda address: (self._latency.get(address, 0.0) > self.hedge_delay,
+                                                      -self._trust.get(address, 0), self._latency.get(address, 0.0)))
+
+    def record_failure(self, address: str, error: Exception) -> None:
+        """Count a failed read or write and lower the node's trust score until the chain reports a new one"""
+        with self._place_lock:
+            self.failures += 1
+            self._node_failures[address] = self._node_failures.get(address, 0) + 1
+        print(f"⚠️ Storage node {address} failed: {error}")
+        score = self._trust.get(address)
+        if score is not None:
+            self._trust[address] = max(0, int(score * self.failure_penalty))
+            self.trust_cache.set_local_score(address, self._trust[address])
+
+    def _observe(self, address: str, elapsed: float) -> None:
+        previous = self._latency.get(address)
+        self._latency[address] = elapsed if previous is None else previous + LATENCY_ALPHA * (elapsed - previous)
+
+    def _get_verified(self, address: str, key: str) -> bytes:
+        payload = self.node(address).get(key)
+        if self.verify is not None and not self.verify(payload):
+            with self._place_lock:
+                self.corrupt += 1
+            raise StorageError(f"Replica of {key} failed verification")
+        return payload
+
+    def _read(self, address: str, key: str) -> "asyncio.Future[bytes]":
+        """Start reading a replica; its latency is recorded when the read ends, even if nobody waits for it"""
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().run_in_executor(self._readers, self._get_verified, address, key)
+
+        def finished(future: "asyncio.Future[bytes]") -> None:
+            self._observe(address, time.perf_counter() - started)
+            if not future.cancelled():
+                future.exception()  # Retrieved here, so a losing read that failed is not logged as unhandled
+
+        future.add_done_callback(finished)
+        return future
+
+    async def fetch(self, key: str, local: Callable[[], bytes]) -> bytes:
+        """Payload from the best responding replica, or from `local` when no replica has it"""
+        addresses = self.replicas.get(key)
+        if not addresses:
+            return local()
+        self.fetches += 1
+        ranked = self.rank(addresses)
+        waiting = deque(ranked)
+        pending: Dict[asyncio.Future, str] = {}
+
+        def ask_next() -> None:
+            if waiting:
+                address = waiting.popleft()
+                pending[self._read(address, key)] = address
+
+        async with self._fetch_slots:
+            ask_next()
+            # Reads still running when a replica answers finish in the pool; their results are dropped
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_delay if waiting else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Slow replica: hedge with the next one, keeping the first in the race
+                    self.hedged += 1
+                    ask_next()
+                    continue
+                for read in done:
+                    address = pending.pop(read)
+                    try:
+                        payload = read.result()
+                    except Exception as e:
+                        self.record_failure(address, e)
+                        ask_next()
+                        continue
+                    if address != ranked[0]:
+                        self.backup_reads += 1
+                    return payload
+        self.fallbacks += 1
+        return local()
+
+    def close(self) -> None:
+        self._readers.shutdown(wait=True)
+        for store in self._nodes.values():
+            store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "replication": self.replication,
+            "nodes": len(self._nodes),
+            "replicated_fragments": len(self.replicas),
+            "placed": self.placed,
+            "fetches": self.fetches,
+            "hedged": self.hedged,
+            "backup_reads": self.backup_reads,
+            "failures": self.failures,
+            "corrupt_replicas": self.corrupt,
+            "local_fallbacks": self.fallbacks,
+            "node_latency_ms": {address: round(latency * 1000, 3) for address, latency in self._latency.items()},
+            "node_failures": dict(self._node_failures)
+        }
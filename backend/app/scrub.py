@@ -0,0 +1,388 @@
+"""
+Background scrubbing and repair of stored fragments
+
+Nothing reads a fragment payload until its file is retrieved, so a flipped bit
+on disk or a replica lost by a storage node goes unnoticed until a retrieval
+fails. The Scrubber walks every referenced payload in key order, a batch at a
+time, and checks every copy of it: the one in the local fragment store and each
+storage node replica must decrypt to the fragment's hash.
+
+- batches are verified on the crypto pool, `concurrency` at a time, and only
+  while the pool has an idle worker, so foreground requests go first; payload
+  bytes read per second are capped at `rate`
+- the last key checked is checkpointed, so a restart resumes the pass
+- a missing or corrupt copy is rewritten from a good copy, or rebuilt from its
+  erasure stripe when no good copy is left; fragments that cannot be repaired
+  are kept in `unrepaired` until a later pass finds them good
+- a storage node holding a bad copy is penalized in the trust cache through
+  the placement engine, like a node that fails a read
+"""
+import asyncio
+import json
+import os
+import time
+from bisect import bisect_right
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from . import crypto_executor as crypto
+from .crypto_executor import CryptoExecutor
+from .placement import PlacementEngine
+from .storage import RefCountedStore, StorageError
+
+LOCAL = "local"  # Location of the copy in the local fragment store; replicas are named by node address
+YIELD_DELAY = 0.05  # Seconds to wait for a busy crypto pool before checking again
+CHECKPOINT_INTERVAL = 30.0
+NOT_STORED = "not stored"
+
+# (k, m, fragment records of one stripe) of the erasure stripes containing a payload
+StripeLookup = Callable[[str], Iterable[Tuple[int, int, List[Dict[str, Any]]]]]
+
+class Scrubber:
+    """Rate-limited background verification and repair of every stored fragment copy"""
+
+    def __init__(self, store: RefCountedStore, placement: PlacementEngine, pool: CryptoExecutor,
+                 data_key: Callable[[Any], Optional[bytes]], stripes: StripeLookup,
+                 nodes: Optional[Callable[[], Awaitable[Any]]] = None, interval: float = 86400.0,
+                 rate: int = 8 * 1024 * 1024, batch_size: int = 16, concurrency: int = 2,
+                 checkpoint_path: Optional[str] = None, max_findings: int = 1000):
+        self.store = store
+        self.placement = placement
+        self.pool = pool
+        # Data key a payload was sealed with (None for the base key)
+        self.data_key = data_key
+        self.stripes = stripes
+        # Refreshes node trust scores before a pass, so penalties apply to current scores
+        self.nodes = nodes
+        self.interval = interval  # Seconds between scheduled passes; 0 runs passes only on request
+        self.rate = rate  # Payload bytes read per second; 0 is uncapped
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.checkpoint_path = checkpoint_path
+        self.state = "idle"  # idle -> running <-> yielding | throttled
+        # Last key checked by the current pass (None between passes)
+        self.cursor: Optional[str] = None
+        self.passes = 0
+        self.last_finished: Optional[float] = None
+        self.last_pass: Optional[Dict[str, Any]] = None
+        self._pass: Optional[Dict[str, Any]] = None
+        self._started = time.time()
+        # Set by request(); created by run(), so it belongs to the loop the scrubber runs on
+        self._wake: Optional[asyncio.Event] = None
+        # Recent problems found, and the latest one of each fragment that is still not repaired
+        self.findings: Deque[Dict[str, Any]] = deque(maxlen=max_findings)
+        self.unrepaired: Dict[str, Dict[str, Any]] = {}
+        self.fragments_checked = 0
+        self.copies_checked = 0
+        self.bytes_checked = 0
+        self.corrupt = 0
+        self.missing = 0
+        self.repaired = 0
+        self.yielded_seconds = 0.0
+        self.throttled_seconds = 0.0
+        self.last_error: Optional[str] = None
+        self.load_checkpoint()
+
+    # ---- scheduling ----
+
+    def next_pass_at(self) -> Optional[float]:
+        if self.interval <= 0:
+            return None
+        return (self.last_finished or self._started) + self.interval
+
+    def request(self) -> bool:
+        """Start a pass now; False if one is already running (or the scrubber is not running)"""
+        if self.state != "idle" or self._wake is None:
+            return False
+        self._wake.set()
+        return True
+
+    def set_limits(self, rate: Optional[int] = None, concurrency: Optional[int] = None) -> None:
+        """Change the throughput caps; a running pass picks them up with its next batch"""
+        if rate is not None:
+            self.rate = max(0, rate)
+        if concurrency is not None:
+            self.concurrency = max(1, concurrency)
+
+    async def run(self) -> None:
+        """Run passes forever: when one is due, when requested, or right away to finish an interrupted pass"""
+        self._wake = asyncio.Event()
+        while True:
+            if self.cursor is None:
+                due = self.next_pass_at()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), None if due is None else max(0.0, due - time.time()))
+                except asyncio.TimeoutError:
+                    pass
+            self._wake.clear()
+            try:
+                await self.scrub_pass()
+                self.last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The cursor is kept, so the pass resumes where it failed
+                self.state = "idle"
+                self.last_error = str(e)
+                print(f"⚠️ Scrub pass failed: {e}")
+                await asyncio.sleep(CHECKPOINT_INTERVAL)
+
+    # ---- passes ----
+
+    async def _wait_for_pool(self) -> None:
+        """Wait while foreground work keeps every crypto worker busy"""
+        if self.pool.in_flight < self.pool.workers:
+            return
+        self.state = "yielding"
+        started = time.monotonic()
+        while self.pool.in_flight >= self.pool.workers:
+            await asyncio.sleep(YIELD_DELAY)
+        self.yielded_seconds += time.monotonic() - started
+        self.state = "running"
+
+    async def scrub_pass(self) -> None:
+        """Check every referenced payload once, resuming after the checkpointed cursor"""
+        self.state = "running"
+        if self.nodes is not None:
+            try:
+                await self.nodes()
+            except Exception as e:
+                print(f"⚠️ Node trust scores unavailable for scrubbing: {e}")
+        keys = sorted(self.store.keys())
+        position = bisect_right(keys, self.cursor) if self.cursor is not None else 0
+        self._pass = {"started_at": time.time(), "resumed_at": position, "position": position, "total": len(keys),
+                      "fragments": 0, "bytes": 0, "problems": 0, "repaired": 0}
+        print(f"🔎 Scrub pass started: {len(keys) - position} of {len(keys)} fragments to check")
+        last_save = time.monotonic()
+        try:
+            while position < len(keys):
+                await self._wait_for_pool()
+                window = keys[position:position + self.batch_size * self.concurrency]
+                started = time.monotonic()
+                scanned = await asyncio.gather(*(self.scrub_batch(window[i:i + self.batch_size])
+                                                 for i in range(0, len(window), self.batch_size)))
+                position += len(window)
+                self.cursor = window[-1]
+                self._pass["position"] = position
+                if self.rate > 0:
+                    # A window of n bytes takes at least n / rate seconds
+                    delay = sum(scanned) / self.rate - (time.monotonic() - started)
+                    if delay > 0:
+                        self.state = "throttled"
+                        await asyncio.sleep(delay)
+                        self.throttled_seconds += delay
+                        self.state = "running"
+                if time.monotonic() - last_save > CHECKPOINT_INTERVAL:
+                    await asyncio.to_thread(self.save_checkpoint)
+                    last_save = time.monotonic()
+        except BaseException:
+            self.state = "idle"
+            raise
+
+        finished = time.time()
+        self.last_pass = {key: value for key, value in self._pass.items() if key not in ("position", "resumed_at")}
+        self.last_pass.update(finished_at=finished, seconds=round(finished - self._pass["started_at"], 3))
+        self.passes += 1
+        self.last_finished = finished
+        self.cursor = None
+        self._pass = None
+        self.state = "idle"
+        await asyncio.to_thread(self.save_checkpoint)
+        print(f"✅ Scrub pass finished: {self.last_pass['fragments']} fragments, "
+              f"{self.last_pass['problems']} problems, {self.last_pass['repaired']} repaired")
+
+    # ---- checking ----
+
+    def _copy_store(self, location: str) -> Any:
+        return self.store.store if location == LOCAL else self.placement.node(location)
+
+    def _read_copies(self, keys: List[str]) -> List[Tuple[str, str, Optional[bytes], Optional[str]]]:
+        """(key, location, payload or None, read error or None) of every copy of the payloads"""
+        copies = []
+        for key in keys:
+            for location in [LOCAL] + list(self.placement.replicas.get(key, [])):
+                store = self._copy_store(location)
+                if key not in store:
+                    copies.append((key, location, None, NOT_STORED))
+                    continue
+                try:
+                    copies.append((key, location, store.get(key), None))
+                except Exception as e:
+                    copies.append((key, location, None, str(e)))
+        return copies
+
+    async def scrub_batch(self, keys: List[str]) -> int:
+        """Verify every copy of a batch of payloads and repair the bad ones; returns the bytes read"""
+        copies = await asyncio.to_thread(self._read_copies, keys)
+        readable = [(key, payload) for key, _, payload, _ in copies if payload is not None]
+        errors = iter(await self.pool.submit(crypto.verify_batch, [
+            (key, payload, key, self.store.codec(key), self.data_key(payload)) for key, payload in readable
+        ]))
+
+        good: Dict[str, Tuple[str, bytes]] = {}
+        bad: Dict[str, List[Tuple[str, str, str]]] = {}
+        for key, location, payload, error in copies:
+            if payload is None:
+                bad.setdefault(key, []).append((location, "missing" if error == NOT_STORED else "corrupt", error))
+                continue
+            error = next(errors)
+            if error is not None:
+                bad.setdefault(key, []).append((location, "corrupt", error))
+            elif key not in good:
+                good[key] = (location, payload)
+
+        scanned = sum(len(payload) for _, payload in readable)
+        self.fragments_checked += len(keys)
+        self.copies_checked += len(copies)
+        self.bytes_checked += scanned
+        if self._pass is not None:
+            self._pass["fragments"] += len(keys)
+            self._pass["bytes"] += scanned
+        for key in keys:
+            if key not in bad:
+                self.unrepaired.pop(key, None)
+        for key, problems in bad.items():
+            # Payloads deleted while they were being checked are not problems
+            if key in self.store:
+                await self.repair(key, problems, good.get(key))
+        return scanned
+
+    # ---- repair ----
+
+    def _read_any(self, fragments: List[Dict[str, Any]]) -> List[Optional[Any]]:
+        """Payload of each fragment record from any copy that can be read (verified later), else None"""
+        payloads: List[Optional[Any]] = []
+        for fragment in fragments:
+            if "data" in fragment:
+                payloads.append(fragment["data"])
+                continue
+            key = fragment["storage_key"]
+            payload = None
+            for location in [LOCAL] + list(self.placement.replicas.get(key, [])):
+                try:
+                    payload = self._copy_store(location).get(key)
+                    break
+                except Exception:
+                    continue
+            payloads.append(payload)
+        return payloads
+
+    async def rebuild(self, key: str) -> Optional[bytes]:
+        """A new payload for a fragment rebuilt from the rest of an erasure stripe it belongs to, if any"""
+        for k, m, stripe in self.stripes(key):
+            lost = [fragment for fragment in stripe if fragment["original_hash"] == key]
+            others = [fragment for fragment in stripe if fragment["original_hash"] != key]
+            parity = [fragment for fragment in stripe if fragment.get("parity")]
+            payloads = await asyncio.to_thread(self._read_any, others)
+            shards = [(fragment["shard"], fragment["fragment_id"], payload, fragment["original_hash"],
+                       fragment.get("codec"), self.data_key(payload))
+                      for fragment, payload in zip(others, payloads) if payload is not None]
+            data = [(fragment["size"], fragment["original_hash"]) for fragment in stripe if not fragment.get("parity")]
+            shard = lost[0]["shard"]
+            rebuilt = (await self.pool.submit(crypto.rebuild_stripe_batch, [
+                (k, m, parity[0]["size"] if parity else 0, data, shards, [(shard, key, self.store.codec(key))])
+            ]))[0]
+            if rebuilt is not None:
+                return rebuilt[shard]
+        return None
+
+    def _rewrite(self, key: str, location: str, payload: bytes) -> bool:
+        if location == LOCAL:
+            return self.store.repair(key, payload)
+        if location not in self.placement.replicas.get(key, []):
+            return False  # The replica was dropped meanwhile
+        self.placement.node(location).put(key, payload)
+        return True
+
+    async def repair(self, key: str, problems: List[Tuple[str, str, str]], good: Optional[Tuple[str, bytes]]) -> None:
+        """Record the bad copies of a payload and rewrite them from a good copy or from parity"""
+        source, payload = good if good is not None else ("parity", await self.rebuild(key))
+        finding = None
+        repaired_all = True
+        for location, problem, error in problems:
+            if problem == "missing":
+                self.missing += 1
+            else:
+                self.corrupt += 1
+            if location != LOCAL:
+                self.placement.record_failure(location, StorageError(f"Scrub found fragment {key} {problem}: {error}"))
+            finding = {"fragment": key, "location": location, "problem": problem, "error": error,
+                       "detected_at": time.time(), "repaired_from": None}
+            if payload is not None:
+                try:
+                    if await asyncio.to_thread(self._rewrite, key, location, payload):
+                        finding["repaired_from"] = source
+                except Exception as e:
+                    self.placement.record_failure(location, e)
+            if finding["repaired_from"] is None:
+                repaired_all = False
+            else:
+                self.repaired += 1
+            self.findings.append(finding)
+            if self._pass is not None:
+                self._pass["problems"] += 1
+                self._pass["repaired"] += finding["repaired_from"] is not None
+            print(f"{'🔧' if finding['repaired_from'] else '❌'} Fragment {key} {problem} at {location}"
+                  + (f", repaired from {source}" if finding["repaired_from"] else ", not repaired"))
+        if repaired_all:
+            self.unrepaired.pop(key, None)
+        else:
+            self.unrepaired[key] = finding
+
+    # ---- persistence ----
+
+    def save_checkpoint(self) -> None:
+        if not self.checkpoint_path:
+            return
+        state = {"cursor": self.cursor, "passes": self.passes, "last_finished": self.last_finished, "last_pass": self.last_pass}
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self) -> None:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.cursor = state.get("cursor")
+            self.passes = state.get("passes", 0)
+            self.last_finished = state.get("last_finished")
+            self.last_pass = state.get("last_pass")
+        except Exception as e:
+            print(f"⚠️ Could not load scrub checkpoint: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        current = None
+        if self._pass is not None:
+            elapsed = time.time() - self._pass["started_at"]
+            total, position = self._pass["total"], self._pass["position"]
+            checked = position - self._pass["resumed_at"]
+            current = {
+                **self._pass,
+                "progress": round(position / total, 4) if total else 1.0,
+                "bytes_per_second": round(self._pass["bytes"] / elapsed) if elapsed > 0 else 0,
+                "eta_seconds": round(elapsed / checked * (total - position), 1) if checked else None
+            }
+        return {
+            "state": self.state,
+            "interval_seconds": self.interval,
+            "rate_bytes": self.rate,
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "passes": self.passes,
+            "current_pass": current,
+            "last_pass": self.last_pass,
+            "next_pass_at": self.next_pass_at() if self.state == "idle" and self.cursor is None else None,
+            "fragments_checked": self.fragments_checked,
+            "copies_checked": self.copies_checked,
+            "bytes_checked": self.bytes_checked,
+            "corrupt": self.corrupt,
+            "missing": self.missing,
+            "repaired": self.repaired,
+            "unrepaired": len(self.unrepaired),
+            "yielded_seconds": round(self.yielded_seconds, 3),
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "last_error": self.last_error
+        }
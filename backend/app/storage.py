@@ -0,0 +1,954 @@
+"""
+Pluggable storage backends for encrypted fragment payloads and the file catalog
+
+- MemoryFragmentStore keeps payloads in a dict (tests and throwaway demos)
+- SegmentFragmentStore appends raw payloads to on-disk segment files, keeps an
+  in-memory offset index and reads payloads back through mmap, so the data set
+  can be larger than RAM and survives restarts; compact() rewrites mostly-dead
+  segments to reclaim the space of deleted and replaced payloads
+- SQLiteFragmentStore keeps payloads in an SQLite database in WAL mode, which
+  several worker processes can open at once
+- RefCountedStore wraps any of them as a content-addressed store with reference
+  counts, so fragments shared between files are stored once; SharedRefCountedStore
+  does the same with the counts kept in the SQLite database, so worker processes
+  sharing it share one set of counts
+- CatalogLog persists file metadata and fragment records as an append-only
+  JSON-lines log that is replayed on startup; SQLiteCatalog keeps them in SQLite
+  with a feed of changes, so each worker process can keep its in-memory copy of
+  the catalog current with what the others write
+"""
+import fcntl
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+class StorageError(Exception):
+    """Raised when a stored fragment is missing or fails its checksum"""
+
+def lock_file(path: str) -> Optional[Any]:
+    """
+    Take an exclusive lock on path (created if needed) for as long as the returned
+    file stays open; None if another process holds it
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handle = open(path, "a")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        return None
+    return handle
+
+class FragmentStore:
+    """Interface for encrypted fragment payload storage"""
+
+    name = "base"
+
+    def put(self, key: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def __contains__(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def keys(self) -> List[str]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "fragments": len(self)}
+
+    def compact(self, min_dead_ratio: float = 0.5, include_active: bool = False) -> Dict[str, int]:
+        """Reclaim space held by deleted payloads, where the backend needs it (see SegmentFragmentStore)"""
+        return {"segments": 0, "reclaimed_bytes": 0}
+
+    def close(self) -> None:
+        pass
+
+class MemoryFragmentStore(FragmentStore):
+    """Keeps fragment payloads in a process-local dict"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, bytes] = {}
+        self._bytes = 0
+
+    def put(self, key: str, data: bytes) -> None:
+        previous = self._data.get(key)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._data[key] = bytes(data)
+        self._bytes += len(data)
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self._data[key]
+        except KeyError:
+            raise StorageError(f"Fragment {key} not found")
+
+    def delete(self, key: str) -> None:
+        data = self._data.pop(key, None)
+        if data is not None:
+            self._bytes -= len(data)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self) -> List[str]:
+        return list(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "fragments": len(self), "stored_bytes": self._bytes}
+
+class SegmentFragmentStore(FragmentStore):
+    """
+    Append-only segment files with an offset index and mmap reads
+
+    Each record is HEADER | key | payload. Deletes append a tombstone record.
+    The offset index is rebuilt on startup by scanning record headers, and a
+    torn record at the end of the active segment (crash mid-write) is truncated.
+    The index lives in one process, so the directory is locked against others.
+
+    Deleted and replaced records stay in their segment until compact() copies the
+    live records of sealed segments that are mostly dead into the active segment
+    and deletes the old files. Segments are replayed in id order, so a crash
+    before a file is deleted only leaves copies that the newer ones supersede.
+    """
+
+    name = "segment"
+    MAGIC = b"CVF1"
+    HEADER = struct.Struct("<4sBHII")  # magic, op, key length, payload length, crc32
+    OP_PUT = 0
+    OP_DELETE = 1
+
+    def __init__(self, directory: str, segment_size: int = 256 * 1024 * 1024, sync: bool = False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync = sync
+        # key => (segment_id, payload_offset, payload_length, crc32)
+        self._index: Dict[str, Tuple[int, int, int, int]] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        # segment_id => [file bytes, bytes of records still in the index]
+        self._segments: Dict[int, List[int]] = {}
+        self._lock = threading.RLock()
+        self.live_bytes = 0
+        self.compactions = 0
+        self.reclaimed_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._dir_lock = lock_file(os.path.join(directory, "LOCK"))
+        if self._dir_lock is None:
+            raise StorageError(f"{directory} is in use by another process; "
+                               "use the sqlite storage backend to share storage between worker processes")
+        segment_ids = sorted(
+            int(name[len("segment-"):-len(".dat")])
+            for name in os.listdir(directory)
+            if name.startswith("segment-") and name.endswith(".dat")
+        )
+        for segment_id in segment_ids:
+            self._scan(segment_id)
+
+        self._active_id = segment_ids[-1] if segment_ids else 1
+        self._active_size = os.path.getsize(self._segment_path(self._active_id)) if segment_ids else 0
+        self._segments.setdefault(self._active_id, [self._active_size, 0])
+        # Opened on first write, and again after close()
+        self._writer = None
+
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment_id:06d}.dat")
+
+    def _records(self, f: Any, file_size: int) -> Iterator[Tuple[int, str, int, int, int]]:
+        """(op, key, payload_offset, payload_length, crc32) of each whole record in an open segment file"""
+        offset = 0
+        while True:
+            header = f.read(self.HEADER.size)
+            if len(header) < self.HEADER.size:
+                return
+            magic, op, key_length, payload_length, crc = self.HEADER.unpack(header)
+            if magic != self.MAGIC:
+                return
+            key_bytes = f.read(key_length)
+            payload_offset = offset + self.HEADER.size + key_length
+            if len(key_bytes) < key_length or payload_offset + payload_length > file_size:
+                return
+            yield op, key_bytes.decode("utf-8"), payload_offset, payload_length, crc
+            f.seek(payload_length, os.SEEK_CUR)
+            offset = payload_offset + payload_length
+
+    def _scan(self, segment_id: int) -> None:
+        """Rebuild index entries from one segment file"""
+        path = self._segment_path(segment_id)
+        file_size = os.path.getsize(path)
+        offset = 0
+        self._segments[segment_id] = [0, 0]
+
+        with open(path, "rb") as f:
+            for op, key, payload_offset, payload_length, crc in self._records(f, file_size):
+                self._drop(key)
+                if op == self.OP_PUT:
+                    self._index[key] = (segment_id, payload_offset, payload_length, crc)
+                    self.live_bytes += payload_length
+                    self._segments[segment_id][1] += self._record_size(key, payload_length)
+                offset = payload_offset + payload_length
+
+        if offset < file_size:
+            print(f"⚠️ Truncating torn record at {path}:{offset}")
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        self._segments[segment_id][0] = offset
+
+    def _record_size(self, key: str, payload_length: int) -> int:
+        return self.HEADER.size + len(key.encode("utf-8")) + payload_length
+
+    def _drop(self, key: str) -> None:
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self.live_bytes -= entry[2]
+            self._segments[entry[0]][1] -= self._record_size(key, entry[2])
+
+    def _append(self, op: int, key: str, data: bytes, crc: Optional[int] = None) -> Tuple[int, int, int]:
+        """
+        Append a record to the active segment and return (segment_id, payload_offset, crc32);
+        crc is the payload's checksum when it is already known (a record being moved)
+        """
+        if self._active_size >= self.segment_size:
+            self._seal()
+        if self._writer is None:
+            self._writer = open(self._segment_path(self._active_id), "ab")
+
+        key_bytes = key.encode("utf-8")
+        if crc is None:
+            crc = zlib.crc32(data)
+        self._writer.write(self.HEADER.pack(self.MAGIC, op, len(key_bytes), len(data), crc))
+        self._writer.write(key_bytes)
+        self._writer.write(data)
+        self._writer.flush()
+        if self.sync:
+            os.fsync(self._writer.fileno())
+
+        payload_offset = self._active_size + self.HEADER.size + len(key_bytes)
+        self._active_size = payload_offset + len(data)
+        self._segments[self._active_id][0] = self._active_size
+        return self._active_id, payload_offset, crc
+
+    def _seal(self) -> None:
+        """Close the active segment; the next record starts a new one"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._active_id += 1
+        self._active_size = 0
+        self._segments[self._active_id] = [0, 0]
+
+    def _index_put(self, key: str, segment_id: int, payload_offset: int, payload_length: int, crc: int) -> None:
+        self._drop(key)
+        self._index[key] = (segment_id, payload_offset, payload_length, crc)
+        self.live_bytes += payload_length
+        self._segments[segment_id][1] += self._record_size(key, payload_length)
+
+    def _map(self, segment_id: int, needed: int) -> mmap.mmap:
+        """Return a read-only map of a segment covering at least `needed` bytes"""
+        mapped = self._maps.get(segment_id)
+        if mapped is None or len(mapped) < needed:
+            if mapped is not None:
+                mapped.close()
+            with open(self._segment_path(segment_id), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment_id] = mapped
+        return mapped
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            segment_id, payload_offset, crc = self._append(self.OP_PUT, key, data)
+            self._index_put(key, segment_id, payload_offset, len(data), crc)
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                raise StorageError(f"Fragment {key} not found")
+            segment_id, payload_offset, payload_length, crc = entry
+            data = self._map(segment_id, payload_offset + payload_length)[payload_offset:payload_offset + payload_length]
+
+        if zlib.crc32(data) != crc:
+            raise StorageError(f"Fragment {key} failed checksum")
+        return data
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._index:
+                self._append(self.OP_DELETE, key, b"")
+                self._drop(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._index)
+
+    @property
+    def dead_bytes(self) -> int:
+        """Segment bytes held by deleted or replaced records and tombstones"""
+        with self._lock:
+            return sum(size - live for size, live in self._segments.values())
+
+    def compactable(self, min_dead_ratio: float = 0.5) -> List[int]:
+        """Sealed segments (every one but the active one) with at least min_dead_ratio of their bytes dead"""
+        with self._lock:
+            return [segment_id for segment_id, (size, live) in sorted(self._segments.items())
+                    if segment_id != self._active_id and (size == 0 or (size - live) / size >= min_dead_ratio)]
+
+    def compact(self, min_dead_ratio: float = 0.5, include_active: bool = False) -> Dict[str, int]:
+        """
+        Move the live records of compactable() segments into the active segment and
+        delete the old files; returns {"segments", "reclaimed_bytes"}. With
+        include_active, an active segment that qualifies is sealed and compacted too.
+        Records are moved one at a time, so reads and writes go on meanwhile.
+        Blocking: call it from a worker thread.
+        """
+        if include_active:
+            with self._lock:
+                size, live = self._segments[self._active_id]
+                if size and (size - live) / size >= min_dead_ratio:
+                    self._seal()
+        compacted = reclaimed = 0
+        # Oldest first: a segment whose predecessors were all compacted can drop its tombstones
+        for segment_id in self.compactable(min_dead_ratio):
+            reclaimed += self._compact_segment(segment_id)
+            compacted += 1
+        return {"segments": compacted, "reclaimed_bytes": reclaimed}
+
+    def _compact_segment(self, segment_id: int) -> int:
+        with self._lock:
+            # Tombstones only matter while an older segment may still hold the record they delete
+            oldest = segment_id == min(self._segments)
+        path = self._segment_path(segment_id)
+        moved_bytes = 0
+        with open(path, "rb") as f:
+            for op, key, payload_offset, payload_length, crc in self._records(f, os.path.getsize(path)):
+                if op == self.OP_PUT:
+                    with self._lock:
+                        if self._index.get(key, ())[:2] != (segment_id, payload_offset):
+                            continue
+                    data = os.pread(f.fileno(), payload_length, payload_offset)
+                    with self._lock:
+                        # Replaced or deleted while it was being read: nothing to move
+                        if self._index.get(key, ())[:2] != (segment_id, payload_offset):
+                            continue
+                        # The stored checksum moves with the payload, so a damaged payload stays detectable
+                        moved = self._append(self.OP_PUT, key, data, crc)
+                        self._index_put(key, moved[0], moved[1], payload_length, crc)
+                        moved_bytes += self._record_size(key, payload_length)
+                elif not oldest:
+                    with self._lock:
+                        if key not in self._index:
+                            self._append(self.OP_DELETE, key, b"")
+                            moved_bytes += self._record_size(key, 0)
+
+        with self._lock:
+            # The moved records must be durable before the only other copy is deleted
+            if self._writer is not None:
+                os.fsync(self._writer.fileno())
+            mapped = self._maps.pop(segment_id, None)
+            if mapped is not None:
+                mapped.close()
+            reclaimed = self._segments.pop(segment_id)[0] - moved_bytes
+            os.unlink(path)
+            self.compactions += 1
+            self.reclaimed_bytes += reclaimed
+        return reclaimed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "fragments": len(self),
+            "stored_bytes": self.live_bytes,
+            "dead_bytes": self.dead_bytes,
+            "segments": len(self._segments),
+            "compacted_segments": self.compactions,
+            "reclaimed_bytes": self.reclaimed_bytes
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if self._dir_lock is not None:
+                self._dir_lock.close()
+                self._dir_lock = None
+
+class SQLiteDatabase:
+    """
+    Connections to one SQLite database in WAL mode: readers never wait for the
+    writer, and writers in any process take turns (waiting up to `timeout` seconds)
+    """
+
+    def __init__(self, path: str, schema: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # One connection per thread; sqlite3 connections must not be used by two threads at once
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.connection().executescript(schema)
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit; multi-statement updates use transaction()
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Committed transactions survive a process crash; only a power loss can drop the last few
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def execute(self, sql: str, parameters: Iterable[Any] = ()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, tuple(parameters))
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements atomically, holding the write lock from the start"""
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+class SQLiteFragmentStore(FragmentStore):
+    """
+    Fragment payloads in an SQLite database that several processes can share
+
+    Rows also carry the reference count and codec SharedRefCountedStore keeps
+    (unused when the store is used on its own), and triggers keep a one-row
+    table of totals so stats never count rows.
+    """
+
+    name = "sqlite"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS payloads (
+            key TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            refs INTEGER NOT NULL DEFAULT 0,
+            codec TEXT
+        );
+        CREATE TABLE IF NOT EXISTS payload_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            fragments INTEGER NOT NULL,
+            stored_bytes INTEGER NOT NULL,
+            refs INTEGER NOT NULL,
+            compressed INTEGER NOT NULL,
+            dedup_hits INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO payload_totals VALUES (0, 0, 0, 0, 0, 0);
+        CREATE TRIGGER IF NOT EXISTS payloads_inserted AFTER INSERT ON payloads BEGIN
+            UPDATE payload_totals SET fragments = fragments + 1, stored_bytes = stored_bytes + length(NEW.data),
+                refs = refs + NEW.refs, compressed = compressed + (NEW.codec IS NOT NULL);
+        END;
+        CREATE TRIGGER IF NOT EXISTS payloads_deleted AFTER DELETE ON payloads BEGIN
+            UPDATE payload_totals SET fragments = fragments - 1, stored_bytes = stored_bytes - length(OLD.data),
+                refs = refs - OLD.refs, compressed = compressed - (OLD.codec IS NOT NULL);
+        END;
+        CREATE TRIGGER IF NOT EXISTS payloads_updated AFTER UPDATE ON payloads BEGIN
+            UPDATE payload_totals SET stored_bytes = stored_bytes + length(NEW.data) - length(OLD.data),
+                refs = refs + NEW.refs - OLD.refs,
+                compressed = compressed + (NEW.codec IS NOT NULL) - (OLD.codec IS NOT NULL),
+                dedup_hits = dedup_hits + max(NEW.refs - OLD.refs, 0);
+        END;
+    """
+
+    def __init__(self, path: str):
+        self.db = SQLiteDatabase(path, self.SCHEMA)
+
+    def put(self, key: str, data: bytes) -> None:
+        self.db.execute("INSERT INTO payloads (key, data) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET data = excluded.data",
+                        (key, bytes(data)))
+
+    def get(self, key: str) -> bytes:
+        row = self.db.execute("SELECT data FROM payloads WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise StorageError(f"Fragment {key} not found")
+        return row[0]
+
+    def delete(self, key: str) -> None:
+        self.db.execute("DELETE FROM payloads WHERE key = ?", (key,))
+
+    def __contains__(self, key: str) -> bool:
+        return self.db.execute("SELECT 1 FROM payloads WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.totals()["fragments"]
+
+    def keys(self) -> List[str]:
+        return [key for key, in self.db.execute("SELECT key FROM payloads")]
+
+    def totals(self) -> Dict[str, int]:
+        row = self.db.execute("SELECT fragments, stored_bytes, refs, compressed, dedup_hits FROM payload_totals").fetchone()
+        return dict(zip(("fragments", "stored_bytes", "refs", "compressed", "dedup_hits"), row))
+
+    def stats(self) -> Dict[str, Any]:
+        totals = self.totals()
+        return {"backend": self.name, "fragments": totals["fragments"], "stored_bytes": totals["stored_bytes"]}
+
+    def close(self) -> None:
+        self.db.close()
+
+class RefCountedStore:
+    """
+    Content-addressed fragment store with reference counts
+
+    Payloads are keyed by the hash of their plaintext, so a fragment shared by
+    several files (or versions of one file) is stored once. Every file that uses
+    a key holds one reference; the payload is deleted with the last reference.
+    Counts are not persisted: load_refs() rebuilds them from the catalog.
+    The store also remembers which payloads are compressed (and with which
+    codec), so a file that reuses a payload records how to read it.
+    """
+
+    def __init__(self, store: FragmentStore):
+        self.store = store
+        self.name = store.name
+        self._refs: Dict[str, int] = {}
+        self._references = 0
+        # key => compression codec, for compressed payloads only
+        self._codecs: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.dedup_hits = 0
+
+    def load_refs(self, payload_lists: Iterable[Iterable[Tuple[str, Optional[str]]]]) -> int:
+        """
+        Count references from the (storage key, codec) payloads of every catalog
+        file and delete unreferenced payloads
+        """
+        with self._lock:
+            self._refs.clear()
+            self._codecs.clear()
+            for payloads in payload_lists:
+                for key, codec in payloads:
+                    self._refs[key] = self._refs.get(key, 0) + 1
+                    if codec is not None:
+                        self._codecs[key] = codec
+            self._references = sum(self._refs.values())
+            # Payloads written by uploads that never reached the catalog (e.g. a crash)
+            orphans = [key for key in self.store.keys() if key not in self._refs]
+            for key in orphans:
+                self.store.delete(key)
+            return len(orphans)
+
+    def acquire(self, key: str) -> bool:
+        """Take a reference to an already stored payload; False if it is not stored"""
+        with self._lock:
+            if key not in self._refs:
+                return False
+            self._refs[key] += 1
+            self._references += 1
+            self.dedup_hits += 1
+            return True
+
+    def add(self, key: str, data: bytes, codec: Optional[str] = None) -> None:
+        """
+        Store a payload (compressed with codec, if any) with one reference, or
+        just take a reference if it is already stored
+        """
+        with self._lock:
+            if key in self._refs:
+                self._refs[key] += 1
+                self._references += 1
+                self.dedup_hits += 1
+                return
+            self.store.put(key, data)
+            self._refs[key] = 1
+            self._references += 1
+            if codec is not None:
+                self._codecs[key] = codec
+
+    def release(self, key: str) -> bool:
+        """Drop one reference, deleting the payload with the last one; True if it was deleted"""
+        with self._lock:
+            count = self._refs.get(key)
+            if count is None:
+                return False
+            self._references -= 1
+            if count > 1:
+                self._refs[key] = count - 1
+                return False
+            del self._refs[key]
+            self._codecs.pop(key, None)
+            self.store.delete(key)
+            return True
+
+    def get(self, key: str) -> bytes:
+        return self.store.get(key)
+
+    def repair(self, key: str, data: bytes) -> bool:
+        """Overwrite a referenced payload with a good copy; False if it is no longer referenced"""
+        with self._lock:
+            if key not in self._refs:
+                return False
+            self.store.put(key, data)
+            return True
+
+    def keys(self) -> List[str]:
+        """Keys of every referenced payload, stored or not"""
+        with self._lock:
+            return list(self._refs)
+
+    def codec(self, key: str) -> Optional[str]:
+        """Compression codec of a stored payload (None when stored uncompressed)"""
+        return self._codecs.get(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._refs
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.store.stats()
+        stats["references"] = self._references
+        stats["compressed"] = len(self._codecs)
+        stats["dedup_hits"] = self.dedup_hits
+        return stats
+
+    def close(self) -> None:
+        self.store.close()
+
+class SharedRefCountedStore:
+    """
+    RefCountedStore over an SQLiteFragmentStore, with the reference counts and
+    codecs kept in the payload rows
+
+    Every process sharing the database sees the same counts, so an upload through
+    one worker deduplicates against payloads stored through another, and a
+    payload is deleted only when no file in any worker references it.
+    """
+
+    def __init__(self, store: SQLiteFragmentStore):
+        self.store = store
+        self.name = store.name
+        self.db = store.db
+
+    def load_refs(self, payload_lists: Iterable[Iterable[Tuple[str, Optional[str]]]]) -> int:
+        """
+        Counts are persisted with the payloads (and other workers may be using them),
+        so nothing is recounted; only payloads nothing references are deleted
+        """
+        return self.db.execute("DELETE FROM payloads WHERE refs = 0").rowcount
+
+    def acquire(self, key: str) -> bool:
+        """Take a reference to an already stored payload; False if it is not stored"""
+        return self.db.execute("UPDATE payloads SET refs = refs + 1 WHERE key = ? AND refs > 0", (key,)).rowcount == 1
+
+    def add(self, key: str, data: bytes, codec: Optional[str] = None) -> None:
+        """
+        Store a payload (compressed with codec, if any) with one reference, or
+        just take a reference if it is already stored
+        """
+        self.db.execute(
+            "INSERT INTO payloads (key, data, refs, codec) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT (key) DO UPDATE SET refs = refs + 1",
+            (key, bytes(data), codec)
+        )
+
+    def release(self, key: str) -> bool:
+        """Drop one reference, deleting the payload with the last one; True if it was deleted"""
+        with self.db.transaction() as connection:
+            rows = connection.execute("UPDATE payloads SET refs = refs - 1 WHERE key = ? AND refs > 0 RETURNING refs",
+                                      (key,)).fetchall()
+            if not rows or rows[0][0] > 0:
+                return False
+            connection.execute("DELETE FROM payloads WHERE key = ?", (key,))
+        return True
+
+    def get(self, key: str) -> bytes:
+        return self.store.get(key)
+
+    def repair(self, key: str, data: bytes) -> bool:
+        """Overwrite a referenced payload with a good copy; False if it is no longer referenced"""
+        return self.db.execute("UPDATE payloads SET data = ? WHERE key = ? AND refs > 0", (bytes(data), key)).rowcount == 1
+
+    def keys(self) -> List[str]:
+        """Keys of every referenced payload"""
+        return [key for key, in self.db.execute("SELECT key FROM payloads WHERE refs > 0")]
+
+    def codec(self, key: str) -> Optional[str]:
+        """Compression codec of a stored payload (None when stored uncompressed)"""
+        row = self.db.execute("SELECT codec FROM payloads WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def __contains__(self, key: str) -> bool:
+        return self.db.execute("SELECT 1 FROM payloads WHERE key = ? AND refs > 0", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def stats(self) -> Dict[str, Any]:
+        totals = self.store.totals()
+        return {
+            "backend": self.name,
+            "fragments": totals["fragments"],
+            "stored_bytes": totals["stored_bytes"],
+            "references": totals["refs"],
+            "compressed": totals["compressed"],
+            "dedup_hits": totals["dedup_hits"],
+            "shared": True
+        }
+
+    def close(self) -> None:
+        self.store.close()
+
+class CatalogLog:
+    """
+    Append-only JSON-lines log of catalog changes
+
+    Records are {"op": "put", "file_hash", "metadata", "fragments"} or
+    {"op": "delete", "file_hash"}. load() replays the log and rewrites it
+    without superseded records when more than half of it is dead. With sync,
+    every record is fsynced as it is written, like SegmentFragmentStore's.
+    """
+
+    # Only this process writes the log
+    shared = False
+
+    def __init__(self, path: str, sync: bool = False):
+        self.path = path
+        self.sync = sync
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self, build_fragments: Optional[Callable[[List[Dict[str, Any]]], Any]] = None) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+        """
+        Replay the log into ({file_hash: metadata}, {file_hash: fragments}); each
+        file's fragment records are passed through build_fragments if given
+        """
+        files: Dict[str, Dict[str, Any]] = {}
+        fragments: Dict[str, Any] = {}
+        record_count = 0
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from a crash is ignored
+                        continue
+                    record_count += 1
+                    file_hash = record["file_hash"]
+                    if record["op"] == "put":
+                        files[file_hash] = record["metadata"]
+                        fragments[file_hash] = record["fragments"] if build_fragments is None else build_fragments(record["fragments"])
+                    else:
+                        files.pop(file_hash, None)
+                        fragments.pop(file_hash, None)
+
+        if record_count > 2 * len(files):
+            self._rewrite(files, fragments)
+        return files, fragments
+
+    def _rewrite(self, files: Dict[str, Dict[str, Any]], fragments: Dict[str, Any]) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for file_hash, metadata in files.items():
+                f.write(self._encode("put", file_hash, metadata, fragments.get(file_hash, [])))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _encode(op: str, file_hash: str, metadata: Optional[Dict[str, Any]] = None,
+                fragments: Optional[Iterable[Dict[str, Any]]] = None) -> str:
+        record: Dict[str, Any] = {"op": op, "file_hash": file_hash}
+        if op == "put":
+            record["metadata"] = metadata
+            record["fragments"] = list(fragments)
+        return json.dumps(record, separators=(",", ":")) + "\n"
+
+    def _write(self, line: str) -> None:
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+
+    def put(self, file_hash: str, metadata: Dict[str, Any], fragments: Iterable[Dict[str, Any]]) -> None:
+        self._write(self._encode("put", file_hash, metadata, fragments))
+
+    def delete(self, file_hash: str) -> None:
+        self._write(self._encode("delete", file_hash))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class SQLiteCatalog:
+    """
+    File catalog in an SQLite database shared by worker processes
+
+    Has CatalogLog's interface, plus:
+    - put() and delete() return the fragment records of the copy they replaced or
+      removed, read in the same transaction, so exactly one worker releases them
+      even when two replace or delete the same file at once
+    - every write appends the file hash to a change feed; changes() returns the
+      current rows of files other processes changed since this one last looked,
+      which is how each worker keeps its in-memory catalog current
+    """
+
+    shared = True
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            file_hash TEXT PRIMARY KEY,
+            metadata TEXT NOT NULL,
+            fragments TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_hash TEXT NOT NULL
+        );
+    """
+    # Changes kept in the feed; a worker further behind than this reloads the whole catalog
+    CHANGE_RETENTION = 100000
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = SQLiteDatabase(path, self.SCHEMA)
+        # Last change this process has applied, and changes it wrote itself since then
+        self.seq = 0
+        self._own: set = set()
+
+    def _latest_seq(self, connection: sqlite3.Connection) -> int:
+        return connection.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def load(self, build_fragments: Optional[Callable[[List[Dict[str, Any]]], Any]] = None) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+        """Read the whole catalog into ({file_hash: metadata}, {file_hash: fragments}), as CatalogLog.load"""
+        files: Dict[str, Dict[str, Any]] = {}
+        fragments: Dict[str, Any] = {}
+        connection = self.db.connection()
+        # One read transaction, so the rows and the change position match
+        connection.execute("BEGIN")
+        try:
+            self.seq = self._latest_seq(connection)
+            for file_hash, metadata, records in connection.execute("SELECT file_hash, metadata, fragments FROM files"):
+                records = json.loads(records)
+                files[file_hash] = json.loads(metadata)
+                fragments[file_hash] = records if build_fragments is None else build_fragments(records)
+        finally:
+            connection.execute("COMMIT")
+        self._own.clear()
+        return files, fragments
+
+    def _record_change(self, connection: sqlite3.Connection, file_hash: str) -> None:
+        seq = connection.execute("INSERT INTO changes (file_hash) VALUES (?) RETURNING seq", (file_hash,)).fetchall()[0][0]
+        self._own.add(seq)
+        if seq % 1000 == 0:
+            connection.execute("DELETE FROM changes WHERE seq <= ?", (seq - self.CHANGE_RETENTION,))
+
+    def put(self, file_hash: str, metadata: Dict[str, Any], fragments: Iterable[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """Store a file, returning the fragment records of the copy it replaced (None if there was none)"""
+        with self.db.transaction() as connection:
+            previous = connection.execute("SELECT fragments FROM files WHERE file_hash = ?", (file_hash,)).fetchone()
+            connection.execute(
+                "INSERT INTO files (file_hash, metadata, fragments) VALUES (?, ?, ?) "
+                "ON CONFLICT (file_hash) DO UPDATE SET metadata = excluded.metadata, fragments = excluded.fragments",
+                (file_hash, json.dumps(metadata, separators=(",", ":")), json.dumps(list(fragments), separators=(",", ":")))
+            )
+            self._record_change(connection, file_hash)
+        return json.loads(previous[0]) if previous is not None else None
+
+    def delete(self, file_hash: str) -> Optional[List[Dict[str, Any]]]:
+        """Remove a file, returning its fragment records (None if another process removed it first)"""
+        with self.db.transaction() as connection:
+            previous = connection.execute("DELETE FROM files WHERE file_hash = ? RETURNING fragments", (file_hash,)).fetchall()
+            if previous:
+                self._record_change(connection, file_hash)
+        return json.loads(previous[0][0]) if previous else None
+
+    def changes(self, build_fragments: Optional[Callable[[List[Dict[str, Any]]], Any]] = None) -> Optional[List[Tuple[str, Optional[Dict[str, Any]], Any]]]:
+        """
+        (file_hash, metadata, fragments) of each file other processes changed since
+        the last call (metadata and fragments are None for a deleted file), or None
+        if the feed no longer reaches back that far and the catalog must be reloaded
+        """
+        connection = self.db.connection()
+        connection.execute("BEGIN")
+        try:
+            latest = self._latest_seq(connection)
+            if latest == self.seq:
+                return []
+            oldest = connection.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+            if oldest is None or oldest > self.seq + 1:
+                return None
+            changed = []
+            for seq, file_hash in connection.execute("SELECT seq, file_hash FROM changes WHERE seq > ? ORDER BY seq", (self.seq,)):
+                if seq in self._own:
+                    self._own.discard(seq)
+                elif file_hash not in changed:
+                    changed.append(file_hash)
+            self.seq = latest
+            result = []
+            for file_hash in changed:
+                row = connection.execute("SELECT metadata, fragments FROM files WHERE file_hash = ?", (file_hash,)).fetchone()
+                if row is None:
+                    result.append((file_hash, None, None))
+                    continue
+                records = json.loads(row[1])
+                result.append((file_hash, json.loads(row[0]), records if build_fragments is None else build_fragments(records)))
+            return result
+        finally:
+            connection.execute("COMMIT")
+
+    def close(self) -> None:
+        self.db.close()
+
+def create_fragment_store(backend: str, data_dir: str, sync: bool = False) -> FragmentStore:
+    """Build the configured fragment store ("memory", "segment" or "sqlite"); sync fsyncs segment records"""
+    if backend == "memory":
+        return MemoryFragmentStore()
+    if backend == "segment":
+        return SegmentFragmentStore(os.path.join(data_dir, "fragments"), sync=sync)
+    if backend == "sqlite":
+        return SQLiteFragmentStore(os.path.join(data_dir, "fragments.db"))
+    raise ValueError(f"Unknown storage backend: {backend}")
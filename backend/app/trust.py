@@ -0,0 +1,215 @@
+"""
+Cached storage-node trust scores
+
+TrustCache keeps a snapshot of every storage node record so placement and
+retrieval decisions never wait on the chain:
+- a fresh snapshot (younger than `ttl`) is served directly
+- a stale one (up to `ttl + stale_ttl`) is served while a single background
+  refresh runs (stale-while-revalidate)
+- only a missing or expired snapshot makes the caller wait for a refresh
+
+A refresh reads the local chain index when it is synced. Otherwise it fetches
+the node list and every known node record in one JSON-RPC batch; only nodes
+registered since the previous refresh need a second batch.
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from web3 import Web3
+
+from .indexer import ChainIndex, TRUSTED_NODE_THRESHOLD
+
+def node_record(address: str, info: Any, order: int) -> Dict[str, Any]:
+    """Build a node record from a storageNodes() result"""
+    return {
+        "address": address,
+        "trust_score": int(info[1]),
+        "total_stored": int(info[2]),
+        "successful_retrievals": int(info[3]),
+        "failed_retrievals": int(info[4]),
+        "active": bool(info[5]),
+        "last_activity": int(info[6]),
+        "order": order
+    }
+
+class TrustCache:
+    """TTL + stale-while-revalidate cache of storage node records"""
+
+    def __init__(self, chain: Any, index: Optional[ChainIndex] = None, ttl: float = 30.0, stale_ttl: float = 300.0,
+                 threshold: int = TRUSTED_NODE_THRESHOLD):
+        self.chain = chain
+        self.index = index
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.threshold = threshold
+        # address => record, in registration order
+        self._records: Optional[Dict[str, Dict[str, Any]]] = None
+        self._fetched_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        # address => (local score, chain score it was derived from); see set_local_score
+        self._local_scores: Dict[str, Tuple[int, int]] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.last_refresh_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    # ---- loading ----
+
+    async def _fetch(self) -> Dict[str, Dict[str, Any]]:
+        if self.index is not None and self.index.synced:
+            nodes = self.index.tables["nodes"]
+            addresses = self.index.all_nodes()
+            active = {address: self.index.node_active(address) for address in addresses}
+            # Rows from a checkpoint that predates the isActive column: ask the contract, in one batch
+            unknown = [address for address, flag in active.items() if flag is None]
+            if unknown and self.chain.available:
+                infos = await self.chain.batch_call([("storageNodes", (address,)) for address in unknown])
+                for address, info in zip(unknown, infos):
+                    if isinstance(info, Exception):
+                        print(f"Error fetching node {address}: {info}")
+                    else:
+                        active[address] = bool(info[5])
+            return {
+                address: {
+                    "address": address,
+                    "trust_score": int(nodes[address]["trust_score"]),
+                    # Registered nodes are active unless the chain says otherwise
+                    "active": active[address] is not False,
+                    "order": order
+                }
+                for order, address in enumerate(addresses)
+            }
+
+        if not self.chain.available:
+            raise RuntimeError("Blockchain not available")
+
+        # Node list plus every node we already know about in one round trip
+        known = list(self._records or {})
+        results = await self.chain.batch_call(
+            [("getAllStorageNodes", ())] + [("storageNodes", (address,)) for address in known]
+        )
+        if isinstance(results[0], Exception):
+            raise results[0]
+        addresses = [Web3.to_checksum_address(address) for address in results[0]]
+        infos = dict(zip(known, results[1:]))
+
+        new = [address for address in addresses if address not in infos]
+        if new:
+            infos.update(zip(new, await self.chain.batch_call([("storageNodes", (address,)) for address in new])))
+
+        records = {}
+        for order, address in enumerate(addresses):
+            info = infos[address]
+            if isinstance(info, Exception):
+                print(f"Error fetching node {address}: {info}")
+                continue
+            records[address] = node_record(address, info, order)
+        return records
+
+    async def _refresh(self) -> None:
+        started = time.perf_counter()
+        try:
+            records = await self._fetch()
+        except Exception as e:
+            self.refresh_errors += 1
+            self.last_error = str(e)
+            print(f"⚠️ Trust score refresh failed: {e}")
+            return
+        finally:
+            self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        # A local score is dropped once the chain reports a different score for that node
+        for address, (_, chain_score) in list(self._local_scores.items()):
+            record = records.get(address)
+            if record is None or record["trust_score"] != chain_score:
+                del self._local_scores[address]
+
+        self._records = records
+        self._fetched_at = time.monotonic()
+        self.refreshes += 1
+        self.last_error = None
+
+    def _start_refresh(self) -> asyncio.Task:
+        # Single flight: concurrent callers share one refresh
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+        return self._refresh_task
+
+    async def refresh(self) -> None:
+        """Refresh now, waiting for the result"""
+        await asyncio.shield(self._start_refresh())
+
+    def invalidate(self) -> None:
+        """Force the next lookup to wait for fresh data"""
+        self._fetched_at = 0.0
+        self._records = None
+
+    async def _snapshot(self) -> Dict[str, Dict[str, Any]]:
+        age = time.monotonic() - self._fetched_at
+        if self._records is not None and age < self.ttl:
+            self.hits += 1
+        elif self._records is not None and age < self.ttl + self.stale_ttl:
+            self.stale_hits += 1
+            self._start_refresh()
+        else:
+            self.misses += 1
+            await self.refresh()
+        return self._records or {}
+
+    # ---- queries ----
+
+    def _score(self, record: Dict[str, Any]) -> int:
+        local = self._local_scores.get(record["address"])
+        return local[0] if local is not None else record["trust_score"]
+
+    async def nodes(self, local_scores: bool = True) -> List[Dict[str, Any]]:
+        """All node records in registration order, with local scores applied unless disabled"""
+        records = (await self._snapshot()).values()
+        if not local_scores:
+            return [dict(record) for record in records]
+        return [dict(record, trust_score=self._score(record)) for record in records]
+
+    async def trusted_nodes(self, local_scores: bool = True) -> Dict[str, int]:
+        """{address: trust_score} of active nodes at or above the threshold, in registration order (as getTrustedNodes)"""
+        return {
+            record["address"]: record["trust_score"]
+            for record in await self.nodes(local_scores)
+            if record["active"] and record["trust_score"] >= self.threshold
+        }
+
+    async def ranked(self, min_trust: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Active nodes by descending trust score (ties keep registration order)"""
+        ranked = sorted(
+            (record for record in await self.nodes() if record["active"] and record["trust_score"] >= min_trust),
+            key=lambda record: (-record["trust_score"], record["order"])
+        )
+        return ranked[:limit] if limit is not None else ranked
+
+    def set_local_score(self, address: str, score: int) -> None:
+        """
+        Record a score computed off chain (e.g. a retrieval penalty) until the
+        chain reports a new score for the node
+        """
+        record = (self._records or {}).get(address)
+        if record is not None:
+            self._local_scores[address] = (score, record["trust_score"])
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "nodes": len(self._records or {}),
+            "age_seconds": round(time.monotonic() - self._fetched_at, 2) if self._records is not None else None,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "last_refresh_ms": self.last_refresh_ms,
+            "local_scores": len(self._local_scores),
+            "last_error": self.last_error
+        }
@@ -0,0 +1,439 @@
+"""
+Benchmarks for the upload, retrieve and listing hot paths
+
+Run from backend/:
+
+    python -m benchmarks.bench                          # every benchmark with the defaults
+    python -m benchmarks.bench --only pipeline --sizes 1K,1M,1G
+    python -m benchmarks.bench --only endpoints --concurrency 32 --requests 400
+    python -m benchmarks.bench --only listing --catalog 1000,100000 --rpc-latency-ms 50
+    python -m benchmarks.bench --compare base.json new.json   # exit 1 on regressions
+
+Benchmarks:
+- pipeline: MB/s of FileProcessor.fragment_file (hash, compress, encrypt and
+  erasure-code in this process) and FileProcessor.reassemble_file (decrypt,
+  verify and place) per file size
+- endpoints: p50/p99 latency and throughput of POST /upload and POST
+  /retrieve (JSON and streamed) under concurrent load, through an in-process
+  ASGI client
+- listing: GET /files?account= latency per catalog size, against a stub
+  contract (stub_rpc.py) that adds --rpc-latency-ms to every RPC round trip;
+  "cold" runs start with empty access caches
+
+Peak RSS (this process and its crypto pool workers) is recorded after each
+result. Results are written as JSON to --output (default
+benchmarks/results/<commit>-<time>.json) with the commit and configuration,
+so two runs can be compared with --compare. The backend is configured through
+the usual CHAINVAULT_* variables; data goes to a temporary directory unless
+CHAINVAULT_DATA_DIR is set, and the chain indexer is off so listings exercise
+the RPC path.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from .stub_rpc import StubRPC, accounts
+
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def parse_size(text: str) -> int:
+    """Byte count from "512", "64K", "16M" or "1G" """
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def format_size(size: int) -> str:
+    for unit in ("G", "M", "K"):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]}{unit}"
+    return str(size)
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile of samples (q in 0..100)"""
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+def latency_metrics(latencies: List[float], elapsed: float, total_bytes: int = 0) -> Dict[str, float]:
+    metrics = {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 2)
+    }
+    if total_bytes:
+        metrics["mb_s"] = round(total_bytes / elapsed / 1024 ** 2, 2)
+    return metrics
+
+def peak_rss_mb() -> Dict[str, float]:
+    """Peak resident set size of this process and of its (finished or running) children, in MiB"""
+    scale = 1024 if sys.platform != "darwin" else 1024 * 1024  # ru_maxrss is KiB on Linux, bytes on macOS
+    return {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1024 ** 2, 1),
+        "peak_rss_children_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 1024 ** 2, 1)
+    }
+
+def sample_data(size: int, kind: str) -> bytes:
+    if kind == "random":
+        return os.urandom(size)
+    # Repetitive text with some variation, so compression has something to do
+    line = b"".join(b"%08d chainvault benchmark line with some repeated words\n" % i for i in range(64))
+    return (line * (size // len(line) + 1))[:size]
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+class Bench:
+    """Runs the benchmarks against the backend app and collects results"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.results: List[Dict[str, Any]] = []
+        self.app_main: Any = None
+        self.stub: Optional[StubRPC] = None
+
+    def record(self, benchmark: str, params: Dict[str, Any], metrics: Dict[str, Any]) -> None:
+        metrics.update(peak_rss_mb())
+        self.results.append({"benchmark": benchmark, "params": params, "metrics": metrics})
+        shown = ", ".join(f"{key}={value}" for key, value in metrics.items() if not isinstance(value, dict))
+        print(f"{benchmark:<10} {json.dumps(params, sort_keys=True):<50} {shown}", file=sys.stderr)
+
+    @contextlib.contextmanager
+    def quiet(self):
+        """Hide the backend's per-request logging unless --verbose"""
+        if self.args.verbose:
+            yield
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield
+
+    # ---- pipeline ----
+
+    def bench_pipeline(self) -> None:
+        FileProcessor = self.app_main.FileProcessor
+        for size in self.args.sizes:
+            data = sample_data(size, self.args.data)
+            fragment_times, reassemble_times = [], []
+            fragment_count = 0
+            for _ in range(self.args.repeat):
+                with self.quiet():
+                    started = time.perf_counter()
+                    fragments = FileProcessor.fragment_file(data)
+                    fragment_times.append(time.perf_counter() - started)
+                    data_fragments = [fragment for fragment in fragments if not fragment.get("parity")]
+                    started = time.perf_counter()
+                    rebuilt = FileProcessor.reassemble_file(data_fragments)
+                    reassemble_times.append(time.perf_counter() - started)
+                if rebuilt != data:
+                    raise RuntimeError(f"Reassembled {format_size(size)} file does not match the input")
+                fragment_count = len(fragments)
+                del fragments, data_fragments, rebuilt
+            fragment_time = statistics.median(fragment_times)
+            reassemble_time = statistics.median(reassemble_times)
+            self.record("pipeline", {"size": format_size(size), "data": self.args.data}, {
+                "size_bytes": size,
+                "fragments": fragment_count,
+                "fragment_mb_s": round(size / fragment_time / 1024 ** 2, 2),
+                "reassemble_mb_s": round(size / reassemble_time / 1024 ** 2, 2),
+                "fragment_ms": round(fragment_time * 1000, 3),
+                "reassemble_ms": round(reassemble_time * 1000, 3)
+            })
+
+    # ---- endpoints ----
+
+    async def run_load(self, client: httpx.AsyncClient, count: int,
+                       request: Callable[[httpx.AsyncClient, int], Awaitable[int]]) -> Tuple[List[float], float, int]:
+        """Issue count requests with --concurrency in flight; returns (latencies, elapsed, response bytes)"""
+        slots = asyncio.Semaphore(self.args.concurrency)
+        latencies: List[float] = []
+        received = [0]
+
+        async def one(index: int) -> None:
+            async with slots:
+                started = time.perf_counter()
+                received[0] += await request(client, index)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(count)))
+        return latencies, time.perf_counter() - started, received[0]
+
+    async def bench_endpoints(self, client: httpx.AsyncClient) -> None:
+        size, count = self.args.upload_size, self.args.requests
+        params = {"size": format_size(size), "concurrency": self.args.concurrency, "data": self.args.data}
+        payloads = [sample_data(size, "random") if self.args.data == "random"
+                    else sample_data(size, "text")[:-8] + b"%08d" % index for index in range(count)]
+        hashes: List[str] = [""] * count
+
+        async def upload(client: httpx.AsyncClient, index: int) -> int:
+            response = await client.post("/upload", files={"file": (f"bench-{index}.bin", payloads[index])})
+            response.raise_for_status()
+            hashes[index] = response.json()["file_hash"]
+            return len(payloads[index])
+
+        async def retrieve(client: httpx.AsyncClient, index: int) -> int:
+            response = await client.post(f"/retrieve/{hashes[index]}")
+            response.raise_for_status()
+            return size
+
+        async def retrieve_stream(client: httpx.AsyncClient, index: int) -> int:
+            response = await client.post(f"/retrieve/{hashes[index]}", params={"stream": "true"})
+            response.raise_for_status()
+            return len(response.content)
+
+        for name, request in (("upload", upload), ("retrieve", retrieve), ("retrieve_stream", retrieve_stream)):
+            with self.quiet():
+                latencies, elapsed, moved = await self.run_load(client, count, request)
+            self.record(name, params, latency_metrics(latencies, elapsed, moved))
+
+        with self.quiet():
+            for file_hash in hashes:
+                await client.delete(f"/file/{file_hash}")
+
+    # ---- listing ----
+
+    def fill_catalog(self, count: int, owners: List[str]) -> List[str]:
+        """Add count synthetic files (metadata only) owned round-robin by owners, on chain and in the catalog"""
+        main = self.app_main
+        hashes = []
+        for index in range(count):
+            file_hash = f"{index:064x}"
+            owner = owners[index % len(owners)]
+            main.record_file(file_hash, {
+                "original_filename": f"bench-{index}.bin",
+                "original_size": 0,
+                "file_hash": file_hash,
+                "fragment_count": 0,
+                "upload_timestamp": datetime.now().isoformat(),
+                "content_type": "application/octet-stream",
+                "owner": owner
+            }, main.FragmentTable())
+            self.stub.owners[file_hash] = owner
+            hashes.append(file_hash)
+        return hashes
+
+    def clear_catalog(self, hashes: List[str]) -> None:
+        for file_hash in hashes:
+            self.app_main.forget_file(file_hash)
+            self.stub.owners.pop(file_hash, None)
+
+    async def bench_listing(self, client: httpx.AsyncClient) -> None:
+        main = self.app_main
+        owners = accounts(self.args.owners)
+        for count in self.args.catalog:
+            hashes = self.fill_catalog(count, owners)
+            params = {"files": count, "owners": self.args.owners, "rpc_latency_ms": self.args.rpc_latency_ms}
+            try:
+                # Cold: empty access caches, so every listing resolves owners and grants over RPC
+                cold, rpc_requests = [], []
+                with self.quiet():
+                    for run in range(self.args.cold_runs):
+                        main.access_resolver.owner_cache.clear()
+                        main.access_resolver.access_cache.clear()
+                        self.stub.reset_stats()
+                        started = time.perf_counter()
+                        response = await client.get("/files", params={"account": owners[run % len(owners)]})
+                        response.raise_for_status()
+                        cold.append(time.perf_counter() - started)
+                        rpc_requests.append(self.stub.requests)
+                metrics = latency_metrics(cold, sum(cold))
+                metrics["rpc_requests"] = max(rpc_requests)
+                metrics["files_returned"] = response.json()["total_files"]
+                self.record("list_cold", params, metrics)
+
+                async def listing(client: httpx.AsyncClient, index: int) -> int:
+                    response = await client.get("/files", params={"account": owners[index % len(owners)]})
+                    response.raise_for_status()
+                    return len(response.content)
+
+                with self.quiet():
+                    latencies, elapsed, _ = await self.run_load(client, self.args.requests, listing)
+                self.record("list_warm", dict(params, concurrency=self.args.concurrency),
+                            latency_metrics(latencies, elapsed))
+
+                async def listing_all(client: httpx.AsyncClient, index: int) -> int:
+                    response = await client.get("/files")
+                    response.raise_for_status()
+                    return len(response.content)
+
+                with self.quiet():
+                    latencies, elapsed, _ = await self.run_load(client, max(1, self.args.requests // 10), listing_all)
+                self.record("list_all", dict(params, concurrency=self.args.concurrency),
+                            latency_metrics(latencies, elapsed))
+            finally:
+                self.clear_catalog(hashes)
+
+    # ---- driver ----
+
+    async def run(self) -> Dict[str, Any]:
+        only = set(self.args.only)
+        self.stub = StubRPC(latency=self.args.rpc_latency_ms / 1000)
+        await self.stub.start()
+        os.environ["CHAINVAULT_RPC_URL"] = self.stub.url
+        os.environ.setdefault("CHAINVAULT_INDEXER", "0")
+        os.environ.setdefault("CHAINVAULT_RPC_HEALTH_INTERVAL", "1")
+        data_dir = None
+        if "CHAINVAULT_DATA_DIR" not in os.environ:
+            data_dir = tempfile.TemporaryDirectory(prefix="chainvault-bench-")
+            os.environ["CHAINVAULT_DATA_DIR"] = data_dir.name
+
+        try:
+            # Imported only now: the app reads its configuration at import time
+            with self.quiet():
+                from app import main as app_main
+            self.app_main = app_main
+
+            if "pipeline" in only:
+                self.bench_pipeline()
+
+            if only & {"endpoints", "listing"}:
+                app = app_main.app
+                async with app.router.lifespan_context(app):
+                    # Wait for the first RPC health check so listings go to the stub chain
+                    for _ in range(100):
+                        if app_main.chain.available:
+                            break
+                        await asyncio.sleep(0.05)
+                    transport = httpx.ASGITransport(app=app)
+                    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                        if "endpoints" in only:
+                            await self.bench_endpoints(client)
+                        if "listing" in only:
+                            await self.bench_listing(client)
+        finally:
+            await self.stub.stop()
+            if data_dir is not None:
+                data_dir.cleanup()
+
+        return {
+            "meta": self.meta(),
+            "results": self.results
+        }
+
+    def meta(self) -> Dict[str, Any]:
+        main = self.app_main
+        return {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(self.args).items() if key not in ("compare", "output")},
+            "config": {
+                "fragment_size": main.FRAGMENT_SIZE,
+                "chunking": main.CHUNKING,
+                "cipher": main.CIPHER_ENGINE,
+                "compression": main.crypto_pool.compression or "none",
+                "erasure": [main.ERASURE_DATA_SHARDS, main.ERASURE_PARITY_SHARDS],
+                "crypto_executor": main.CRYPTO_EXECUTOR_MODE,
+                "crypto_workers": main.crypto_pool.workers,
+                "storage_backend": main.STORAGE_BACKEND,
+                "replication": main.REPLICATION
+            }
+        }
+
+# ---- comparison ----
+
+HIGHER_IS_BETTER = ("_mb_s", "requests_per_s")
+LOWER_IS_BETTER = ("_ms", "rpc_requests", "peak_rss_mb")
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    """Print metric changes between two result files; returns the number of regressions beyond threshold"""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def keyed(run: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        return {f"{result['benchmark']} {json.dumps(result['params'], sort_keys=True)}": result["metrics"]
+                for result in run["results"]}
+
+    base_results, regressions = keyed(base), 0
+    print(f"base {base['meta'].get('commit')}  new {new['meta'].get('commit')}")
+    for key, metrics in keyed(new).items():
+        previous = base_results.get(key)
+        if previous is None:
+            continue
+        for metric, value in metrics.items():
+            old = previous.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            if metric.endswith(HIGHER_IS_BETTER):
+                change = (value - old) / old
+            elif metric.endswith(LOWER_IS_BETTER):
+                change = (old - value) / old
+            else:
+                continue
+            marker = ""
+            if change < -threshold:
+                marker = "  REGRESSION"
+                regressions += 1
+            elif change > threshold:
+                marker = "  improved"
+            print(f"{key:<70} {metric:<22} {old:>12} -> {value:<12} {change:+.1%}{marker}")
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ChainVault backend benchmarks")
+    parser.add_argument("--only", default="pipeline,endpoints,listing",
+                        help="Comma-separated benchmarks to run (pipeline, endpoints, listing)")
+    parser.add_argument("--sizes", default="1K,64K,1M,16M,128M", help="File sizes for the pipeline benchmark (up to 1G)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per pipeline size (the median is reported)")
+    parser.add_argument("--data", choices=("random", "text"), default="random",
+                        help="random (incompressible) or repetitive text content")
+    parser.add_argument("--upload-size", default="256K", help="File size for the endpoint benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint benchmark")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight")
+    parser.add_argument("--catalog", default="100,1000", help="Catalog sizes for the listing benchmark")
+    parser.add_argument("--owners", type=int, default=10, help="Accounts the listing catalog is spread across")
+    parser.add_argument("--cold-runs", type=int, default=3, help="Listings with empty access caches per catalog size")
+    parser.add_argument("--rpc-latency-ms", type=float, default=20.0, help="Latency the stub chain adds per RPC round trip")
+    parser.add_argument("--output", help="Result file (default benchmarks/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression by --compare")
+    parser.add_argument("--verbose", action="store_true", help="Show the backend's own logging")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    args.only = [name.strip() for name in args.only.split(",") if name.strip()]
+    args.sizes = [parse_size(size) for size in args.sizes.split(",")]
+    args.upload_size = parse_size(args.upload_size)
+    args.catalog = [int(count) for count in args.catalog.split(",")]
+
+    report = asyncio.run(Bench(args).run())
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = (report["meta"]["commit"] or "nogit")[:10]
+        output = os.path.join(RESULTS_DIR, f"{commit}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📊 Results written to {output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Stub JSON-RPC node for benchmarks
+
+Answers the handful of calls the backend makes to TrustAwareStorage
+(files, hasFileAccess, getAllStorageNodes, storageNodes) from in-memory
+tables, after sleeping `latency` seconds per HTTP request, so access checks can
+be measured against a chain of known speed without running Hardhat. A batch
+request pays the latency once, like one round trip to a real node.
+"""
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+from eth_abi import decode, encode
+from web3 import Web3
+
+def _selector(signature: str) -> str:
+    return Web3.keccak(text=signature)[:4].hex().replace("0x", "")
+
+FILES = _selector("files(string)")
+HAS_FILE_ACCESS = _selector("hasFileAccess(string,address)")
+ALL_NODES = _selector("getAllStorageNodes()")
+STORAGE_NODES = _selector("storageNodes(address)")
+
+ZERO_ADDRESS = "0x" + "00" * 20
+
+class StubRPC:
+    """In-process JSON-RPC server with configurable per-request latency"""
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        # file hash => owner address
+        self.owners: Dict[str, str] = {}
+        # (file hash, account) pairs granted access
+        self.grants: Set[Tuple[str, str]] = set()
+        # node address => trust score
+        self.nodes: Dict[str, int] = {}
+        self.requests = 0
+        self.calls: Dict[str, int] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        # Port 0 picks a free port
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _eth_call(self, data: str) -> str:
+        selector, args = data[:8], bytes.fromhex(data[8:])
+        if selector == FILES:
+            self._count("files")
+            (file_hash,) = decode(["string"], args)
+            owner = self.owners.get(file_hash)
+            result = encode(["string", "address", "uint256", "uint256", "string", "bool"],
+                            [file_hash, owner or ZERO_ADDRESS, 0, 0, "", owner is not None])
+        elif selector == HAS_FILE_ACCESS:
+            self._count("hasFileAccess")
+            file_hash, account = decode(["string", "address"], args)
+            account = Web3.to_checksum_address(account)
+            result = encode(["bool"], [self.owners.get(file_hash) == account or (file_hash, account) in self.grants])
+        elif selector == ALL_NODES:
+            self._count("getAllStorageNodes")
+            result = encode(["address[]"], [list(self.nodes)])
+        elif selector == STORAGE_NODES:
+            self._count("storageNodes")
+            (address,) = decode(["address"], args)
+            address = Web3.to_checksum_address(address)
+            result = encode(["address", "uint256", "uint256", "uint256", "uint256", "bool", "uint256"],
+                            [address, self.nodes.get(address, 0), 0, 0, 0, address in self.nodes, 0])
+        else:
+            raise ValueError(f"Unsupported call {selector}")
+        return "0x" + result.hex()
+
+    def _answer(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        method = request["method"]
+        response: Dict[str, Any] = {"jsonrpc": "2.0", "id": request["id"]}
+        try:
+            if method == "web3_clientVersion":
+                response["result"] = "chainvault-stub/1"
+            elif method == "eth_chainId":
+                response["result"] = hex(31337)
+            elif method == "eth_blockNumber":
+                response["result"] = "0x1"
+            elif method == "eth_getLogs":
+                response["result"] = []
+            elif method == "eth_call":
+                response["result"] = self._eth_call(request["params"][0]["data"][2:])
+            else:
+                raise ValueError(f"Unsupported method {method}")
+        except Exception as e:
+            response["error"] = {"code": -32000, "message": str(e)}
+        return response
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(body, list):
+            return web.json_response([self._answer(item) for item in body])
+        return web.json_response(self._answer(body))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "calls": dict(self.calls)}
+
+    def reset_stats(self) -> None:
+        self.requests = 0
+        self.calls = {}
+
+def accounts(count: int) -> List[str]:
+    """Deterministic checksum addresses for benchmark owners"""
+    return [Web3.to_checksum_address(f"0x{index + 1:040x}") for index in range(count)]
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the backend package as `app`, the way uvicorn loads it from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """The FastAPI app module, configured on first import to keep its state in a temporary directory"""
+    os.environ["CHAINVAULT_DATA_DIR"] = str(tmp_path_factory.mktemp("data"))
+    os.environ.setdefault("CHAINVAULT_STORAGE_BACKEND", "segment")
+    import app.main as main
+    return main
+
+@pytest.fixture(scope="session")
+def client(api):
+    from fastapi.testclient import TestClient
+    with TestClient(api.app) as test_client:
+        yield test_client
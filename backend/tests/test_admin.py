@@ -0,0 +1,30 @@
+"""Operator endpoints: disabled without CHAINVAULT_ADMIN_TOKEN, and token-gated with it"""
+import pytest
+
+OPERATOR_ACTIONS = [
+    ("/keys/rotate", {}),
+    ("/scrub", {"run": "false"}),
+    ("/storage/compact", {"min_dead_ratio": 1}),
+]
+HEADER = "X-ChainVault-Admin-Token"
+
+@pytest.mark.parametrize("path, params", OPERATOR_ACTIONS)
+def test_disabled_without_admin_token(client, api, monkeypatch, path, params):
+    monkeypatch.setattr(api, "ADMIN_TOKEN", None)
+    assert client.post(path, params=params).status_code == 403
+    assert client.post(path, params=params, headers={HEADER: ""}).status_code == 403
+
+@pytest.mark.parametrize("path, params", OPERATOR_ACTIONS)
+def test_admin_token_required(client, api, monkeypatch, path, params):
+    monkeypatch.setattr(api, "ADMIN_TOKEN", "s3cret")
+    assert client.post(path, params=params).status_code == 401
+    assert client.post(path, params=params, headers={HEADER: "wrong"}).status_code == 401
+
+    response = client.post(path, params=params, headers={HEADER: "s3cret"})
+    assert response.status_code == 200, response.text
+    assert response.json()["success"]
+
+def test_status_endpoints_stay_open(client, api, monkeypatch):
+    monkeypatch.setattr(api, "ADMIN_TOKEN", None)
+    assert client.get("/keys").status_code == 200
+    assert client.get("/scrub").status_code == 200
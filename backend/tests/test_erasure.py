@@ -0,0 +1,99 @@
+"""Reed-Solomon coding and erasure-coded stripe decode/rebuild on the crypto batch functions"""
+import hashlib
+import itertools
+import os
+import random
+
+import pytest
+from cryptography.fernet import Fernet
+
+from app import crypto_executor as crypto
+from app.erasure import ReedSolomon
+
+K, M = 4, 2
+
+@pytest.fixture(autouse=True)
+def worker_key():
+    crypto.init_worker(Fernet.generate_key())
+    yield
+    crypto.init_worker(Fernet.generate_key())
+
+def encode_stripe(chunks, k=K, m=M, stripe=0):
+    """Fragment records of one stripe (data first, then parity) built from plaintext chunks"""
+    jobs = [(index + 1, index * 1000, chunk, False) for index, chunk in enumerate(chunks)]
+    return crypto.encode_stripe_batch([(stripe, k, m, jobs)])
+
+def decode_job(records, present, k=K, m=M):
+    """decode_stripe_batch input for a stripe of which only the `present` shards are available"""
+    data = [(record["size"], record["original_hash"]) for record in records if not record.get("parity")]
+    parity_size = next(record["size"] for record in records if record.get("parity"))
+    shards = [(record["shard"], record["fragment_id"], record["data"], record["original_hash"], record.get("codec"), None)
+              for record in records if record["shard"] in present]
+    return k, m, parity_size, data, shards
+
+@pytest.mark.parametrize("k,m", [(4, 2), (3, 3), (5, 1)])
+def test_reed_solomon_decodes_from_every_k_subset(k, m):
+    rng = random.Random(k * 10 + m)
+    data = [bytes(rng.getrandbits(8) for _ in range(257)) for _ in range(k)]
+    codec = ReedSolomon(k, m)
+    shards = dict(enumerate(data + codec.encode(data)))
+    for subset in itertools.combinations(range(k + m), k):
+        decoded = codec.decode({index: shards[index] for index in subset})
+        assert [decoded[index] for index in range(k)] == data, subset
+
+def test_reed_solomon_needs_k_shards():
+    codec = ReedSolomon(K, M)
+    data = [os.urandom(64) for _ in range(K)]
+    shards = dict(enumerate(data + codec.encode(data)))
+    with pytest.raises(ValueError):
+        codec.decode({index: shards[index] for index in range(K - 1)})
+
+@pytest.mark.parametrize("sizes", [
+    [4096, 3000, 4096, 17],  # full stripe of unequal fragments
+    [4096, 1500],            # short last stripe: two data fragments, padded with zero shards
+    [1]
+])
+def test_decode_stripe_from_every_recoverable_subset(sizes):
+    chunks = [os.urandom(size) for size in sizes]
+    records = encode_stripe(chunks)
+    real_shards = [record["shard"] for record in records]
+    assert len(real_shards) == len(chunks) + M
+    # The zero shards of a short stripe never go missing, so any len(chunks) real shards suffice
+    for count in range(len(chunks), len(real_shards) + 1):
+        for present in itertools.combinations(real_shards, count):
+            assert crypto.decode_stripe_batch([decode_job(records, set(present))]) == [chunks], present
+    for present in itertools.combinations(real_shards, len(chunks) - 1):
+        assert crypto.decode_stripe_batch([decode_job(records, set(present))]) == [None]
+
+def test_decode_stripe_treats_corrupt_shard_as_missing():
+    chunks = [os.urandom(2048) for _ in range(K)]
+    records = encode_stripe(chunks)
+    records[0]["data"] = records[0]["data"][:-1] + bytes([records[0]["data"][-1] ^ 1])
+    assert crypto.decode_stripe_batch([decode_job(records, set(range(K + M)))]) == [chunks]
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+@pytest.mark.parametrize("lost_shard", [1, K, K + M - 1])
+def test_rebuild_lost_data_or_parity_shard(compression, lost_shard):
+    crypto.init_worker(Fernet.generate_key(), compression)
+    # Compressible, so fragments carry a codec when compression is on
+    chunks = [bytes([index]) * 3000 + os.urandom(100) for index in range(K)]
+    records = encode_stripe(chunks)
+    lost = records[lost_shard]
+    assert lost["shard"] == lost_shard
+    assert (lost.get("codec") is not None) == (compression is not None)
+    present = set(range(K + M)) - {lost_shard}
+
+    job = decode_job(records, present) + ([(lost_shard, lost["original_hash"], lost.get("codec"))],)
+    rebuilt = crypto.rebuild_stripe_batch([job])[0]
+    assert set(rebuilt) == {lost_shard}
+    plain = crypto.decrypt_batch([(lost_shard, rebuilt[lost_shard], lost["original_hash"], lost.get("codec"), None)])[0]
+    assert hashlib.sha256(plain).hexdigest() == lost["original_hash"]
+    if lost_shard < K:
+        assert plain == chunks[lost_shard]
+
+def test_rebuild_fails_without_enough_shards():
+    chunks = [os.urandom(1024) for _ in range(K)]
+    records = encode_stripe(chunks)
+    present = set(range(K - 1))
+    lost = [(shard, records[shard]["original_hash"], None) for shard in range(K - 1, K + M)]
+    assert crypto.rebuild_stripe_batch([decode_job(records, present) + (lost,)]) == [None]
@@ -0,0 +1,236 @@
+"""ChainIndexer against a stub chain: event application, checkpoints, reorgs and chain restarts"""
+import asyncio
+
+from eth_abi import encode as abi_encode
+from web3 import Web3
+from web3.exceptions import BlockNotFound
+
+from app.indexer import EVENT_SIGNATURES, ChainIndex, ChainIndexer, file_topic, normalize_hex
+
+CONTRACT = "0x" + "ab" * 20
+
+def address(n):
+    return f"0x{n:040x}"
+
+def topic(n):
+    return "0x" + "00" * 12 + f"{n:040x}"
+
+def signature(event):
+    return normalize_hex(Web3.keccak(text=EVENT_SIGNATURES[event]))
+
+def uploaded(file_hash, owner, file_name="report.txt"):
+    return [signature("FileUploaded"), file_topic(file_hash), topic(owner)], abi_encode(["string", "uint256"], [file_name, 1700000000])
+
+def granted(file_hash, owner, account):
+    return [signature("AccessGranted"), file_topic(file_hash), topic(owner), topic(account)], b""
+
+def revoked(file_hash, owner, account):
+    return [signature("AccessRevoked"), file_topic(file_hash), topic(owner), topic(account)], b""
+
+def registered(node, score):
+    return [signature("NodeRegistered"), topic(node)], abi_encode(["uint256"], [score])
+
+def rescored(node, old_score, new_score):
+    return [signature("TrustScoreUpdated"), topic(node)], abi_encode(["uint256", "uint256"], [old_score, new_score])
+
+class ChainStub:
+    """A chain of `head + 1` blocks whose hashes carry a fork label, with logs by block"""
+
+    available = True
+
+    def __init__(self, head, fork="a"):
+        self.hashes = {n: self.block_hash(fork, n) for n in range(head + 1)}
+        self.logs = {}
+
+    @staticmethod
+    def block_hash(fork, n):
+        return normalize_hex(Web3.keccak(text=f"{fork}:{n}"))
+
+    def emit(self, block, event):
+        topics, data = event
+        self.logs.setdefault(block, []).append({
+            "topics": topics,
+            "data": data,
+            "blockNumber": block,
+            "logIndex": len(self.logs.get(block, [])),
+            "blockHash": self.hashes[block]
+        })
+
+    def fork(self, from_block, fork):
+        """Replace every block from from_block on, dropping their logs"""
+        for n in self.hashes:
+            if n >= from_block:
+                self.hashes[n] = self.block_hash(fork, n)
+                self.logs.pop(n, None)
+
+    async def block_number(self):
+        return max(self.hashes)
+
+    async def get_block(self, n):
+        if n not in self.hashes:
+            raise BlockNotFound(f"Block {n} not found")
+        return {"hash": self.hashes[n]}
+
+    async def get_logs(self, log_filter):
+        return [
+            log
+            for n in range(log_filter["fromBlock"], log_filter["toBlock"] + 1)
+            for log in self.logs.get(n, [])
+        ]
+
+def make_indexer(chain, path=None, **options):
+    return ChainIndexer(chain, CONTRACT, ChainIndex(), str(path) if path else None, **options)
+
+def test_events_are_applied():
+    chain = ChainStub(10)
+    chain.emit(1, registered(1, 80))
+    chain.emit(1, registered(2, 50))
+    chain.emit(2, uploaded("QmFile", 7))
+    chain.emit(3, granted("QmFile", 7, 8))
+    chain.emit(3, granted("QmFile", 7, 9))
+    chain.emit(4, revoked("QmFile", 7, 9))
+    chain.emit(5, rescored(2, 50, 75))
+    indexer = make_indexer(chain)
+
+    assert asyncio.run(indexer.sync_once()) == 7
+    index = indexer.index
+    assert index.synced and index.last_block == 10
+    assert index.owner_of("QmFile") == address(7)
+    assert index.file_record("QmFile")["file_name"] == "report.txt"
+    assert index.resolve(address(8), ["QmFile", "QmOther"]) == {"QmFile": "granted"}
+    assert index.resolve(address(9), ["QmFile"]) == {"QmFile": None}
+    assert index.account_files(address(7)) == {file_topic("QmFile"): "owner"}
+    assert index.all_nodes() == [address(1), address(2)]
+    assert index.trusted_nodes() == {address(1): 80, address(2): 75}
+
+def test_checkpoint_round_trip(tmp_path):
+    path = tmp_path / "index.json"
+    chain = ChainStub(10)
+    chain.emit(2, uploaded("QmFile", 7))
+    chain.emit(3, granted("QmFile", 7, 8))
+    indexer = make_indexer(chain, path)
+    asyncio.run(indexer.sync_once())
+    indexer.save_checkpoint()
+
+    restored = make_indexer(chain, path)
+    assert restored.index.last_block == 10
+    assert restored.index.has_access("QmFile", address(8))
+    assert restored.checkpoints == indexer.checkpoints
+    assert restored.genesis == chain.hashes[0]
+
+    # Only blocks after the checkpoint are fetched
+    chain.hashes[11] = chain.block_hash("a", 11)
+    chain.emit(11, revoked("QmFile", 7, 8))
+    assert asyncio.run(restored.sync_once()) == 1
+    assert not restored.index.has_access("QmFile", address(8))
+    assert restored.reorgs == restored.resets == 0
+
+def test_checkpoint_for_another_contract_is_ignored(tmp_path):
+    path = tmp_path / "index.json"
+    chain = ChainStub(10)
+    chain.emit(2, uploaded("QmFile", 7))
+    indexer = make_indexer(chain, path)
+    asyncio.run(indexer.sync_once())
+    indexer.save_checkpoint()
+
+    other = ChainIndexer(chain, "0x" + "cd" * 20, ChainIndex(), str(path))
+    assert other.index.last_block == -1 and other.checkpoints == []
+
+def test_shallow_reorg_rolls_back_journaled_blocks():
+    chain = ChainStub(10)
+    chain.emit(2, uploaded("QmKept", 7))
+    chain.emit(6, uploaded("QmDropped", 7))
+    chain.emit(8, granted("QmKept", 7, 8))
+    indexer = make_indexer(chain, batch_blocks=2)
+    asyncio.run(indexer.sync_once())
+    assert indexer.index.is_registered("QmDropped")
+
+    # Blocks 6.. are replaced; the new branch grants a different account
+    chain.fork(6, "b")
+    chain.emit(7, granted("QmKept", 7, 9))
+    assert asyncio.run(indexer.sync_once()) == 1
+    index = indexer.index
+    assert indexer.reorgs == 1 and indexer.resets == 0
+    assert index.is_registered("QmKept") and not index.is_registered("QmDropped")
+    assert index.resolve(address(8), ["QmKept"]) == {"QmKept": None}
+    assert index.resolve(address(9), ["QmKept"]) == {"QmKept": "granted"}
+    assert index.last_block == 10 and index.synced
+
+def test_restarted_chain_resets_the_index(tmp_path):
+    path = tmp_path / "index.json"
+    chain = ChainStub(500)
+    chain.emit(400, uploaded("QmOld", 7))
+    indexer = make_indexer(chain, path)
+    asyncio.run(indexer.sync_once())
+    indexer.save_checkpoint()
+
+    # A fresh dev chain redeploys to the same address and is still below the checkpoint
+    restarted = ChainStub(3, fork="b")
+    restarted.emit(2, uploaded("QmNew", 7))
+    restored = make_indexer(restarted, path)
+    assert restored.index.is_registered("QmOld")
+
+    assert asyncio.run(restored.sync_once()) == 1
+    index = restored.index
+    assert restored.resets == 1
+    assert not index.is_registered("QmOld") and index.is_registered("QmNew")
+    assert index.last_block == 3 and index.synced
+    assert restored.genesis == restarted.hashes[0]
+
+def test_restarted_chain_past_the_checkpoint_resets_the_index(tmp_path):
+    path = tmp_path / "index.json"
+    chain = ChainStub(5)
+    chain.emit(4, uploaded("QmOld", 7))
+    indexer = make_indexer(chain, path)
+    asyncio.run(indexer.sync_once())
+    indexer.save_checkpoint()
+
+    # Already taller than the checkpoint: only the genesis hash tells the chains apart
+    restarted = ChainStub(20, fork="b")
+    restarted.emit(9, uploaded("QmNew", 7))
+    restored = make_indexer(restarted, path)
+    asyncio.run(restored.sync_once())
+    assert restored.resets == 1
+    assert not restored.index.is_registered("QmOld") and restored.index.is_registered("QmNew")
+
+def test_head_below_checkpoint_resets_the_index():
+    chain = ChainStub(10)
+    chain.emit(2, uploaded("QmKept", 7))
+    chain.emit(8, uploaded("QmDropped", 7))
+    indexer = make_indexer(chain)
+    asyncio.run(indexer.sync_once())
+
+    # Same genesis, but the chain was rewound below the checkpoint
+    for n in range(5, 11):
+        del chain.hashes[n]
+        chain.logs.pop(n, None)
+    asyncio.run(indexer.sync_once())
+    assert indexer.resets == 1
+    assert indexer.index.is_registered("QmKept") and not indexer.index.is_registered("QmDropped")
+    assert indexer.index.last_block == 4
+
+def test_missing_checkpoint_block_resets_the_index():
+    chain = ChainStub(10)
+    chain.emit(2, uploaded("QmOld", 7))
+    indexer = make_indexer(chain)
+    asyncio.run(indexer.sync_once())
+
+    class PrunedChain(ChainStub):
+        async def get_block(self, n):
+            if n == 10:
+                raise BlockNotFound(f"Block {n} not found")
+            return await super().get_block(n)
+
+    pruned = PrunedChain(12)
+    pruned.emit(2, uploaded("QmOld", 7))
+    indexer.chain = pruned
+    indexer._genesis_checked = True
+    asyncio.run(indexer._check_reorg())
+    assert indexer.resets == 1
+    assert indexer.index.last_block == -1 and not indexer.index.synced
+
+def test_reset_clears_synced():
+    index = ChainIndex()
+    index.synced = True
+    index.reset()
+    assert not index.synced
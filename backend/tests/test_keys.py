@@ -0,0 +1,131 @@
+"""KeyManager keyring persistence: rotation, crash recovery, torn appends and sharing between processes"""
+import os
+
+import pytest
+
+from app import keys
+from app.keys import KeyManager, KeyManagementError, load_master_key
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "keyring.jsonl"), str(tmp_path / "master.key")
+
+def open_manager(paths, **kwargs):
+    """KeyManager as a (re)starting process opens it: master key from the keyfile"""
+    keyring_path, keyfile_path = paths
+    return KeyManager(*load_master_key(None, keyfile_path), keyring_path=keyring_path,
+                      keyfile_path=keyfile_path, **kwargs)
+
+def keyring_lines(paths):
+    with open(paths[0], "rb") as f:
+        return f.read().splitlines()
+
+def test_rotate_then_reopen_with_rotated_keyfile(paths):
+    manager = open_manager(paths)
+    key_id, key = manager.create_data_key()
+    base_key = manager.base_key
+    old_id = manager.master_key_id
+
+    new_id = manager.rotate_master_key()
+    assert new_id != old_id
+    assert not os.path.exists(paths[1] + ".new")
+
+    reopened = open_manager(paths)
+    assert reopened.master_key_id == new_id
+    assert reopened.data_key(key_id) == key
+    assert reopened.base_key == base_key
+
+def test_crash_after_keyring_rewrite_completes_rotation(paths, monkeypatch):
+    manager = open_manager(paths)
+    key_id, key = manager.create_data_key()
+    replace = os.replace
+
+    def crash_before_keyfile(src, dst):
+        if dst == paths[1]:
+            raise OSError("crashed")
+        replace(src, dst)
+
+    monkeypatch.setattr(keys.os, "replace", crash_before_keyfile)
+    with pytest.raises(OSError):
+        manager.rotate_master_key()
+    monkeypatch.undo()
+    # The keyring is wrapped under the staged key while the keyfile still holds the old one
+    assert os.path.exists(paths[1] + ".new")
+
+    reopened = open_manager(paths)
+    assert reopened.master_key_id == manager.master_key_id
+    assert not os.path.exists(paths[1] + ".new")
+    assert reopened.data_key(key_id) == key
+    assert open_manager(paths).data_key(key_id) == key
+
+def test_crash_before_keyring_rewrite_keeps_old_master(paths, monkeypatch):
+    manager = open_manager(paths)
+    key_id, key = manager.create_data_key()
+    old_id = manager.master_key_id
+    replace = os.replace
+
+    def crash_before_keyring(src, dst):
+        if dst == paths[0]:
+            raise OSError("crashed")
+        replace(src, dst)
+
+    monkeypatch.setattr(keys.os, "replace", crash_before_keyring)
+    with pytest.raises(OSError):
+        manager.rotate_master_key()
+    monkeypatch.undo()
+
+    reopened = open_manager(paths)
+    assert reopened.master_key_id == old_id
+    assert not os.path.exists(paths[1] + ".new")
+    assert reopened.data_key(key_id) == key
+
+def test_torn_append_is_skipped_and_overwritten(paths):
+    manager = open_manager(paths)
+    key_id, key = manager.create_data_key()
+    with open(paths[0], "ab") as f:
+        f.write(b'{"key_id": "gen-deadbeef", "wrap')  # A writer that crashed mid-line
+
+    reopened = open_manager(paths, generation_uploads=1)
+    assert reopened.data_key(key_id) == key
+    # The next append replaces the torn line instead of gluing onto it
+    other_id, other_key = reopened.create_data_key()
+    assert all(line.endswith(b"}") for line in keyring_lines(paths))
+
+    third = open_manager(paths)
+    assert third.data_key(key_id) == key
+    assert third.data_key(other_id) == other_key
+
+def test_second_manager_sees_keys_appended_by_another(paths):
+    first = open_manager(paths)
+    second = open_manager(paths)
+    key_id, key = first.create_data_key()
+    # Created after `second` read the keyring: found by reloading it
+    assert second.data_key(key_id) == key
+    with pytest.raises(KeyManagementError):
+        second.data_key(os.urandom(8).hex())
+
+def test_upload_keys_share_a_generation_entry(paths):
+    manager = open_manager(paths, generation_uploads=100)
+    lines = len(keyring_lines(paths))
+    issued = [manager.create_data_key() for _ in range(100)]
+
+    assert len({key_id for key_id, _ in issued}) == len(issued)
+    assert len({key for _, key in issued}) == len(issued)
+    assert len(keyring_lines(paths)) == lines + 1
+    # The generation is used up: the next upload starts another one
+    manager.create_data_key()
+    assert len(keyring_lines(paths)) == lines + 2
+    assert manager.stats()["key_generations"] == 2
+
+    reopened = open_manager(paths)
+    assert all(reopened.data_key(key_id) == key for key_id, key in issued)
+
+def test_keys_stored_per_upload_stay_readable(paths):
+    manager = open_manager(paths)
+    # Keyrings written before generations hold one random-id key per upload
+    legacy_id, legacy_key = os.urandom(8).hex(), os.urandom(32)
+    manager._add_key(legacy_id, legacy_key)
+    manager.create_data_key()
+
+    reopened = open_manager(paths)
+    assert reopened.data_key(legacy_id) == legacy_key
@@ -0,0 +1,63 @@
+"""PlacementEngine: replica verification in hedged fetches and placement off the event loop"""
+import asyncio
+
+from app.placement import PlacementEngine
+from app.storage import MemoryFragmentStore
+
+GOOD = b"good payload"
+
+class TrustStub:
+    def __init__(self, trusted):
+        self.trusted = trusted
+        self.scores = {}
+
+    async def trusted_nodes(self):
+        return dict(self.trusted)
+
+    def set_local_score(self, address, score):
+        self.scores[address] = score
+
+def make_engine(trusted, **kwargs):
+    """Engine over in-memory nodes whose verify accepts only GOOD, with trust scores loaded"""
+    nodes = {}
+    engine = PlacementEngine(lambda address: nodes.setdefault(address, MemoryFragmentStore()), TrustStub(trusted),
+                             verify=lambda payload: payload == GOOD, **kwargs)
+    assert asyncio.run(engine.trusted()) == trusted
+    return engine
+
+def test_bad_replica_falls_through_and_is_penalized():
+    trusted = {"best": 100, "other": 50}
+    engine = make_engine(trusted, replication=2)
+    placed = engine.place_many([("key", GOOD)], trusted)
+    assert placed == 1 and sorted(engine.replicas["key"]) == ["best", "other"]
+    engine.node("best").put("key", b"tampered")
+
+    payload = asyncio.run(engine.fetch("key", lambda: b"local"))
+    assert payload == GOOD
+    assert engine.corrupt == 1 and engine.failures == 1 and engine.backup_reads == 1
+    assert engine.trust_cache.scores["best"] < 100
+    engine.close()
+
+def test_every_replica_bad_uses_local_copy():
+    trusted = {"a": 10, "b": 10}
+    engine = make_engine(trusted, replication=2)
+    engine.place_many([("key", GOOD)], trusted)
+    for address in engine.replicas["key"]:
+        engine.node(address).put("key", b"tampered")
+
+    assert asyncio.run(engine.fetch("key", lambda: b"local")) == b"local"
+    assert engine.corrupt == 2 and engine.fallbacks == 1
+    engine.close()
+
+def test_place_many_from_threads_places_each_key_once():
+    trusted = {"a": 10, "b": 20}
+    engine = make_engine(trusted, replication=1)
+
+    async def place():
+        batches = [[(f"key{i}", GOOD) for i in range(start, start + 50)] for start in range(0, 200, 50)]
+        return await asyncio.gather(*(asyncio.to_thread(engine.place_many, batch, trusted) for batch in batches))
+
+    assert sum(asyncio.run(place())) == 200
+    assert len(engine.replicas) == engine.placed == 200
+    assert all(key in engine.node(engine.replicas[key][0]) for key in engine.replicas)
+    engine.close()
@@ -0,0 +1,20 @@
+"""Streamed retrieval through the API"""
+import os
+from urllib.parse import unquote
+
+def test_stream_non_ascii_filename(client):
+    data = os.urandom(70000)
+    uploaded = client.post("/upload", files={"file": ("文件 报告.txt", data)})
+    assert uploaded.status_code == 200, uploaded.text
+
+    response = client.post("/retrieve/" + uploaded.json()["file_hash"], params={"stream": "true"})
+    assert response.status_code == 200
+    assert response.content == data
+    disposition = response.headers["content-disposition"]
+    assert disposition.startswith('attachment; filename=".txt";')
+    assert unquote(disposition.split("filename*=UTF-8''", 1)[1]) == "文件 报告.txt"
+
+def test_content_disposition_fallback(api):
+    assert api.content_disposition("report.pdf") == "attachment; filename=\"report.pdf\"; filename*=UTF-8''report.pdf"
+    assert api.content_disposition('a"b\\c\nd.txt').startswith('attachment; filename="abcd.txt";')
+    assert api.content_disposition("文件").startswith('attachment; filename="download";')
@@ -0,0 +1,124 @@
+"""SegmentFragmentStore: compaction of segments holding deleted and replaced records, and synced writes"""
+import os
+
+import pytest
+
+from app.storage import CatalogLog, SegmentFragmentStore, StorageError
+
+SEGMENT_SIZE = 4096
+
+def open_store(directory):
+    return SegmentFragmentStore(str(directory), segment_size=SEGMENT_SIZE)
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("segment-"))
+
+def fill(store, count, size=1000, prefix="k"):
+    payloads = {f"{prefix}{i}": os.urandom(size) for i in range(count)}
+    for key, data in payloads.items():
+        store.put(key, data)
+    return payloads
+
+def test_compaction_reclaims_dead_segments(tmp_path):
+    store = open_store(tmp_path)
+    payloads = fill(store, 20)
+    for i in range(0, 20, 4):
+        store.put(f"k{i}", payloads[f"k{i}"][::-1])  # Replaced
+        payloads[f"k{i}"] = payloads[f"k{i}"][::-1]
+    for i in range(1, 20, 2):
+        store.delete(f"k{i}")
+        del payloads[f"k{i}"]
+    before = store.stats()
+    files_before = segment_files(tmp_path)
+    bytes_before = sum(os.path.getsize(tmp_path / name) for name in files_before)
+
+    result = store.compact(min_dead_ratio=0.3)
+    assert result["segments"] > 0 and result["reclaimed_bytes"] > 0
+    after = store.stats()
+    assert after["dead_bytes"] == before["dead_bytes"] - result["reclaimed_bytes"]
+    assert after["stored_bytes"] == before["stored_bytes"]
+    assert len(segment_files(tmp_path)) < len(files_before)
+    assert sum(os.path.getsize(tmp_path / name) for name in segment_files(tmp_path)) \
+        == bytes_before - result["reclaimed_bytes"]
+    assert all(store.get(key) == data for key, data in payloads.items())
+    store.close()
+
+    # Replaying the compacted files gives the same contents: deletes stay deleted
+    reopened = open_store(tmp_path)
+    assert sorted(reopened.keys()) == sorted(payloads)
+    assert all(reopened.get(key) == data for key, data in payloads.items())
+    assert reopened.stats()["dead_bytes"] == after["dead_bytes"]
+    reopened.close()
+
+def test_tombstones_survive_while_older_segments_remain(tmp_path):
+    store = open_store(tmp_path)
+    fill(store, 4, size=1100)  # Segment 1
+    store.delete("k0")  # Segment 2 starts with k0's tombstone...
+    fill(store, 4, size=1100, prefix="x")  # ...followed by records deleted below
+    for i in range(4):
+        store.delete(f"x{i}")
+    fill(store, 4, size=1100, prefix="y")
+    assert segment_files(tmp_path) == ["segment-000001.dat", "segment-000002.dat", "segment-000003.dat"]
+
+    # Segment 1 is mostly live and stays, so k0's tombstone must outlive segment 2
+    assert store.compact(min_dead_ratio=0.6)["segments"] == 1
+    assert "segment-000001.dat" in segment_files(tmp_path)
+    assert "segment-000002.dat" not in segment_files(tmp_path)
+    store.close()
+
+    reopened = open_store(tmp_path)
+    assert "k0" not in reopened
+    assert sorted(reopened.keys()) == ["k1", "k2", "k3", "y0", "y1", "y2", "y3"]
+    reopened.close()
+
+def test_compact_active_segment(tmp_path):
+    store = SegmentFragmentStore(str(tmp_path))  # One large segment: never sealed by size
+    payloads = fill(store, 10)
+    for i in range(8):
+        store.delete(f"k{i}")
+    assert store.compact()["segments"] == 0
+    result = store.compact(include_active=True)
+    assert result["segments"] == 1 and store.stats()["dead_bytes"] == 0
+    assert store.get("k9") == payloads["k9"]
+    with pytest.raises(StorageError):
+        store.get("k0")
+    store.close()
+    assert sorted(open_store(tmp_path).keys()) == ["k8", "k9"]
+
+def test_damaged_payload_stays_detectable_after_move(tmp_path):
+    store = open_store(tmp_path)
+    fill(store, 8)
+    path = tmp_path / segment_files(tmp_path)[0]
+    segment_id, offset, length, _ = store._index["k0"]
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(b"\0" * 8)
+    for i in range(1, 4):
+        store.delete(f"k{i}")
+    assert store.compact(min_dead_ratio=0.5)["segments"] >= 1
+    assert store._index["k0"][0] != segment_id
+    with pytest.raises(StorageError):
+        store.get("k0")
+    store.close()
+
+def test_sync_fsyncs_segment_and_catalog_records(tmp_path, monkeypatch):
+    synced = []
+    real_fsync = os.fsync
+    def fsync(fd):
+        synced.append(os.readlink(f"/proc/self/fd/{fd}"))
+        real_fsync(fd)
+    monkeypatch.setattr(os, "fsync", fsync)
+
+    store = SegmentFragmentStore(str(tmp_path / "fragments"), sync=True)
+    catalog = CatalogLog(str(tmp_path / "catalog.log"), sync=True)
+    store.put("k", b"payload")
+    catalog.put("file", {"original_filename": "a.txt"}, [{"storage_key": "k"}])
+    catalog.delete("file")
+    assert [os.path.basename(path) for path in synced] == ["segment-000001.dat", "catalog.log", "catalog.log"]
+
+    synced.clear()
+    unsynced = CatalogLog(str(tmp_path / "unsynced.log"))
+    unsynced.put("file", {}, [])
+    assert synced == []
+    for closing in (store, catalog, unsynced):
+        closing.close()
@@ -0,0 +1,127 @@
+"""SQLite shared state: two workers (catalog and store instances) on one data directory"""
+import multiprocessing
+import os
+
+import pytest
+
+from app.storage import SharedRefCountedStore, SQLiteCatalog, SQLiteFragmentStore
+
+class Worker:
+    """The shared-state objects one worker process opens on a data directory"""
+
+    def __init__(self, data_dir):
+        self.catalog = SQLiteCatalog(os.path.join(data_dir, "catalog.db"))
+        self.store = SharedRefCountedStore(SQLiteFragmentStore(os.path.join(data_dir, "fragments.db")))
+        self.catalog.load()
+
+    def upload(self, file_hash, payloads):
+        """Store payloads ({key: data}) deduplicated, then the catalog entry naming them"""
+        for key, data in payloads.items():
+            if not self.store.acquire(key):
+                self.store.add(key, data)
+        records = [{"storage_key": key} for key in payloads]
+        previous = self.catalog.put(file_hash, {"filename": file_hash}, records)
+        if previous is not None:
+            self.release(previous)
+
+    def delete(self, file_hash):
+        previous = self.catalog.delete(file_hash)
+        if previous is not None:
+            self.release(previous)
+        return previous is not None
+
+    def release(self, records):
+        for record in records:
+            self.store.release(record["storage_key"])
+
+    def close(self):
+        self.catalog.close()
+        self.store.close()
+
+@pytest.fixture
+def workers(tmp_path):
+    first, second = Worker(str(tmp_path)), Worker(str(tmp_path))
+    yield first, second
+    first.close()
+    second.close()
+
+def refs(worker, key):
+    row = worker.store.db.execute("SELECT refs FROM payloads WHERE key = ?", (key,)).fetchone()
+    return row[0] if row is not None else 0
+
+def test_change_feed_carries_upload_and_delete(workers):
+    first, second = workers
+    first.upload("a", {"k1": b"one", "k2": b"two"})
+
+    changes = second.catalog.changes()
+    assert changes == [("a", {"filename": "a"}, [{"storage_key": "k1"}, {"storage_key": "k2"}])]
+    assert second.store.get("k1") == b"one"
+    # A worker's own writes are not fed back to it
+    assert first.catalog.changes() == []
+
+    assert second.delete("a")
+    assert first.catalog.changes() == [("a", None, None)]
+    assert "k1" not in first.store and "k2" not in first.store
+    assert second.catalog.changes() == []
+
+def test_replace_is_seen_with_current_rows(workers):
+    first, second = workers
+    first.upload("a", {"k1": b"one"})
+    first.upload("a", {"k2": b"two"})
+
+    assert second.catalog.changes() == [("a", {"filename": "a"}, [{"storage_key": "k2"}])]
+    assert "k1" not in second.store
+
+def test_concurrent_delete_releases_once(workers):
+    first, second = workers
+    first.upload("a", {"k1": b"one"})
+    second.upload("b", {"k1": b"one"})
+
+    assert first.delete("a")
+    # The file is already gone: the second delete must not release k1 again
+    assert not second.delete("a")
+    assert refs(first, "k1") == 1
+
+def test_dedup_refcount_across_workers(workers):
+    first, second = workers
+    first.upload("a", {"shared": b"payload", "own": b"first"})
+    second.upload("b", {"shared": b"payload"})
+
+    assert refs(first, "shared") == refs(second, "shared") == 2
+    assert first.store.stats()["dedup_hits"] == 1
+
+    # The payload survives until the last worker's file that references it is gone
+    assert first.delete("a")
+    assert refs(second, "shared") == 1
+    assert second.store.get("shared") == b"payload"
+    assert "own" not in second.store
+
+    assert second.delete("b")
+    assert "shared" not in first.store
+    assert first.store.stats()["fragments"] == 0
+
+def add_and_release(data_dir, rounds):
+    worker = Worker(data_dir)
+    try:
+        for _ in range(rounds):
+            worker.store.add("shared", b"payload")
+        for _ in range(rounds // 2):
+            worker.store.release("shared")
+    finally:
+        worker.close()
+
+def test_refcount_from_concurrent_processes(tmp_path):
+    processes = [multiprocessing.get_context("fork").Process(target=add_and_release, args=(str(tmp_path), 200))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    worker = Worker(str(tmp_path))
+    try:
+        assert refs(worker, "shared") == 4 * 100
+        assert worker.store.stats()["references"] == 4 * 100
+    finally:
+        worker.close()
@@ -0,0 +1,52 @@
+"""StripeIndex: payload => erasure stripes lookups kept current as files come and go"""
+import hashlib
+
+from app.catalog import StripeIndex
+from app.fragments import FragmentTable
+
+K, M = 2, 1
+
+def digest(label):
+    return hashlib.sha256(label.encode()).hexdigest()
+
+def erasure_table(labels):
+    """Fragment table of an erasure-coded file: data fragments (labels) in stripes of K, then parity"""
+    records = [{"fragment_id": i + 1, "position": i * 10, "size": 10, "stripe": i // K, "shard": i % K,
+                "original_hash": digest(label)} for i, label in enumerate(labels)]
+    stripes = (len(labels) + K - 1) // K
+    records += [{"fragment_id": len(labels) + stripe + 1, "size": 10, "stripe": stripe, "shard": K, "parity": True,
+                 "original_hash": digest(f"parity-{''.join(labels)}-{stripe}")} for stripe in range(stripes)]
+    return FragmentTable.from_records(records)
+
+def test_every_stripe_holding_a_payload_is_found():
+    index = StripeIndex()
+    # "a" is in stripes 0 and 2 of one file and stripe 0 of another
+    first = erasure_table(["a", "b", "c", "d", "a", "e"])
+    second = erasure_table(["a", "f"])
+    index.add("first", first)
+    index.add("second", second)
+
+    assert sorted(index.stripes(digest("a"))) == [("first", 0), ("first", 2), ("second", 0)]
+    assert index.stripes(digest("d")) == [("first", 1)]
+    assert index.stripes(digest("parity-abcdae-1")) == [("first", 1)]
+    assert index.stripes(digest("missing")) == []
+
+    rows = first.stripe_rows(2)
+    assert [first[row]["original_hash"] for row in rows] == [digest("a"), digest("e"), digest("parity-abcdae-2")]
+
+def test_removal_and_files_without_parity():
+    index = StripeIndex()
+    first = erasure_table(["a", "b"])
+    plain = FragmentTable.from_records([{"fragment_id": 1, "position": 0, "size": 10, "original_hash": digest("a")}])
+    index.add("first", first)
+    index.add("plain", plain)
+    index.add("second", erasure_table(["a", "c"]))
+    assert index.stats() == {"payloads": 5, "stripe_entries": 6}
+
+    index.remove("first", first)
+    assert index.stripes(digest("a")) == [("second", 0)]
+    assert index.stripes(digest("b")) == []
+    assert index.stats() == {"payloads": 3, "stripe_entries": 3}
+
+    rebuilt = StripeIndex.build({"first": first, "plain": plain})
+    assert rebuilt.stripes(digest("a")) == [("first", 0)]
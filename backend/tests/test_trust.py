@@ -0,0 +1,73 @@
+"""TrustCache over the chain index: node isActive from the index, or from the contract for older rows"""
+import asyncio
+
+from eth_abi import encode as abi_encode
+
+from app.indexer import ChainIndex
+from app.trust import TrustCache
+
+def address(n):
+    return f"0x{n:040x}"
+
+def topic(n):
+    return "0x" + "00" * 12 + f"{n:040x}"
+
+class ChainStub:
+    """storageNodes() results by address; counts the calls made"""
+
+    available = True
+
+    def __init__(self, active):
+        self.active = active
+        self.calls = []
+
+    async def batch_call(self, calls):
+        self.calls.extend(calls)
+        return [(node, 80, 0, 0, 0, self.active[node], 0) for _, (node,) in calls]
+
+def indexed(*registrations):
+    index = ChainIndex()
+    for block, (n, score) in enumerate(registrations):
+        index.apply("NodeRegistered", [None, topic(n)], abi_encode(["uint256"], [score]), block)
+    index.synced = True
+    return index
+
+def test_registered_nodes_are_active_without_rpc():
+    index = indexed((1, 80), (2, 90))
+    chain = ChainStub({})
+    cache = TrustCache(chain, index)
+
+    nodes = asyncio.run(cache.nodes())
+    assert [node["active"] for node in nodes] == [True, True]
+    assert chain.calls == []
+    assert index.node_active(address(1)) is True
+
+def test_rows_without_active_flag_ask_the_contract():
+    index = indexed((1, 80), (2, 90), (3, 95))
+    # Checkpointed before isActive was indexed
+    for n in (2, 3):
+        del index.tables["nodes"][address(n)]["active"]
+    chain = ChainStub({address(2): False, address(3): True})
+    cache = TrustCache(chain, index)
+
+    trusted = asyncio.run(cache.trusted_nodes())
+    assert trusted == {address(1): 80, address(3): 95}
+    assert sorted(node for _, (node,) in chain.calls) == [address(2), address(3)]
+
+def test_inactive_rows_are_not_trusted():
+    index = indexed((1, 80), (2, 90))
+    index.tables["nodes"][address(2)]["active"] = False
+    chain = ChainStub({})
+
+    assert asyncio.run(TrustCache(chain, index).trusted_nodes()) == {address(1): 80}
+    assert index.trusted_nodes() == {address(1): 80}
+    assert chain.calls == []
+
+def test_unknown_rows_stay_active_when_the_chain_is_down():
+    index = indexed((1, 80))
+    del index.tables["nodes"][address(1)]["active"]
+    chain = ChainStub({})
+    chain.available = False
+
+    assert asyncio.run(TrustCache(chain, index).trusted_nodes()) == {address(1): 80}
+    assert index.trusted_nodes() == {address(1): 80}
@@ -99,40 +99,36 @@ contract TrustAwareStorage {
         string[] memory fragmentHashes,
         uint256[] memory fragmentSizes
     ) external {
-        require(!files[fileHash].exists, "File already exists");
-        require(fragmentHashes.length == fragmentSizes.length, "Fragment arrays length mismatch");
-        require(fragmentHashes.length > 0, "At least one fragment required");
-        
-        // Create file metadata
-        files[fileHash] = FileMetadata({
-            fileHash: fileHash,
-            owner: msg.sender,
-            timestamp: block.timestamp,
-            fileSize: fileSize,
-            fileName: fileName,
-            exists: true,
-            fragmentIds: new uint256[](fragmentHashes.length)
-        });
+        _registerFile(fileHash, fileName, fileSize, fragmentHashes, fragmentSizes);
+    }
+    
+    /**
+     * @dev Register several files in one transaction (all or none)
+     * @param fileHashes SHA-256 hashes of the original files
+     * @param fileNames Original filenames
+     * @param fileSizes Original file sizes in bytes
+     * @param fragmentHashes Fragment hashes of each file
+     * @param fragmentSizes Fragment sizes of each file
+     */
+    function registerFiles(
+        string[] memory fileHashes,
+        string[] memory fileNames,
+        uint256[] memory fileSizes,
+        string[][] memory fragmentHashes,
+        uint256[][] memory fragmentSizes
+    ) external {
+        require(fileHashes.length > 0, "At least one file required");
+        require(
+            fileNames.length == fileHashes.length &&
+            fileSizes.length == fileHashes.length &&
+            fragmentHashes.length == fileHashes.length &&
+            fragmentSizes.length == fileHashes.length,
+            "File arrays length mismatch"
+        );
         
-        // Register fragments
-        for (uint256 i = 0; i < fragmentHashes.length; i++) {
-            uint256 fragmentId = nextFragmentId++;
-            
-            fragments[fragmentId] = Fragment({
-                fragmentId: fragmentId,
-                fragmentHash: fragmentHashes[i],
-                storageNodes: new address[](0),
-                size: fragmentSizes[i],
-                exists: true
-            });
-            
-            files[fileHash].fragmentIds[i] = fragmentId;
-            
-            // Assign fragment to trusted nodes
-            _assignFragmentToNodes(fragmentId);
+        for (uint256 i = 0; i < fileHashes.length; i++) {
+            _registerFile(fileHashes[i], fileNames[i], fileSizes[i], fragmentHashes[i], fragmentSizes[i]);
         }
-        
-        emit FileUploaded(fileHash, msg.sender, fileName, block.timestamp);
     }
     
     /**
@@ -316,6 +312,52 @@ contract TrustAwareStorage {
     
     // ============ INTERNAL FUNCTIONS ============
     
+    /**
+     * @dev Store a file's metadata and fragments and assign the fragments to trusted nodes
+     */
+    function _registerFile(
+        string memory fileHash,
+        string memory fileName,
+        uint256 fileSize,
+        string[] memory fragmentHashes,
+        uint256[] memory fragmentSizes
+    ) internal {
+        require(!files[fileHash].exists, "File already exists");
+        require(fragmentHashes.length == fragmentSizes.length, "Fragment arrays length mismatch");
+        require(fragmentHashes.length > 0, "At least one fragment required");
+        
+        // Create file metadata
+        files[fileHash] = FileMetadata({
+            fileHash: fileHash,
+            owner: msg.sender,
+            timestamp: block.timestamp,
+            fileSize: fileSize,
+            fileName: fileName,
+            exists: true,
+            fragmentIds: new uint256[](fragmentHashes.length)
+        });
+        
+        // Register fragments
+        for (uint256 i = 0; i < fragmentHashes.length; i++) {
+            uint256 fragmentId = nextFragmentId++;
+            
+            fragments[fragmentId] = Fragment({
+                fragmentId: fragmentId,
+                fragmentHash: fragmentHashes[i],
+                storageNodes: new address[](0),
+                size: fragmentSizes[i],
+                exists: true
+            });
+            
+            files[fileHash].fragmentIds[i] = fragmentId;
+            
+            // Assign fragment to trusted nodes
+            _assignFragmentToNodes(fragmentId);
+        }
+        
+        emit FileUploaded(fileHash, msg.sender, fileName, block.timestamp);
+    }
+    
     /**
      * @dev Assign a fragment to trusted storage nodes
      * @param fragmentId ID of the fragment to assign
@@ -71,5 +71,51 @@ describe("TrustAwareStorage", function () {
       await contract.revokeAccess(fileHash, user1.address);
       expect(await contract.hasFileAccess(fileHash, user1.address)).to.be.false;
     });
+
+    it("Should register several files in one transaction", async function () {
+      const fileHashes = ["0xfile1", "0xfile2"];
+      const fileNames = ["a.txt", "b.txt"];
+      const fileSizes = [1024, 100];
+      const fragmentHashes = [["0xfrag1", "0xfrag2"], ["0xfrag3"]];
+      const fragmentSizes = [[512, 512], [100]];
+
+      const tx = await contract.registerFiles(fileHashes, fileNames, fileSizes, fragmentHashes, fragmentSizes);
+      const receipt = await tx.wait();
+      const uploads = receipt.events.filter((event) => event.event === "FileUploaded");
+      expect(uploads.length).to.equal(2);
+
+      const first = await contract.getFileMetadata("0xfile1");
+      const second = await contract.getFileMetadata("0xfile2");
+      expect(first.owner).to.equal(owner.address);
+      expect(first.fragmentIds.length).to.equal(2);
+      expect(second.fileName).to.equal("b.txt");
+      expect(second.fragmentIds.length).to.equal(1);
+    });
+
+    it("Should reject a batch with a registered file or mismatched arrays", async function () {
+      await contract.registerFile("0xfile1", "a.txt", 1024, ["0xfrag1"], [1024]);
+
+      const expectRevert = async (promise, reason) => {
+        try {
+          await promise;
+        } catch (error) {
+          expect(error.message).to.include(reason);
+          return;
+        }
+        expect.fail(`Expected revert: ${reason}`);
+      };
+
+      await expectRevert(
+        contract.registerFiles(["0xfile2", "0xfile1"], ["b.txt", "a.txt"], [10, 1024], [["0xfrag2"], ["0xfrag1"]], [[10], [1024]]),
+        "File already exists"
+      );
+      // The whole batch was rolled back
+      await expectRevert(contract.getFileMetadata("0xfile2"), "File does not exist");
+
+      await expectRevert(
+        contract.registerFiles(["0xfile2"], ["b.txt", "c.txt"], [10], [["0xfrag2"]], [[10]]),
+        "File arrays length mismatch"
+      );
+    });
   });
 });
\ No newline at end of file
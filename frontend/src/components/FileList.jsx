@@ -21,11 +21,17 @@ const FileList = ({ files, loading, onRefresh, backendUrl }) => {
     setRetrieving(prev => ({ ...prev, [fileHash]: true }));
     
     try {
+      // Request the binary stream; retrieval details arrive as response headers
       const response = await axios.post(`${backendUrl}/retrieve/${fileHash}`, null, {
-        params: { simulate_node_failure: simulateFailure }
+        params: { simulate_node_failure: simulateFailure, stream: true },
+        responseType: 'blob'
       });
 
-      const { file_data, failed_nodes, fragments_used, total_fragments, failed_fragments } = response.data;
+      const headers = response.headers;
+      const failed_fragments = (headers['x-chainvault-failed-fragments'] || '').split(',').filter(Boolean);
+      const failed_nodes = failed_fragments.map((fragment_hash) => ({ fragment_hash }));
+      const fragments_used = Number(headers['x-chainvault-fragments-used']);
+      const total_fragments = Number(headers['x-chainvault-total-fragments']);
       
       // If failures were simulated, notify backend to update trust scores
       if (simulateFailure && failed_nodes && failed_nodes.length > 0) {
@@ -39,14 +45,7 @@ const FileList = ({ files, loading, onRefresh, backendUrl }) => {
         }
       }
       
-      // Convert base64 to blob and download
-      const byteCharacters = atob(file_data);
-      const byteNumbers = new Array(byteCharacters.length);
-      for (let i = 0; i < byteCharacters.length; i++) {
-        byteNumbers[i] = byteCharacters.charCodeAt(i);
-      }
-      const byteArray = new Uint8Array(byteNumbers);
-      const blob = new Blob([byteArray]);
+      const blob = response.data;
       
       // Create download link
       const url = window.URL.createObjectURL(blob);
@@ -78,7 +77,9 @@ const FileList = ({ files, loading, onRefresh, backendUrl }) => {
         ...prev,
         [fileHash]: {
           success: false,
-          error: error.response?.data?.detail || error.message,
+          error: (error.response?.data instanceof Blob
+            ? JSON.parse(await error.response.data.text()).detail
+            : error.response?.data?.detail) || error.message,
           timestamp: new Date().toLocaleString()
         }
       }));